@@ -0,0 +1,339 @@
+import contextlib
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import os
+import shutil
+import subprocess
+import time
+
+# Builds are cached by a hash of the source tree rather than by revision, so
+# that revisions which only differ in files that can't affect the build (docs,
+# tests) share a single entry.  Entries are evicted least-recently-used first
+# once the cache grows past CACHE_BUDGET_GB.
+CACHE_BUDGET_GB = 20
+
+NON_CODE_PATTERNS = [
+    "*.md",
+    "LICENSE*",
+    ".gitignore",
+    ".travis.yml",
+    "docs/*",
+    "test/tests/*",
+    "test/integration/*",
+]
+
+# Written into the build directory so that the next build knows which revision
+# the existing objects came from:
+LAST_BUILD_FILE = ".last_build_revision"
+
+# Compiles happen in a pool of `git worktree`s of the source directory rather
+# than in the source directory itself, so that several investigations or
+# bisections can build at once and the main checkout never gets touched.  The
+# worktrees share the main checkout's object store (and its submodules'), and
+# each one keeps its own build directory, so a worktree that last built a
+# nearby revision only has to recompile what changed.
+WORKTREE_POOL_SIZE = 4
+
+def get_cache_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_builds")
+
+def get_worktrees_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "worktrees")
+
+def get_worktree_src_dir(slot):
+    # The checkout is one level down so that old revisions' build directory,
+    # which is a sibling of the source directory, stays within the slot too.
+    return os.path.join(get_worktrees_dir(), str(slot), "pyston")
+
+def get_build_save_dir(revision):
+    # Where builds were saved before the cache was content-addressed; these
+    # are still used if they exist.
+    return os.path.join(get_cache_dir(), revision)
+
+def is_ancestor(rev1, rev2, src_dir):
+    return subprocess.call(["git", "merge-base", "--is-ancestor", rev1, rev2], cwd=src_dir) == 0
+
+def update_submodules(worktree_dir, src_dir):
+    # Each submodule borrows the objects of the main checkout's copy of it,
+    # when there is one, rather than being cloned from scratch
+    out = subprocess.check_output(["git", "config", "-f", ".gitmodules", "--get-regexp", r"^submodule\..*\.path$"],
+            cwd=worktree_dir) if os.path.exists(os.path.join(worktree_dir, ".gitmodules")) else ""
+    for l in out.split('\n'):
+        if not l:
+            continue
+        path = l.split()[1]
+        args = ["git", "submodule", "update", "--init"]
+        if os.path.exists(os.path.join(src_dir, path, ".git")):
+            args += ["--reference", os.path.abspath(os.path.join(src_dir, path))]
+        subprocess.check_call(args + ["--", path], cwd=worktree_dir)
+
+def checkout(rev, worktree_dir, src_dir):
+    status = subprocess.check_output(["git", "status", "--porcelain", "--untracked=no", "--ignore-submodules"], cwd=worktree_dir)
+    assert not status, "Worktree %s is dirty!" % worktree_dir
+
+    subprocess.check_call(["git", "checkout", "--detach", rev], cwd=worktree_dir)
+    update_submodules(worktree_dir, src_dir)
+
+def _lock_slot(slot):
+    # Returns the open lock file if we got the slot, or None if someone else
+    # (in this or another process) is using it.  The lock goes away with the
+    # file, including when the process dies.
+    f = open(os.path.join(get_worktrees_dir(), "%d.lock" % slot), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError, e:
+        f.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return f
+
+def _checkout_distance(slot, revision):
+    # How many files differ between the slot's checkout and the revision, ie
+    # roughly how much a build there would have to recompile
+    d = get_worktree_src_dir(slot)
+    if not os.path.exists(os.path.join(d, ".git")):
+        return float('inf')
+    try:
+        out = subprocess.check_output(["git", "diff", "--name-only", "HEAD", revision], cwd=d)
+    except subprocess.CalledProcessError:
+        return float('inf')
+    return len(out.split())
+
+# Yields the source directory of a worktree from the pool, checked out at the
+# revision.  Prefers the free worktree that is closest to the revision, and
+# waits if all of them are in use.
+@contextlib.contextmanager
+def worktree(revision, src_dir):
+    if not os.path.exists(get_worktrees_dir()):
+        os.makedirs(get_worktrees_dir())
+
+    slots = sorted(xrange(WORKTREE_POOL_SIZE), key=lambda s: _checkout_distance(s, revision))
+    lock = None
+    while True:
+        for slot in slots:
+            lock = _lock_slot(slot)
+            if lock:
+                break
+        if lock:
+            break
+        print "All %d build worktrees are in use; waiting for one..." % WORKTREE_POOL_SIZE
+        time.sleep(10)
+
+    try:
+        d = get_worktree_src_dir(slot)
+        if not os.path.exists(os.path.join(d, ".git")):
+            # Clear out anything left by an interrupted `git worktree add`:
+            if os.path.exists(os.path.dirname(d)):
+                shutil.rmtree(os.path.dirname(d))
+            subprocess.check_call(["git", "worktree", "prune"], cwd=src_dir)
+            print "Creating build worktree %s" % d
+            subprocess.check_call(["git", "worktree", "add", "--detach", d, revision], cwd=src_dir)
+            update_submodules(d, src_dir)
+        else:
+            checkout(revision, d, src_dir)
+        yield d
+    finally:
+        lock.close()
+
+def cleanup_worktrees(src_dir, keep=0):
+    # Removes the worktrees past the first `keep` (and their build
+    # directories), skipping any that are in use
+    if not os.path.exists(get_worktrees_dir()):
+        return
+    for name in sorted(os.listdir(get_worktrees_dir())):
+        if not name.isdigit() or int(name) < keep:
+            continue
+        slot = int(name)
+        lock = _lock_slot(slot)
+        if not lock:
+            print "Worktree %d is in use, leaving it" % slot
+            continue
+        try:
+            print "Removing build worktree %d" % slot
+            subprocess.call(["git", "worktree", "remove", "--force", get_worktree_src_dir(slot)], cwd=src_dir)
+            shutil.rmtree(os.path.join(get_worktrees_dir(), name), ignore_errors=True)
+            os.remove(os.path.join(get_worktrees_dir(), "%d.lock" % slot))
+        finally:
+            lock.close()
+    subprocess.check_call(["git", "worktree", "prune"], cwd=src_dir)
+
+# Some old revisions need fixes cherry-picked on top of them to build or to run
+# the benchmarks.  These are the same ones that measure_all.sh applies.
+# Returns [(fixup_rev, allow_failure)]
+def get_fixups(revision, src_dir):
+    fixups = []
+    if is_ancestor(revision, "069d309", src_dir):
+        fixups.append(("4c7b796", True))
+
+    if is_ancestor(revision, "c4c58d0d~", src_dir):
+        fixups.append(("c4c58d0d^2", True))
+
+    if is_ancestor(revision, "6fc7a17~", src_dir) and is_ancestor("5e0b10a", revision, src_dir):
+        fixups.append(("6fc7a17", False))
+    return fixups
+
+def apply_fixups(revision, src_dir):
+    for rev, allow_failure in get_fixups(revision, src_dir):
+        if subprocess.call(["git", "cherry-pick", "--no-commit", rev], cwd=src_dir) != 0:
+            assert allow_failure, "Couldn't apply fixup %s" % rev
+            subprocess.check_call(["git", "reset", "--hard"], cwd=src_dir)
+
+def extra_jit_args(revision, src_dir):
+    if is_ancestor(revision, "923e960~", src_dir):
+        return ["-x"]
+    return []
+
+def get_source_key(revision, src_dir):
+    # ls-tree lists the blob hash of every file (and the commit of every
+    # submodule), so this identifies the exact sources that get built.
+    tree = subprocess.check_output(["git", "ls-tree", "-r", "--full-tree", revision], cwd=src_dir)
+    h = hashlib.sha1()
+    for l in tree.split('\n'):
+        if not l:
+            continue
+        path = l.split('\t', 1)[1]
+        if any(fnmatch.fnmatch(path, p) for p in NON_CODE_PATTERNS):
+            continue
+        h.update(l + '\n')
+    for rev, allow_failure in get_fixups(revision, src_dir):
+        h.update("fixup %s\n" % rev)
+    return h.hexdigest()
+
+def _dir_size(d):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(d):
+        for fn in filenames:
+            total += os.lstat(os.path.join(dirpath, fn)).st_size
+    return total
+
+def evict(keep=None):
+    cache_dir = get_cache_dir()
+    if not os.path.exists(cache_dir):
+        return
+
+    # The mtime of an entry is bumped every time it gets used:
+    entries = []
+    for name in os.listdir(cache_dir):
+        d = os.path.join(cache_dir, name)
+        entries.append((os.stat(d).st_mtime, _dir_size(d), d))
+
+    total = sum(size for (mtime, size, d) in entries)
+    budget = CACHE_BUDGET_GB * 1024 ** 3
+    for mtime, size, d in sorted(entries):
+        if total <= budget:
+            break
+        if d == keep:
+            continue
+        print "Evicting %s from the build cache (%.1fMB)" % (d, size / 1024.0 ** 2)
+        shutil.rmtree(d)
+        total -= size
+
+def prepare_build_dir(revision, build_dir, src_dir):
+    # Reuse as much of the previous build as we can: make will pick up the
+    # files that the checkout changed, so we only need to force the steps that
+    # it doesn't track properly.
+    changed = None
+    last_build_fn = os.path.join(build_dir, LAST_BUILD_FILE)
+    if os.path.exists(last_build_fn):
+        last_revision = open(last_build_fn).read().strip()
+        out = subprocess.check_output(["git", "diff", "--name-status", last_revision, revision], cwd=src_dir)
+        changed = [l.split('\t') for l in out.split('\n') if l]
+
+    # cmake globs for source files, so it needs to be rerun when files are added or removed:
+    if changed is None or any(c[0][0] in "ADR" or os.path.basename(c[-1]) == "CMakeLists.txt"
+            or c[-1].endswith(".cmake") for c in changed):
+        os.utime(os.path.join(src_dir, "CMakeLists.txt"), None)
+
+    # distutils doesn't always rebuild the pyston sharedmods when it needs to:
+    if changed is None or any(c[-1].startswith("from_cpython/") or c[-1].endswith(".h") for c in changed):
+        if os.path.exists(build_dir):
+            subprocess.check_call(["find", "-name", "*.pyston.so", "-delete"], cwd=build_dir)
+
+    if os.path.exists(last_build_fn):
+        os.remove(last_build_fn)
+
+# Returns the path to a pyston binary built from the given revision, in one of
+# the worktrees of src_dir.  If cpus is given, the compile is kept to those
+# cpus, ex so that it doesn't disturb benchmarks that are running on the
+# others.
+def build(revision, src_dir, configuration="pyston_release", cpus=None):
+    assert len(revision) == 40, "Please provide a full sha1 hash"
+
+    print "Getting build for %r..." % revision
+
+    legacy_fn = os.path.join(get_build_save_dir(revision), configuration, "pyston")
+    if os.path.exists(legacy_fn):
+        os.utime(get_build_save_dir(revision), None)
+        return legacy_fn
+
+    save_dir = os.path.join(get_cache_dir(), get_source_key(revision, src_dir))
+    this_save_dir = os.path.join(save_dir, configuration)
+    dest_fn = os.path.join(this_save_dir, "pyston")
+    if os.path.exists(dest_fn):
+        os.utime(save_dir, None)
+        return dest_fn
+
+    print "Don't have preexisting build; compiling..."
+
+    with worktree(revision, src_dir) as worktree_dir:
+        # Someone else might have built it while we waited for a worktree:
+        if os.path.exists(dest_fn):
+            os.utime(save_dir, None)
+            return dest_fn
+        _build_in(revision, worktree_dir, configuration, cpus, this_save_dir)
+
+    evict(keep=save_dir)
+    return dest_fn
+
+def _build_in(revision, src_dir, configuration, cpus, this_save_dir):
+    try:
+        apply_fixups(revision, src_dir)
+
+        code = subprocess.call(["git", "merge-base", "--is-ancestor", "bafb715", revision], cwd=src_dir)
+        # If code==0, then this is past the change to move the build directory
+        old_pyston_build_dir = (code!=0)
+
+        if old_pyston_build_dir:
+            build_dir = os.path.join(src_dir, "..", "pyston-build-" + configuration.split('_', 1)[1])
+        else:
+            build_names = {
+                    "pyston_release": "Release",
+                    "pyston_pgo": "Release-gcc-pgo",
+                    }
+            build_dir = os.path.join(src_dir, "build", build_names[configuration])
+
+        prepare_build_dir(revision, build_dir, src_dir)
+
+        make_args = ["make", configuration]
+        if cpus is not None:
+            make_args = ["taskset", "-c", ",".join(str(c) for c in cpus)] + make_args
+        code = subprocess.call(make_args, cwd=src_dir)
+        if code:
+            print "Trying the build again"
+            subprocess.check_call(make_args, cwd=src_dir)
+
+        assert os.path.exists(build_dir), build_dir
+        with open(os.path.join(build_dir, LAST_BUILD_FILE), 'w') as f:
+            f.write(revision + '\n')
+
+        # Copy into a temporary directory first so that an interrupted copy
+        # doesn't leave behind something that looks like a complete build.
+        tmp_dir = "%s.tmp%d" % (this_save_dir, os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        # Copy both the old directories (lib_pyston, from_cpython) and the new one (lib)
+        # to be compatible before and after the path changes.
+        for d in ["lib_pyston", "from_cpython", "lib"]:
+            if os.path.exists(os.path.join(build_dir, d)):
+                shutil.copytree(os.path.join(build_dir, d), os.path.join(tmp_dir, d))
+        shutil.copy(os.path.join(build_dir, "pyston"), os.path.join(tmp_dir, "pyston"))
+        if os.path.exists(this_save_dir):
+            shutil.rmtree(this_save_dir)
+        os.rename(tmp_dir, this_save_dir)
+    finally:
+        # Throw away any fixups:
+        subprocess.check_call(["git", "reset", "--hard"], cwd=src_dir)
@@ -1,11 +1,26 @@
+import argparse
+import csv
+import json
 import os
 import shutil
 import subprocess
 import sys
+import threading
 import time
 import traceback
 
 import model
+import profiles
+from builds import build, cleanup_worktrees
+
+# This goes after the imports of our own modules, since the benchmarking
+# directory has its own (different) model.py:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../benchmarking"))
+import pyston_stats
+import registry
+import scheduler
+import scoring
+import stats
 
 CONFIGURATION = "pyston_release"
 
@@ -15,100 +30,17 @@ try:
 except ImportError:
     pass
 
-def get_build_save_dir(revision):
-    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_builds", revision)
-
 def get_run_save_dir(run_id):
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_runs", str(run_id))
 
-def build(revision, src_dir):
-    assert len(revision) == 40, "Please provide a full sha1 hash"
-
-    print "Getting build for %r..." % revision
-
-    save_dir = get_build_save_dir(revision)
-
-    on_new_rev = False
-    old_revision = []
-
-    def gotorev(rev):
-        status = subprocess.check_output(["git", "status", "--porcelain", "--untracked=no", "--ignore-submodules"], cwd=src_dir)
-        assert not status, "Source directory is dirty!"
-
-        old_revision.append(subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=src_dir).strip())
-
-        subprocess.check_call(["git", "checkout", rev], cwd=src_dir)
-        subprocess.check_call(["git", "submodule", "update"], cwd=src_dir)
-        print "doing `git submodule update`"
-
-        os.utime(os.path.join(src_dir, "CMakeLists.txt"), None)
-
-    try:
-        r = None
-
-        build_types = [CONFIGURATION]
-        # build_types = ["pyston_release", "pyston_dbg"]
-
-        for build_type in build_types:
-            this_save_dir = os.path.join(save_dir, build_type)
-            if not os.path.exists(this_save_dir):
-                os.makedirs(this_save_dir)
-
-            dest_fn = os.path.join(this_save_dir, "pyston")
-            if build_type == CONFIGURATION:
-                r = dest_fn
-
-            if os.path.exists(dest_fn):
-                continue
-
-            print "Don't have preexisting build; compiling..."
-
-            if not on_new_rev:
-                on_new_rev = True
-                gotorev(revision)
-
-            code = subprocess.call(["git", "merge-base", "--is-ancestor", "bafb715", revision], cwd=src_dir)
-            # If code==0, then this is past the change to move the build directory
-            old_pyston_build_dir = (code!=0)
-
-            if old_pyston_build_dir:
-                build_dir = os.path.join(src_dir, "..", "pyston-build-" + build_type.split('_', 1)[1])
-            else:
-                build_names = {
-                        "pyston_release": "Release",
-                        "pyston_pgo": "Release-gcc-pgo",
-                        }
-                build_dir = os.path.join(src_dir, "build", build_names[build_type])
-
-            if os.path.exists(build_dir):
-                # distutils doesn't always rebuild the pyston sharedmods when it needs to:
-                subprocess.check_call(["find", "-name", "*.pyston.so", "-delete"], cwd=build_dir)
-
-            code = subprocess.call(["make", build_type], cwd=src_dir)
-            if code:
-                print "Trying the build again"
-                subprocess.check_call(["make", build_type], cwd=src_dir)
-
-            assert os.path.exists(build_dir), build_dir
-            # Copy both the old directories (lib_pyston, from_cpython) and the new one (lib)
-            # to be compatible before and after the path changes.
-            for d in ["lib_pyston", "from_cpython", "lib"]:
-                if os.path.exists(os.path.join(build_dir, d)):
-                    shutil.copytree(os.path.join(build_dir, d), os.path.join(this_save_dir, d))
-            shutil.copy(os.path.join(build_dir, "pyston"), dest_fn)
-        return r
-    finally:
-        if on_new_rev and old_revision:
-            print "Going back to", old_revision[0]
-            gotorev(old_revision[0])
-
 SRC_DIR = os.path.join(os.path.dirname(__file__), "../../pyston")
 BENCHMARKS_DIR = os.path.join(os.path.dirname(__file__), "../benchmarking/benchmark_suite")
 
-def run_test(revision, benchmark):
-    fn = build(revision, SRC_DIR)
-    bm_fn = os.path.abspath(os.path.join(BENCHMARKS_DIR, benchmark))
+RUN_PERF = True
 
+# A run is split into three steps so that the middle one, which doesn't touch
+# the database, can happen on another thread (see pipelined_runs).
+def start_run(revision, benchmark):
     run_id = model.add_run(revision, CONFIGURATION, benchmark)
     print "Starting run", run_id
 
@@ -117,41 +49,60 @@ def run_test(revision, benchmark):
         os.makedirs(save_dir)
 
     print "In %r" % save_dir
+    return run_id
 
-    run_perf = True
-
-    # This option changed from "-s" to "-T" in d1e16e8
-    STATS_OPTION = "-T"
+# home, if given, is the HOME that the run sees, which is where pyston keeps
+# its cache (see pipelined_runs)
+def execute_run(fn, benchmark, save_dir, cpus=None, home=None):
+    # Returns (elapsed, exitcode, out, err)
+    bm_fn = os.path.abspath(os.path.join(BENCHMARKS_DIR, benchmark))
 
-    args = [fn, STATS_OPTION, bm_fn]
-    if run_perf:
+    args = [fn, pyston_stats.STATS_OPTION, bm_fn]
+    if RUN_PERF:
         args = ["perf", "record", "-g", "-o", "perf.data", "--"] + args
+    args = scheduler.pin_args(cpus, args)
 
     print args
 
+    env = dict(os.environ)
+    if home:
+        env["HOME"] = home
+
     start = time.time()
-    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=save_dir)
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=save_dir, env=env)
     out, err = p.communicate()
     exitcode = p.wait()
     elapsed = time.time() - start
 
-    model.set_metadata(run_id, "has_perf", run_perf)
-    model.set_metadata(run_id, "elapsed", elapsed)
-    model.set_metadata(run_id, "exitcode", exitcode)
-
     with open(os.path.join(save_dir, "out.log"), 'w') as f:
         f.write(out)
 
     with open(os.path.join(save_dir, "err.log"), 'w') as f:
         f.write(err)
 
-    print "Took %.1fs, and exited with code %s" % (elapsed, exitcode)
+    return elapsed, exitcode, out, err
+
+def finish_run(run_id, elapsed, exitcode, out, err):
+    model.set_metadata(run_id, "has_perf", RUN_PERF)
+    model.set_metadata(run_id, "elapsed", elapsed)
+    model.set_metadata(run_id, "exitcode", exitcode)
+
+    print "Run %d took %.1fs, and exited with code %s" % (run_id, elapsed, exitcode)
     if exitcode != 0:
         print out
         print err
+    elif RUN_PERF:
+        profiles.import_run(run_id, get_run_save_dir(run_id))
 
+def run_test(revision, benchmark):
+    fn = build(revision, SRC_DIR, CONFIGURATION)
+    run_id = start_run(revision, benchmark)
+    finish_run(run_id, *execute_run(fn, benchmark, get_run_save_dir(run_id)))
     return run_id
 
+def get_run_profile(run_id):
+    return profiles.get_profile(run_id, get_run_save_dir(run_id))
+
 def remove_run(run_id):
     print "Removing run", run_id
     model.delete_run(run_id)
@@ -159,16 +110,118 @@ def remove_run(run_id):
     if os.path.exists(dir):
         shutil.rmtree(dir)
 
-def do_three_runs(rev, benchmark):
+def clear_cache():
     # Forcibly removing the cache improves performance consistency:
     cache_dir = os.path.expanduser("~/.cache/pyston")
     if os.path.exists(cache_dir):
         shutil.rmtree(cache_dir)
+
+def do_three_runs(rev, benchmark):
+    clear_cache()
     r = run_test(rev, benchmark)
     remove_run(r)
     run_test(rev, benchmark)
     run_test(rev, benchmark)
 
+def get_pipeline_cpus():
+    # Returns ([cpus of each of the two run slots], cpus for building): one
+    # physical core per slot, preferring isolated ones and staying off of cpu
+    # 0, and everything that doesn't share a core with those for the builds.
+    cores = scheduler.get_physical_cores()
+    isolated = set(scheduler.get_isolated_cpus())
+    cores.sort(key=lambda c: (c in isolated, c != 0))
+    assert len(cores) >= 3, "Need at least 3 free physical cores to pipeline, have %d" % len(cores)
+    slots = [[cores[-1]], [cores[-2]]]
+    busy = set(scheduler.get_thread_siblings(cores[-1]) + scheduler.get_thread_siblings(cores[-2]))
+    build_cpus = [c for c in scheduler.get_allowed_cpus() if c not in busy]
+    return slots, build_cpus
+
+def get_cache_home(rev):
+    # The HOME, and so the pyston cache, that pipelined runs of a revision use
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_homes", rev)
+
+# Does `runs` runs of each benchmark on both revisions, overlapping as much
+# of the work as we can:
+# - rev2 gets built (on cpus of its own) while rev1 is doing its warmup runs,
+#   which get thrown away anyway so it doesn't matter that the build disturbs
+#   them
+# - the runs go in pairs, one of each revision at the same time on two
+#   separate pinned cores, so that drift in the machine's speed affects both
+#   sides equally.  The revisions swap cores every round in case one core is
+#   faster than the other.
+# Each revision gets its own pyston cache, and two runs of the same revision
+# never happen at once, so the runs can't see or race on each other's cache
+# entries.  With warmup, the caches start out empty like in do_three_runs;
+# otherwise only the benchmarks that haven't warmed up their revision's cache
+# yet get a warmup run.
+# The results get recorded as each run finishes; only this thread touches the
+# database.
+def pipelined_runs(rev1, rev2, benchmarks, runs, warmup=True):
+    slots, build_cpus = get_pipeline_cpus()
+
+    warmed_fn = lambda rev, b: os.path.join(get_cache_home(rev), ".warmed_" + b)
+    for rev in (rev1, rev2):
+        if warmup and os.path.exists(get_cache_home(rev)):
+            shutil.rmtree(get_cache_home(rev))
+        if not os.path.exists(get_cache_home(rev)):
+            os.makedirs(get_cache_home(rev))
+
+    builds = {rev1: scheduler.Result(), rev2: scheduler.Result()}
+    def build_all():
+        for rev in (rev1, rev2):
+            try:
+                builds[rev].set(build(rev, SRC_DIR, CONFIGURATION, cpus=build_cpus))
+            except Exception:
+                builds[rev].set_exception(sys.exc_info())
+    builder = threading.Thread(target=build_all)
+    builder.daemon = True
+    builder.start()
+
+    # Each round is a list of (revision, benchmark, is_warmup) jobs, one per
+    # slot.  The warmups go one at a time since they share their revision's
+    # cache.
+    rounds = []
+    for rev in (rev1, rev2):
+        rounds += [[(rev, b, True)] for b in benchmarks if not os.path.exists(warmed_fn(rev, b))]
+    for i in xrange(runs):
+        for b in benchmarks:
+            pair = [(rev1, b, False), (rev2, b, False)]
+            rounds.append(pair if i % 2 == 0 else pair[::-1])
+
+    try:
+        for jobs in rounds:
+            # This is where we wait for the builds:
+            fns = [builds[rev].get() for (rev, b, is_warmup) in jobs]
+
+            running = []
+            for (rev, b, is_warmup), fn, cpus in zip(jobs, fns, slots):
+                run_id = start_run(rev, b)
+                r = scheduler.Result()
+                def execute(fn=fn, b=b, run_id=run_id, cpus=cpus, r=r, home=get_cache_home(rev)):
+                    try:
+                        r.set(execute_run(fn, b, get_run_save_dir(run_id), cpus, home))
+                    except Exception:
+                        r.set_exception(sys.exc_info())
+                t = threading.Thread(target=execute)
+                t.daemon = True
+                t.start()
+                running.append((run_id, is_warmup, r))
+
+            for (rev, b, is_warmup), (run_id, _, r) in zip(jobs, running):
+                model.set_metadata(run_id, "pipelined", 1)
+                finish_run(run_id, *r.get())
+                if is_warmup:
+                    remove_run(run_id)
+                    open(warmed_fn(rev, b), 'w').close()
+    finally:
+        # Don't leave a build going in the source directory behind us:
+        builder.join()
+
+# Pipelined runs have the other revision running next to them, so they only get
+# compared against other pipelined runs
+def is_pipelined(run):
+    return getattr(run.md, "pipelined", 0) == 1
+
 def compareBenchmark(rev1, rev2, benchmark):
     rev1_pretty = rev1[:18]
     rev2_pretty = rev2[:18]
@@ -207,6 +260,8 @@ def compareBenchmark(rev1, rev2, benchmark):
         print "p RUN_ID: go to perf report"
         print "stdout RUN_ID: view the stdout of run.  [stderr also available]"
         print "stderrdiff RUN1 RUN2: diff the stderrs."
+        print "pd RUN1 RUN2: diff the profiles of two runs"
+        print "rpd: diff the profiles of all the runs of the two revisions"
         cmd = raw_input("What would you like to do? ")
         try:
             args = cmd.split()
@@ -248,9 +303,15 @@ def compareBenchmark(rev1, rev2, benchmark):
                 assert len(args) == 2
                 run_id1 = int(args[0])
                 run_id2 = int(args[1])
-                subprocess.check_call("perf report -i %s/perf.data -n --no-call-graph | bash %s/tools/cumulate.sh > perf1.txt" % (get_run_save_dir(run_id1), SRC_DIR), shell=True)
-                subprocess.check_call("perf report -i %s/perf.data -n --no-call-graph | bash %s/tools/cumulate.sh > perf2.txt" % (get_run_save_dir(run_id2), SRC_DIR), shell=True)
-                subprocess.check_call(["python", "%s/tools/perf_diff.py" % SRC_DIR, "perf1.txt", "perf2.txt"])
+                profiles.write_diff(get_run_profile(run_id1), get_run_profile(run_id2),
+                        "%s: run %d vs run %d" % (benchmark, run_id1, run_id2),
+                        "flamegraph_%d_%d.svg" % (run_id1, run_id2))
+            elif cmd == 'rpd':
+                assert not args
+                profile1 = profiles.merge(get_run_profile(r.id) for r in get_runs(rev1, benchmark) if not r.md.exitcode)
+                profile2 = profiles.merge(get_run_profile(r.id) for r in get_runs(rev2, benchmark) if not r.md.exitcode)
+                profiles.write_diff(profile1, profile2, "%s: %s vs %s" % (benchmark, rev1_pretty, rev2_pretty),
+                        "flamegraph_%s_%s_%s.svg" % (benchmark[:-3], rev1[:8], rev2[:8]))
             elif cmd == 'q':
                 break
             else:
@@ -279,40 +340,12 @@ def compareBenchmark(rev1, rev2, benchmark):
     print "Avg time: %+.1f%%" % ((sum(elapsed2) / len(elapsed2) / sum(elapsed1) * len(elapsed1)- 1) * 100.0)
     print runs1, runs2
 
-BENCHMARKS = [
-    "django_template3.py",
-    "pyxl_bench.py",
-    "sqlalchemy_imperative2.py",
-    "pyxl_bench2.py",
-    "pyxl_bench_10x.py",
-    "django_template3_10x.py",
-    "sqlalchemy_imperative2_10x.py",
-    "pyxl_bench2_10x.py",
-    ]
-
-UNAVERAGED_BENCHMARKS = [
-    "django_template3_10x.py",
-    "django_template2.py",
-    "django_template.py",
-    "django_lexing.py",
-    "django_migrate.py",
-    "virtualenv_bench.py",
-    ]
+BENCHMARKS = registry.in_group("investigate")
+UNAVERAGED_BENCHMARKS = registry.in_group("investigate_unaveraged")
 
 # BENCHMARKS += UNAVERAGED_BENCHMARKS
 
-MICROBENCHMARKS = [
-    "interp2.py",
-    "raytrace.py",
-    "nbody.py",
-    "fannkuch.py",
-    # "chaos.py",
-    "fasta.py",
-    "pidigits.py",
-    "richards.py",
-    "deltablue.py",
-    "sre_compile_ubench.py",
-    ]
+MICROBENCHMARKS = registry.in_group("micro")
 
 # BENCHMARKS += MICROBENCHMARKS
 
@@ -359,38 +392,38 @@ def compareAll(rev1, rev2):
                 return "N/A"
             return "%.1fs (%d)" % (self.min(), self.count())
 
+    # Whether we are showing the pipelined runs or the serial ones
+    pipelined = False
     while True:
         stats1 = {b:Stats() for b in BENCHMARKS}
         stats2 = {b:Stats() for b in BENCHMARKS}
 
         for r in get_runs(rev1):
-            if r.benchmark in stats1:
+            if r.benchmark in stats1 and is_pipelined(r) == pipelined:
                 stats1[r.benchmark].add(r)
         for r in get_runs(rev2):
-            if r.benchmark in stats2:
+            if r.benchmark in stats2 and is_pipelined(r) == pipelined:
                 stats2[r.benchmark].add(r)
 
-        print "% 30s % 19s: % 19s:" % ("", rev1_pretty, rev2_pretty)
+        print "% 30s % 19s: % 19s:" % ("pipelined runs" if pipelined else "", rev1_pretty, rev2_pretty)
 
-        prod1 = 1.0
-        prod2 = 1.0
-        prod_count = 0
+        mins1 = {}
+        mins2 = {}
 
         for b in BENCHMARKS:
             s1 = stats1[b]
             s2 = stats2[b]
             print "% 30s % 20s % 20s" % (b, s1.format(), s2.format()),
             if s1.count() and s2.count():
-                prod1 *= s1.min()
-                prod2 *= s2.min()
-                prod_count += 1
+                mins1[b] = s1.min()
+                mins2[b] = s2.min()
                 diff = (s2.min() - s1.min()) / (s1.min())
                 print " %+0.1f%%" % (100.0 * diff),
             print
 
-        if prod_count:
-            geo1 = prod1 ** (1.0 / prod_count)
-            geo2 = prod2 ** (1.0 / prod_count)
+        if mins1:
+            geo1 = scoring.geomean(mins1)
+            geo2 = scoring.geomean(mins2)
             print "% 30s % 19.1fs % 19.1fs" % ("geomean", geo1, geo2),
             diff = (geo2 - geo1) / (geo1)
             print " %+0.1f%%" % (100.0 * diff)
@@ -399,6 +432,8 @@ def compareAll(rev1, rev2):
         print "Commands:"
         print "a: do 2 more runs of %s" % rev1_pretty
         print "b: do 2 more runs of %s" % rev2_pretty
+        print "p: do 2 more runs of both, in parallel"
+        print "t: switch between showing the serial and the pipelined runs"
         print "d BENCH: detailed view of benchmark"
         cmd = raw_input("What would you like to do? ")
         try:
@@ -408,10 +443,17 @@ def compareAll(rev1, rev2):
             if cmd in ['a', 'b', 'A', 'B']:
                 assert not args
                 rev = rev1 if (cmd.lower() == 'a') else rev2
-                stats = stats1 if (cmd.lower() == 'a') else stats2
                 for b in BENCHMARKS:
-                    if cmd.islower() or stats[b].count() < 2:
+                    if cmd.islower() or len(get_elapsed(rev, b)) < 2:
                         do_three_runs(rev, b)
+                pipelined = False
+            elif cmd == 'p':
+                assert not args
+                pipelined_runs(rev1, rev2, BENCHMARKS, 2, warmup=False)
+                pipelined = True
+            elif cmd == 't':
+                assert not args
+                pipelined = not pipelined
             elif cmd == 'd':
                 assert len(args) == 1
                 b = args[0]
@@ -431,11 +473,223 @@ def compareAll(rev1, rev2):
 
 
 
+# Non-interactive version of compareAll, for gating merges on: keeps adding runs
+# of both revisions until each benchmark's difference is significant or it runs
+# out of runs, and then gives a verdict.  The verdicts are also the exit codes
+# of --batch.
+NOT_SLOWER = 0
+SLOWER = 1
+ERROR = 2
+VERDICT_NAMES = {NOT_SLOWER: "not slower", SLOWER: "slower", ERROR: "error"}
+
+# How many failed runs of a benchmark we put up with before giving up on it
+MAX_FAILURES = 3
+
+def get_elapsed(rev, benchmark, pipelined=False):
+    # The times of the runs that finished successfully, out of either the
+    # serial runs or the pipelined ones
+    return [r.md.elapsed for r in get_runs(rev, benchmark)
+            if getattr(r.md, "exitcode", None) == 0 and is_pipelined(r) == pipelined]
+
+def compare_times(times1, times2, threshold, alpha):
+    # Returns (relative change in the min time, p-value, "slower"/"faster"/"same")
+    change = (min(times2) - min(times1)) / min(times1)
+    p = stats.mann_whitney(times1, times2)[1] if len(times1) > 1 and len(times2) > 1 else 1.0
+    if p < alpha and change > threshold:
+        return change, p, "slower"
+    if p < alpha and change < -threshold:
+        return change, p, "faster"
+    return change, p, "same"
+
+def batch_compare_benchmark(rev1, rev2, benchmark, threshold, alpha, min_runs, max_runs, pipeline=False):
+    while True:
+        times1 = get_elapsed(rev1, benchmark, pipeline)
+        times2 = get_elapsed(rev2, benchmark, pipeline)
+        n = min(len(times1), len(times2))
+        if n >= min_runs:
+            change, p, verdict = compare_times(times1, times2, threshold, alpha)
+            if p < alpha or n >= max_runs:
+                break
+
+        failures = [r for r in get_runs(rev1, benchmark) + get_runs(rev2, benchmark)
+                if getattr(r.md, "exitcode", None) != 0 and is_pipelined(r) == pipeline]
+        if len(failures) >= MAX_FAILURES:
+            print "%s failed %d times, giving up on it" % (benchmark, len(failures))
+            return None
+
+        if pipeline:
+            pipelined_runs(rev1, rev2, [benchmark], 1, warmup=False)
+            continue
+
+        # Add a run of whichever revisions are behind, so that the two get
+        # interleaved and drift in the machine's speed affects both the same:
+        for rev, times in ((rev1, times1), (rev2, times2)):
+            if len(times) > n:
+                continue
+            if all(is_pipelined(r) for r in get_runs(rev, benchmark)):
+                do_three_runs(rev, benchmark)
+            else:
+                run_test(rev, benchmark)
+
+    return {
+        "benchmark": benchmark,
+        "n1": len(times1),
+        "n2": len(times2),
+        "min1": min(times1),
+        "min2": min(times2),
+        "median1": stats.median(times1),
+        "median2": stats.median(times2),
+        "change": change,
+        "p": p,
+        "verdict": verdict,
+    }
+
+def batch_compare(rev1, rev2, benchmarks, threshold, alpha, min_runs, max_runs, pipeline=False):
+    rev1 = subprocess.check_output(["git", "rev-parse", rev1], cwd=SRC_DIR).strip()
+    rev2 = subprocess.check_output(["git", "rev-parse", rev2], cwd=SRC_DIR).strip()
+
+    for r in get_runs(rev1) + get_runs(rev2):
+        if not hasattr(r.md, "exitcode"):
+            print "Removing unfinished benchmark run %d" % r.id
+            remove_run(r.id)
+
+    if pipeline:
+        # Get the first min_runs of everything in one go, so that the second
+        # build overlaps with all of the warmups:
+        new = [b for b in benchmarks
+                if not any(is_pipelined(r) for r in get_runs(rev1, b) + get_runs(rev2, b))]
+        if new:
+            try:
+                pipelined_runs(rev1, rev2, new, min_runs)
+            except Exception:
+                traceback.print_exc()
+
+    results = []
+    verdict = NOT_SLOWER
+    for b in benchmarks:
+        try:
+            r = batch_compare_benchmark(rev1, rev2, b, threshold, alpha, min_runs, max_runs, pipeline)
+        except Exception:
+            traceback.print_exc()
+            r = None
+        if r is None:
+            verdict = ERROR
+            continue
+        results.append(r)
+        if r["verdict"] == "slower" and verdict != ERROR:
+            verdict = SLOWER
+
+    summary = {
+        "rev1": rev1,
+        "rev2": rev2,
+        "threshold": threshold,
+        "alpha": alpha,
+        "verdict": VERDICT_NAMES[verdict],
+        "benchmarks": results,
+    }
+    if results:
+        geo1 = scoring.geomean(dict((r["benchmark"], r["min1"]) for r in results))
+        geo2 = scoring.geomean(dict((r["benchmark"], r["min2"]) for r in results))
+        summary["geomean"] = {"min1": geo1, "min2": geo2, "change": (geo2 - geo1) / geo1}
+    return verdict, summary
+
+CSV_FIELDS = ["benchmark", "n1", "n2", "min1", "min2", "median1", "median2", "change", "p", "verdict"]
+
+def print_summary(summary):
+    print "% 30s % 8s % 8s % 8s % 8s  %s" % ("", summary["rev1"][:8], summary["rev2"][:8], "change", "p", "")
+    for r in summary["benchmarks"]:
+        print "% 30s % 7.2fs % 7.2fs %+7.1f%% % 8.3f  %s (n=%d, %d)" % (r["benchmark"], r["min1"], r["min2"],
+                r["change"] * 100, r["p"], r["verdict"], r["n1"], r["n2"])
+    if "geomean" in summary:
+        g = summary["geomean"]
+        print "% 30s % 7.2fs % 7.2fs %+7.1f%%" % ("geomean", g["min1"], g["min2"], g["change"] * 100)
+    print "Verdict: %s" % summary["verdict"]
+
+def write_summary(summary, json_fn, csv_fn):
+    if json_fn:
+        with open(json_fn, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    if csv_fn:
+        with open(csv_fn, 'w') as f:
+            writer = csv.DictWriter(f, CSV_FIELDS)
+            writer.writeheader()
+            for r in summary["benchmarks"]:
+                writer.writerow(r)
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="investigate.py --batch")
+    parser.add_argument("rev1")
+    parser.add_argument("rev2")
+    parser.add_argument("--benchmark", dest="benchmarks", action="append",
+            help="Which benchmarks to compare (default: the main ones)")
+    parser.add_argument("--threshold", dest="threshold", action="store", default="1%",
+            help="How much slower rev2 has to be to count as slower")
+    parser.add_argument("--alpha", dest="alpha", action="store", default=0.05, type=float)
+    parser.add_argument("--min-runs", dest="min_runs", action="store", default=3, type=int)
+    parser.add_argument("--max-runs", dest="max_runs", action="store", default=10, type=int)
+    parser.add_argument("--pipeline", dest="pipeline", action="store_true",
+            help="Build rev2 during rev1's warmups, and run the two revisions side by side on separate cores")
+    parser.add_argument("--json", dest="json", action="store", help="Write the results to this file as JSON")
+    parser.add_argument("--csv", dest="csv", action="store", help="Write the results to this file as CSV")
+    args = parser.parse_args(argv)
+
+    benchmarks = args.benchmarks or registry.in_group("main")
+    verdict, summary = batch_compare(args.rev1, args.rev2, benchmarks, stats.parse_percentage(args.threshold),
+            args.alpha, args.min_runs, args.max_runs, args.pipeline)
+    print_summary(summary)
+    write_summary(summary, args.json, args.csv)
+    return verdict
+
+# How much slower (or for a suspected improvement, faster) the revision has to
+# be than its parent for a queued suspect to count as confirmed
+CONFIRM_THRESHOLD = 0.01
+
+def run_queue():
+    for queue_id, parent, revision, benchmark, reason, direction in model.get_queued():
+        print "Confirming %s (%s vs %s)" % (reason, parent[:12], revision[:12])
+        times = []
+        for rev in (parent, revision):
+            if len(get_elapsed(rev, benchmark)) < 2:
+                do_three_runs(rev, benchmark)
+            elapsed = get_elapsed(rev, benchmark)
+            times.append(min(elapsed) if elapsed else None)
+
+        if None in times:
+            print "Couldn't run %s on both revisions" % benchmark
+            model.finish_queued(queue_id, "failed", None)
+            continue
+        change = (times[1] - times[0]) / times[0]
+        state = "confirmed" if change * direction > CONFIRM_THRESHOLD else "not confirmed"
+        print "%s: %.2fs -> %.2fs (%+.1f%%): %s" % (benchmark, times[0], times[1], change * 100, state)
+        model.finish_queued(queue_id, state, change)
+
 if __name__ == "__main__":
     if sys.argv[1] == '--pgo':
         CONFIGURATION = "pyston_pgo"
         del sys.argv[1]
 
+    if sys.argv[1] == '--enqueue':
+        assert len(sys.argv) in (6, 7), "--enqueue PARENT REVISION BENCHMARK REASON [slower|faster]"
+        parent, revision = [subprocess.check_output(["git", "rev-parse", r], cwd=SRC_DIR).strip()
+                for r in sys.argv[2:4]]
+        direction = sys.argv[6] if len(sys.argv) == 7 else "slower"
+        assert direction in ("slower", "faster"), direction
+        if model.enqueue(parent, revision, sys.argv[4], sys.argv[5], 1 if direction == "slower" else -1):
+            print "Queued %s" % sys.argv[5]
+        sys.exit(0)
+
+    if sys.argv[1] == '--run-queue':
+        run_queue()
+        sys.exit(0)
+
+    if sys.argv[1] == '--cleanup-worktrees':
+        assert len(sys.argv) in (2, 3), "--cleanup-worktrees [NUMBER_TO_KEEP]"
+        cleanup_worktrees(SRC_DIR, int(sys.argv[2]) if len(sys.argv) == 3 else 0)
+        sys.exit(0)
+
+    if sys.argv[1] == '--batch':
+        sys.exit(batch_main(sys.argv[2:]))
+
     assert len(sys.argv) in (3,4)
     rev1 = sys.argv[1]
     rev2 = sys.argv[2]
@@ -16,6 +16,34 @@ conn.cursor().execute("""CREATE TABLE IF NOT EXISTS metadata
         PRIMARY KEY (run_id, type),
         FOREIGN KEY (run_id) REFERENCES runs(id)
         )""")
+# Folded profile stacks (see profiles.py); the stacks themselves are shared
+# between runs, since most of them show up in every run of a benchmark.
+conn.cursor().execute("""CREATE TABLE IF NOT EXISTS stacks
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stack TEXT UNIQUE)""")
+conn.cursor().execute("""CREATE TABLE IF NOT EXISTS profiles
+        (run_id INTEGER,
+        stack_id INTEGER,
+        count INTEGER,
+        PRIMARY KEY (run_id, stack_id),
+        FOREIGN KEY (run_id) REFERENCES runs(id),
+        FOREIGN KEY (stack_id) REFERENCES stacks(id)
+        )""")
+
+# Pairs of revisions to rerun a benchmark on, to confirm a suspected
+# regression or improvement (see benchmarking/detect_regressions.py).
+# direction is 1 if the revision is suspected of being slower, -1 if faster.
+conn.cursor().execute("""CREATE TABLE IF NOT EXISTS queue
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        parent TEXT,
+        revision TEXT,
+        benchmark TEXT,
+        reason TEXT,
+        state TEXT,
+        change REAL,
+        direction INTEGER)""")
+if "direction" not in [r[1] for r in conn.cursor().execute("""PRAGMA table_info(queue)""").fetchall()]:
+    conn.cursor().execute("""ALTER TABLE queue ADD COLUMN direction INTEGER""")
 
 def add_run(revision, configuration, benchmark):
     assert len(revision) == 40
@@ -47,44 +75,108 @@ def get_metadata(run_id, md_name):
     return r[0][0]
 
 def get_runs(revision, configuration, benchmark=None):
+    # The runs come with all of their metadata, which gets loaded in the same query
     assert len(revision) == 40, repr(revision)
     cursor = conn.cursor()
+    query = """SELECT id, benchmark, type, value FROM runs LEFT JOIN metadata ON metadata.run_id = runs.id
+            WHERE revision=? AND configuration=?"""
     if benchmark:
-        cursor.execute("""SELECT id, benchmark FROM runs WHERE revision=? AND configuration=? AND benchmark=?""",
-                (revision, configuration, benchmark))
+        cursor.execute(query + """ AND benchmark=? ORDER BY id""", (revision, configuration, benchmark))
     else:
-        cursor.execute("""SELECT id, benchmark FROM runs WHERE revision=? AND configuration=?""",
-                (revision, configuration))
-    return [Run(*r) for r in cursor.fetchall()]
+        cursor.execute(query + """ ORDER BY id""", (revision, configuration))
+
+    runs = []
+    for id, benchmark, md_name, md_value in cursor.fetchall():
+        if not runs or runs[-1].id != id:
+            runs.append(Run(id, benchmark, {}))
+        if md_name is not None:
+            runs[-1].md.set(md_name, md_value)
+    return runs
+
+def set_profile(run_id, profile):
+    # profile is a {folded stack: samples} dict
+    cursor = conn.cursor()
+    cursor.executemany("""INSERT OR IGNORE INTO stacks(stack) VALUES (?)""", [(s,) for s in profile])
+    cursor.execute("""DELETE FROM profiles WHERE run_id=?""", (run_id,))
+    cursor.executemany("""INSERT INTO profiles(run_id, stack_id, count)
+            SELECT ?, id, ? FROM stacks WHERE stack=?""", [(run_id, c, s) for s, c in profile.items()])
+    cursor.execute("""INSERT OR REPLACE INTO metadata(run_id, type, value)
+            VALUES (?, 'profile_samples', ?)""", (run_id, sum(profile.values())))
+    conn.commit()
+
+def has_profile(run_id):
+    return get_metadata(run_id, "profile_samples") is not None
+
+def get_profile(run_id):
+    cursor = conn.cursor()
+    cursor.execute("""SELECT stack, count FROM profiles JOIN stacks ON profiles.stack_id = stacks.id
+            WHERE run_id=?""", (run_id,))
+    return dict(cursor.fetchall())
 
 def delete_run(run_id):
+    conn.cursor().execute("""DELETE FROM profiles WHERE run_id=?""", (run_id,))
     conn.cursor().execute("""DELETE FROM metadata WHERE run_id=?""", (run_id,))
     conn.cursor().execute("""DELETE FROM runs WHERE id=?""", (run_id,))
     conn.commit()
 
+def enqueue(parent, revision, benchmark, reason, direction=1):
+    # Returns whether it was queued, ie it isn't already queued or done
+    cursor = conn.cursor()
+    cursor.execute("""SELECT id FROM queue WHERE parent=? AND revision=? AND benchmark=?""",
+            (parent, revision, benchmark))
+    if cursor.fetchall():
+        return False
+    cursor.execute("""INSERT INTO queue(parent, revision, benchmark, reason, state, direction)
+            VALUES (?, ?, ?, ?, 'queued', ?)""", (parent, revision, benchmark, reason, direction))
+    conn.commit()
+    return True
+
+def get_queued():
+    cursor = conn.cursor()
+    cursor.execute("""SELECT id, parent, revision, benchmark, reason, direction FROM queue
+            WHERE state='queued' ORDER BY id""")
+    # Rows from before we recorded the direction were all regressions:
+    return [r[:5] + (r[5] or 1,) for r in cursor.fetchall()]
+
+def finish_queued(queue_id, state, change):
+    conn.cursor().execute("""UPDATE queue SET state=?, change=? WHERE id=?""", (state, change, queue_id))
+    conn.commit()
+
 class Metadata(object):
     __CONVERSIONS = {
         "exitcode": int,
         "elapsed": float,
+        "pipelined": int,
     }
 
-    def __init__(self, run_id):
+    # values is the {type: value} dict of all of the run's metadata, if the
+    # caller already loaded it; otherwise we load it on first use.
+    def __init__(self, run_id, values=None):
         self.__run_id = run_id
+        self.__values = values
+
+    def set(self, md_name, md_value):
+        self.__values[md_name] = md_value
 
     def __getattr__(self, attr):
-        v = get_metadata(self.__run_id, attr)
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if self.__values is None:
+            cursor = conn.cursor()
+            cursor.execute("""SELECT type, value FROM metadata WHERE run_id=?""", (self.__run_id,))
+            self.__values = dict(cursor.fetchall())
+        v = self.__values.get(attr)
         if v is None:
             raise AttributeError(attr)
-        # TODO: cache it?
         if attr in self.__CONVERSIONS:
             return self.__CONVERSIONS[attr](v)
         return v
 
 class Run(object):
-    def __init__(self, id, benchmark):
+    def __init__(self, id, benchmark, metadata=None):
         self.id = id
         self.benchmark = benchmark
-        self.md = Metadata(id)
+        self.md = Metadata(id, metadata)
 
     def format(self):
         if self.md.exitcode:
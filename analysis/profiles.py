@@ -0,0 +1,206 @@
+# Post-processing of the `perf record -g` profiles that investigate.py takes.
+#
+# Rather than running `perf report` over the raw perf.data every time we want
+# to look at a profile, each profile gets folded once into "frame;frame;frame
+# count" stacks (the format that the FlameGraph tools use), which get stored in
+# the database per run.  Comparing two runs, or all the runs of two revisions,
+# is then just a matter of diffing the folded stacks, which we render as a
+# differential flamegraph: the shape is the new profile, and each frame is
+# colored by how much its share of the samples changed (red for more, blue for
+# less).
+
+import cgi
+import collections
+import os
+import re
+import subprocess
+
+import model
+
+# perf script event headers look like "comm pid[/tid] [cpu] time: period event:"
+HEADER_RE = re.compile(r"^(\S.*?)\s+\d+(/\d+)?\s")
+OFFSET_RE = re.compile(r"\+0x[0-9a-f]+$")
+
+def _frame_name(l):
+    # Callchain lines are "addr sym+offset (dso)"
+    fields = l.strip().split(None, 1)
+    if len(fields) < 2:
+        return "[unknown]"
+    rest = fields[1]
+    dso = None
+    if rest.endswith(")") and " (" in rest:
+        rest, dso = rest.rsplit(" (", 1)
+        dso = dso[:-1]
+    sym = OFFSET_RE.sub("", rest.strip())
+    if sym == "[unknown]" and dso and dso != "[unknown]":
+        return "[%s]" % os.path.basename(dso)
+    # Frames are separated by ';' in the folded format
+    return sym.replace(';', ':')
+
+def fold(lines):
+    # Folds `perf script` output into a {stack: samples} dict, where the stack
+    # goes from the root to the leaf and starts with the process name.
+    stacks = collections.defaultdict(int)
+    comm = None
+    frames = []
+    for l in lines:
+        l = l.rstrip('\n')
+        if not l.strip():
+            if comm is not None:
+                stacks[";".join([comm] + frames[::-1])] += 1
+            comm = None
+            frames = []
+        elif l[0].isspace():
+            if comm is not None:
+                frames.append(_frame_name(l))
+        else:
+            m = HEADER_RE.match(l)
+            comm = m.group(1) if m else l.split()[0]
+    if comm is not None:
+        stacks[";".join([comm] + frames[::-1])] += 1
+    return dict(stacks)
+
+def fold_perf_data(fn):
+    p = subprocess.Popen(["perf", "script", "-i", fn], stdout=subprocess.PIPE, stderr=open("/dev/null", 'w'))
+    stacks = fold(p.stdout)
+    code = p.wait()
+    assert code == 0, "perf script exited with code %d" % code
+    return stacks
+
+def import_run(run_id, save_dir):
+    # Folds and stores the run's profile; returns whether it had one
+    perf_fn = os.path.join(save_dir, "perf.data")
+    if not os.path.exists(perf_fn):
+        return False
+    print "Folding the profile of run %d" % run_id
+    model.set_profile(run_id, fold_perf_data(perf_fn))
+    return True
+
+def get_profile(run_id, save_dir):
+    # Runs from before we stored profiles get folded on first use
+    if not model.has_profile(run_id):
+        if not import_run(run_id, save_dir):
+            return {}
+    return model.get_profile(run_id)
+
+def merge(profiles):
+    rtn = collections.defaultdict(int)
+    for p in profiles:
+        for stack, count in p.items():
+            rtn[stack] += count
+    return dict(rtn)
+
+def inclusive(profile):
+    # Returns {function: fraction of samples that it is on the stack for}
+    total = float(sum(profile.values()))
+    counts = collections.defaultdict(int)
+    for stack, count in profile.items():
+        for f in set(stack.split(';')[1:]):
+            counts[f] += count
+    return dict((f, c / total) for f, c in counts.items())
+
+def format_diff(before, after, n=25):
+    # The text version of the diff, for a quick look at which functions moved
+    # the most (similar to perf_diff.py from the pyston tree)
+    incl1 = inclusive(before)
+    incl2 = inclusive(after)
+    diffs = sorted(set(incl1) | set(incl2), key=lambda f: -abs(incl2.get(f, 0) - incl1.get(f, 0)))
+    lines = ["% 8s % 8s % 8s  %s" % ("before", "after", "diff", "function")]
+    for f in diffs[:n]:
+        b = incl1.get(f, 0) * 100
+        a = incl2.get(f, 0) * 100
+        lines.append("% 7.2f%% % 7.2f%% %+7.2f%%  %s" % (b, a, a - b, f))
+    return "\n".join(lines)
+
+class _Node(object):
+    def __init__(self, name):
+        self.name = name
+        self.before = 0.0
+        self.after = 0
+        self.children = collections.OrderedDict()
+
+    def child(self, name):
+        if name not in self.children:
+            self.children[name] = _Node(name)
+        return self.children[name]
+
+def _build_tree(before, after):
+    # The before counts are scaled to the size of the after profile, so that
+    # the colors reflect changes in each frame's share of the time rather than
+    # in how many samples we happened to take.
+    scale = float(sum(after.values())) / max(sum(before.values()), 1)
+    root = _Node("all")
+    for profile, attr, factor in ((after, "after", 1), (before, "before", scale)):
+        for stack, count in sorted(profile.items()):
+            node = root
+            setattr(node, attr, getattr(node, attr) + count * factor)
+            for f in stack.split(';'):
+                node = node.child(f)
+                setattr(node, attr, getattr(node, attr) + count * factor)
+    return root
+
+def _color(delta):
+    # delta is the change in the frame's fraction of the total
+    intensity = min(1.0, abs(delta) * 20)
+    fade = int(255 * (1 - intensity))
+    if delta > 0:
+        return "rgb(255,%d,%d)" % (fade, fade)
+    return "rgb(%d,%d,255)" % (fade, fade)
+
+WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_WIDTH = 7
+# Frames narrower than this many pixels don't get drawn
+MIN_WIDTH = 0.5
+
+def render_diff_svg(before, after, title):
+    root = _build_tree(before, after)
+    total = float(root.after)
+    if not total:
+        return None
+
+    rects = []
+    def walk(node, x, depth):
+        width = node.after / total * WIDTH
+        if width < MIN_WIDTH:
+            return
+        rects.append((node, x, depth, width))
+        child_x = x
+        for c in node.children.values():
+            walk(c, child_x, depth + 1)
+            child_x += c.after / total * WIDTH
+    walk(root, 0, 0)
+
+    max_depth = max(depth for (_, _, depth, _) in rects)
+    height = (max_depth + 3) * FRAME_HEIGHT
+    out = []
+    out.append('<?xml version="1.0" standalone="no"?>')
+    out.append('<svg version="1.1" width="%d" height="%d" xmlns="http://www.w3.org/2000/svg" '
+            'style="font-family:monospace; font-size:11px">' % (WIDTH, height))
+    out.append('<text x="%d" y="%d" text-anchor="middle" style="font-size:14px">%s</text>' % (
+        WIDTH / 2, FRAME_HEIGHT, cgi.escape(title)))
+    for node, x, depth, width in rects:
+        delta = (node.after - node.before) / total
+        y = height - (depth + 1) * FRAME_HEIGHT
+        tooltip = "%s (%d samples, %.2f%%, %+.2f%%)" % (node.name, node.after, node.after / total * 100, delta * 100)
+        out.append('<g><title>%s</title>' % cgi.escape(tooltip))
+        out.append('<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s" stroke="white" stroke-width="0.5"/>' % (
+            x, y, width, FRAME_HEIGHT - 1, _color(delta)))
+        chars = int(width / FONT_WIDTH) - 1
+        if chars >= 3:
+            label = node.name if len(node.name) <= chars else node.name[:chars - 2] + ".."
+            out.append('<text x="%.1f" y="%d">%s</text>' % (x + 3, y + FRAME_HEIGHT - 4, cgi.escape(label)))
+        out.append('</g>')
+    out.append('</svg>')
+    return "\n".join(out)
+
+def write_diff(before, after, title, fn):
+    # Prints the text diff and writes the flamegraph to fn
+    if not before or not after:
+        print "Missing a profile to compare"
+        return
+    print format_diff(before, after)
+    svg = render_diff_svg(before, after, title)
+    with open(fn, 'w') as f:
+        f.write(svg)
+    print "Wrote the differential flamegraph to %s" % fn
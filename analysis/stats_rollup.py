@@ -1,9 +1,16 @@
+import argparse
 import os
-import pickle
 import subprocess
 import sys
-import time
-import traceback
+
+# stats_rollup stores its results in the benchmarking run history, so this
+# has to come before our own directory, which has a different model.py:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../benchmarking"))
+import measure_perf
+import model
+import pyston_stats
+import scoring
+import stats
 
 BENCHMARKS = [
     "django_template.py",
@@ -15,160 +22,178 @@ SRC_DIR = os.path.join(os.path.dirname(__file__), "../../pyston")
 BENCHMARKS_DIR = os.path.join(os.path.dirname(__file__), "../benchmarking/benchmark_suite")
 WARMUP_TIMES = 2
 
+# What the runs get recorded as in the history
+EXECUTABLE_NAME = "pyston_stats"
+
+# The times are shown relative to cpython's, which come from the recent
+# `measure_perf.py --run-cpython` runs in the history
+CPYTHON_EXECUTABLE = "cpython 2.7"
+CPYTHON_HISTORY = 10
+
+# In ms; for when there are no cpython runs of a benchmark in the history
 CPYTHON_TIMES = {
     "django_template.py": 1479,
     "pyxl_bench.py": 1966,
     "sqlalchemy_imperative2.py": 2056,
 }
 
-def collect_stats():
-    allstats = {}
+def get_cpython_time(benchmark):
+    times = [t for (_, _, t, _) in model.get_history(CPYTHON_EXECUTABLE, benchmark)[-CPYTHON_HISTORY:] if t is not None]
+    if times:
+        return stats.median(times) * 1000
+    return CPYTHON_TIMES.get(benchmark)
+
+def collect_stats(pyston_exe, executable, revision, benchmarks, rerun, run_times):
+    for b in benchmarks:
+        if not rerun and model.get_revision_stats(revision, b, executable):
+            print "Already have stats for %s" % (b,)
+            continue
 
-    for b in BENCHMARKS:
-        run_args = [pyston_exe, "-s", os.path.join(BENCHMARKS_DIR, b)]
+        run_args = [pyston_exe, pyston_stats.STATS_OPTION, os.path.join(BENCHMARKS_DIR, b)]
         for i in xrange(WARMUP_TIMES):
             print "Warmup #%d of %s" % (i + 1, b)
-            subprocess.check_call(run_args, stdout=open("/dev/null"), stderr=open("/dev/null"))
+            subprocess.check_call(run_args, stdout=open("/dev/null", 'w'), stderr=open("/dev/null", 'w'))
 
         print "Running %s" % (b,)
-        p = subprocess.Popen(run_args, stdout=open("/dev/null"), stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        r = p.wait()
-        assert r == 0, (out, err)
-
-        stats = {}
-        _, counter_str = err.split("Counters:")
-        counter_str, _ = counter_str.split("(End of stats)")
-        for l in counter_str.strip().split('\n'):
-            assert l.count(':') == 1, l
-            k, v = l.split(':')
-            stats[k] = v
-
-        allstats[b] = stats
-
-    return allstats
-
-if __name__ == "__main__":
-    pyston_exe = SRC_DIR + "/pyston_release"
-    assert os.path.exists(pyston_exe)
-
-    if subprocess.call(["grep", "-q", "STAT_TIMERS (1", os.path.join(SRC_DIR, "src/core/stats.h")]) == 1:
-        raise Exception("Stat timers do not seem to be turned on in the source")
-
-    if not os.path.exists("stats.pkl") or os.stat("stats.pkl").st_mtime <= os.stat(pyston_exe).st_mtime:
-        allstats = collect_stats()
-        with open("stats.pkl", "w") as f:
-            pickle.dump(allstats, f)
-
-    allstats = pickle.load(open("stats.pkl"))
-
-    categorizers = []
-    categorizers.append(lambda k: (k, 30))
-    # categorizers.append(lambda k: ("misc", 0))
-
-    def prefix_categorizer(prefix, name, score):
-        def categorizer(k):
-            if k.startswith(prefix):
-                return name, score
-        return categorizer
-
-    def list_categorizer(l, name, score):
-        def categorizer(k):
-            if k in l:
-                return name, score
-            assert k.startswith("us_timer_")
-            if k[len("us_timer_"):] in l:
-                return name, score
-        return categorizer
-
-    categorizers.append(prefix_categorizer("us_timer_slowpath_", "slowpaths", 20))
-    categorizers.append(prefix_categorizer("us_timer_slowpath_", "avoidable runtime overhead", 10))
-    categorizers.append(prefix_categorizer("us_timer_slot_", "api conversion", 20))
-    categorizers.append(prefix_categorizer("us_timer_slot_", "avoidable runtime overhead", 10))
-    categorizers.append(prefix_categorizer("us_timer_wrap_", "api conversion", 20))
-    categorizers.append(prefix_categorizer("us_timer_wrap_", "avoidable runtime overhead", 10))
-    categorizers.append(list_categorizer(["compileFunction"], "llvm+irgen", 20))
-    categorizers.append(list_categorizer(["compileFunction"], "tiering overhead", 10))
-    categorizers.append(list_categorizer(["in_interpreter", "main_toplevel"], "in interpreter", 20))
-    categorizers.append(list_categorizer(["in_interpreter", "main_toplevel"], "tiering overhead", 10))
-    categorizers.append(list_categorizer(["in_jitted_code", "in_builtins", "in_baseline_jitted_code"], "things that should be fast", 10))
-    categorizers.append(list_categorizer(["rewriter", "createrewriter"], "rewriter", 20))
-    categorizers.append(list_categorizer(["rewriter", "createrewriter"], "tiering overhead", 10))
-    categorizers.append(list_categorizer(["typeNew"], "things that should be fast", 10))
-    categorizers.append(list_categorizer(["unwinding", "getTopPythonFrame"], "unwinding", 10))
-    # categorizers.append(list_categorizer(["unwinding", "getTopPythonFrame", "gc_collection"], "using modern techniques", 60))
-    categorizers.append(list_categorizer(["caching_parse_file", "cpyton_parsing"], "parsing", 20))
-    categorizers.append(list_categorizer(["gc_collection"], "gc collection", 10))
-
-    categorize_at = [20, 10]
-    # categorizers.append(lambda k: (k, 1)) # for debugging
-
-    stat_names = set()
-    for b in BENCHMARKS:
-        for stat_name in allstats[b]:
-            if not stat_name.startswith("us_timer_"):
-                continue
-            stat_names.add(stat_name)
-
-    for max_specificity in categorize_at:
+        exe = measure_perf.Executable(run_args[:-1], executable, {"run_times": run_times})
+        code, elapsed, size, details = measure_perf.run_benchmark(exe,
+                measure_perf.Benchmark(b, False), False, BENCHMARKS_DIR, None)
+        assert code == 0, "%s exited with code %d" % (b, code)
+        assert details.get("pyston_stats"), "%s didn't print its stats" % (b,)
+        model.add_run(b, executable, revision, elapsed, size, details)
+        model.commit()
+
+def print_table(executable, revision, benchmarks):
+    allstats = [model.get_revision_stats(revision, b, executable)[-1] for b in benchmarks]
+
+    for max_level in pyston_stats.CATEGORIZE_AT:
         print
-        # print max_specificity
-
-        results = {b:{} for b in BENCHMARKS}
-        for sn in stat_names:
-            category = "misc"
-            specificity = 0
-
-            for categorizer in categorizers:
-                r = categorizer(sn)
-                if r is None:
-                    continue
-                if r[1] > max_specificity:
-                    continue
-                if r[1] == specificity:
-                    print "Ambiguous specificity between %r and %r when applied to %r" % (category, r[0], sn)
-                if r[1] > specificity:
-                    specificity = r[1]
-                    category = r[0]
-
-            for b in BENCHMARKS:
-                results[b][category] = results[b].get(category, 0) + int(allstats[b].get(sn, 0))
+
+        results = dict(zip(benchmarks, pyston_stats.rollup(allstats, max_level)))
 
         cutoff = 10 # in ms
-        for k in results[BENCHMARKS[0]].keys():
+        for k in set(k for b in benchmarks for k in results[b]):
             if k == "misc":
                 continue
 
-            if sum(results[b][k] for b in BENCHMARKS) < cutoff * 1000 * len(BENCHMARKS):
-                for b in BENCHMARKS:
-                    results[b]["misc"] = results[b].get("misc", 0) + results[b][k]
-                    del results[b][k]
+            if sum(results[b].get(k, 0) for b in benchmarks) < cutoff * 1000 * len(benchmarks):
+                for b in benchmarks:
+                    results[b]["misc"] = results[b].get("misc", 0) + results[b].pop(k, 0)
 
-        results = [(k, [results[b][k] for b in BENCHMARKS]) for k in results[BENCHMARKS[0]].keys()]
+        results = [(k, [results[b].get(k, 0) for b in benchmarks]) for k in set(k for b in benchmarks for k in results[b])]
         def sort_key((k, l)):
             if k == "misc":
                 return -1
             return sum(l) # should be product
         results.sort(key=sort_key, reverse=True)
 
+        cpython_times = [get_cpython_time(b) for b in benchmarks]
+
         print "%30s" % '',
-        for b in BENCHMARKS:
+        for b in benchmarks:
             print "% 25s" % b[:-3],
         print "% 15s" % "(geomean)",
         print
         for (k, l) in results:
-
-            # if k.startswith('us_timer_'):
-                # k = k[len('us_timer_'):]
-
             print "%30s" % k,
-            cpython_product = 1.0
-            for i, r in enumerate(l):
-                cpython_percent = r/10/CPYTHON_TIMES[BENCHMARKS[i]]
-                cpython_product *= cpython_percent
-                s = "%d (% 3s%%)" % (r/1000, cpython_percent)
+            cpython_percents = []
+            for r, cpython_time in zip(l, cpython_times):
+                if cpython_time:
+                    cpython_percent = r / 10 / cpython_time
+                    cpython_percents.append(cpython_percent)
+                    s = "%d (% 3d%%)" % (r / 1000, cpython_percent)
+                else:
+                    s = "%d" % (r / 1000)
                 print "% 25s" % s,
 
-            cpython_product **= (1.0 / len(l))
-            print "%14.0f%%" % cpython_product,
+            if cpython_percents and len(cpython_percents) == len(l) and all(cpython_percents):
+                print "%14.0f%%" % scoring.geomean(dict(enumerate(cpython_percents))),
             print
+
+def print_history(executable, benchmarks, category):
+    # The time in one category at each revision that has stats, in ms
+    for b in benchmarks:
+        print b
+        for timestamp, revision, run_id, samples in model.get_stats_history(executable, b):
+            values = pyston_stats.rollup_category(samples, category)
+            print "%s %s % 10.1fms" % (timestamp, (revision or "")[:12], stats.median(values) / 1000.0)
+
+def print_diff(executable, rev1, rev2, benchmarks, max_level):
+    # Per-category changes in time between the runs of two revisions, with
+    # the significance of each when we have several samples of both
+    for b in benchmarks:
+        samples1 = pyston_stats.rollup(model.get_revision_stats(rev1, b, executable), max_level)
+        samples2 = pyston_stats.rollup(model.get_revision_stats(rev2, b, executable), max_level)
+        print
+        if not samples1 or not samples2:
+            print "%s: missing stats for %s" % (b, rev1[:12] if not samples1 else rev2[:12])
+            continue
+
+        print "%30s % 10s % 10s % 10s % 8s % 7s   (%s: n=%d vs n=%d)" % ('', rev1[:10], rev2[:10], "diff", "", "p", b,
+                len(samples1), len(samples2))
+        rows = []
+        for k in set(k for r in samples1 + samples2 for k in r):
+            t1 = [r.get(k, 0) / 1000.0 for r in samples1]
+            t2 = [r.get(k, 0) / 1000.0 for r in samples2]
+            m1 = stats.median(t1)
+            m2 = stats.median(t2)
+            p = stats.mann_whitney(t1, t2)[1] if len(t1) > 1 and len(t2) > 1 else None
+            rows.append((k, m1, m2, p))
+        rows.sort(key=lambda (k, m1, m2, p): -abs(m2 - m1))
+        for k, m1, m2, p in rows:
+            percent = "%+7.1f%%" % ((m2 - m1) / m1 * 100) if m1 else ""
+            significance = "%7.3f%s" % (p, "*" if p < 0.05 else " ") if p is not None else "    n/a "
+            print "%30s % 8.1fms % 8.1fms %+8.1fms %8s %s" % (k, m1, m2, m2 - m1, percent, significance)
+
+def rev_parse(rev):
+    if os.path.exists(SRC_DIR):
+        try:
+            return subprocess.check_output(["git", "rev-parse", rev], cwd=SRC_DIR, stderr=open("/dev/null", 'w')).strip()
+        except subprocess.CalledProcessError:
+            pass
+    # Ex one of the "+dirty" revisions
+    return rev
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*")
+    parser.add_argument("--history", dest="history", action="store",
+            help="Show the time spent in this category across the recorded revisions")
+    parser.add_argument("--executable", dest="executable", action="store", default=EXECUTABLE_NAME,
+            help="What the stats runs get recorded as, and which ones to show")
+    parser.add_argument("--rerun", dest="rerun", action="store_true",
+            help="Collect the stats again even if we already have them for this revision")
+    parser.add_argument("--run-times", dest="run_times", action="store", default=1, type=int,
+            help="How many samples to collect of each benchmark, for --diff to test the changes against")
+    parser.add_argument("--diff", dest="diff", action="store", nargs=2, metavar=("REV1", "REV2"),
+            help="Show how the time in each category changed between the stats of two revisions")
+    parser.add_argument("--level", dest="level", action="store", default=pyston_stats.SUBSYSTEM, type=int,
+            help="The categorization level for --diff (%d for subsystems, %d for broad categories, %d for timers)" % (
+                pyston_stats.SUBSYSTEM, pyston_stats.BROAD, pyston_stats.TIMER))
+    args = parser.parse_args()
+
+    benchmarks = args.benchmarks or BENCHMARKS
+
+    if args.history:
+        print_history(args.executable, benchmarks, args.history)
+        sys.exit(0)
+
+    if args.diff:
+        print_diff(args.executable, rev_parse(args.diff[0]), rev_parse(args.diff[1]), benchmarks, args.level)
+        sys.exit(0)
+
+    pyston_exe = SRC_DIR + "/pyston_release"
+    assert os.path.exists(pyston_exe)
+
+    if subprocess.call(["grep", "-q", "STAT_TIMERS (1", os.path.join(SRC_DIR, "src/core/stats.h")]) == 1:
+        raise Exception("Stat timers do not seem to be turned on in the source")
+
+    revision = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SRC_DIR).strip()
+    rerun = args.rerun
+    if subprocess.check_output(["git", "status", "--porcelain", "--untracked=no"], cwd=SRC_DIR).strip():
+        # Results from a dirty tree don't belong to the revision, and could be
+        # out of date by the next time we run:
+        revision += "+dirty"
+        rerun = True
+    collect_stats(pyston_exe, args.executable, revision, benchmarks, rerun, args.run_times)
+    print_table(args.executable, revision, benchmarks)
@@ -16,6 +16,8 @@ random.seed(1234)
 import sys
 import time
 
+import iteration_timings
+
 class GVector(object):
     def __init__(self, x = 0, y = 0, z = 0):
         self.x = x
@@ -239,6 +241,7 @@ class Chaosgame(object):
                 im[x][h - y - 1] = 0
             t2 = time.time()
             times.append(t2 - t1)
+            iteration_timings.record(t2 - t1)
         save_im(im, name)
         return times
 
@@ -20,6 +20,8 @@ the layout & logic from the original. (Ugh.)
 """
 from __future__ import print_function
 
+import iteration_timings
+
 
 # The JS variant implements "OrderedCollection", which basically completely
 # overlaps with ``list``. So we'll cheat. :D
@@ -625,6 +627,7 @@ def main(n):
         delta_blue()
         t2 = time.time()
         times.append(t2 - t1)
+        iteration_timings.record(t2 - t1)
 
     return times
 
@@ -9,6 +9,7 @@ from django.template.base import Origin, Template, Context, TemplateDoesNotExist
 from django.conf import settings
 from django.apps import apps
 import time
+import iteration_timings
 
 try:
     import __pyston__
@@ -119,4 +120,5 @@ for i in xrange(500):
     start = time.time()
     template = Template(template_source, None, "admin/index.html")
     elapsed = time.time() - start
+    iteration_timings.record(elapsed)
 print "took %4.1fms for last iteration" % (elapsed * 1000.0,)
@@ -9,6 +9,7 @@ from django.template.base import Origin, Template, Context, TemplateDoesNotExist
 from django.conf import settings
 from django.apps import apps
 import time
+import iteration_timings
 import shutil
 
 # Copy the "base" db so we always start with a knownn state:
@@ -132,4 +133,5 @@ for i in xrange(200):
     start = time.time()
     template.render(context)
     elapsed = time.time() - start
+    iteration_timings.record(elapsed)
 print "took %4.1fms for last iteration" % (elapsed * 1000.0,)
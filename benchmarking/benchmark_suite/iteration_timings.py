@@ -0,0 +1,36 @@
+# Side channel for benchmarks to report how long each iteration of their main
+# loop took.  measure_perf.py sets $BENCHMARK_TIMINGS_FILE, and the timings get
+# written there (one per line, in seconds) when the benchmark exits.  This lets
+# us separate steady-state time from startup and warmup time.
+#
+# Benchmarks can also report named phases (ex the startup benchmarks), which
+# get written as "name seconds" lines.
+#
+# This gets imported by the benchmarks themselves, so it should stay small and
+# not pull in any other modules that the benchmark wouldn't otherwise import.
+
+import atexit
+import os
+
+TIMINGS_FILE_ENV = "BENCHMARK_TIMINGS_FILE"
+
+_timings = []
+_phases = []
+
+def record(elapsed):
+    _timings.append(elapsed)
+
+def record_phase(name, elapsed):
+    assert ' ' not in name, name
+    _phases.append((name, elapsed))
+
+def _save():
+    fn = os.environ.get(TIMINGS_FILE_ENV)
+    if not fn:
+        return
+    with open(fn, 'w') as f:
+        for t in _timings:
+            f.write("%r\n" % t)
+        for name, t in _phases:
+            f.write("%s %r\n" % (name, t))
+atexit.register(_save)
@@ -19,8 +19,14 @@ channel = (
     </frag>
 )
 
-for i in xrange(60000):
-    channel.to_string()
+# Time the iterations in batches, since a single one is too short to time accurately:
+import time
+import iteration_timings
+for i in xrange(60):
+    start = time.time()
+    for j in xrange(1000):
+        channel.to_string()
+    iteration_timings.record(time.time() - start)
 """
 
 from pyxl.codec.register import pyxl_transform_string
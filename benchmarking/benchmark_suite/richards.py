@@ -343,6 +343,7 @@ class WorkTask(Task):
 
 import time
 
+import iteration_timings
 
 
 def schedule():
@@ -363,6 +364,7 @@ class Richards(object):
 
     def run(self, iterations):
         for i in xrange(iterations):
+            start = time.time()
             taskWorkArea.holdCount = 0
             taskWorkArea.qpktCount = 0
 
@@ -393,6 +395,8 @@ class Richards(object):
             else:
                 return False
 
+            iteration_timings.record(time.time() - start)
+
         return True
 
 def entry_point(iterations):
@@ -0,0 +1,61 @@
+# Driver for the startup benchmarks.  Each one runs a small snippet in a lot of
+# fresh interpreter processes, and reports the average time spent in each phase
+# of those processes' lives:
+#
+#   launch: from spawning the process until it starts running our code (this
+#           is interpreter initialization plus importing site)
+#   import: running the import statements in the snippet
+#   run:    the rest of the snippet
+#   exit:   from the end of the snippet until the process has exited
+#
+# as well as "harness" for the overhead of the tracing itself, and
+# "import:<package>" for the time spent importing each top-level package.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import iteration_timings
+
+CHILD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_child.py")
+
+def get_interpreter():
+    # measure_perf tells us how it ran us (ex with any extra jit args), so
+    # that the child processes get run the same way:
+    args = os.environ.get("BENCHMARK_INTERPRETER")
+    if args:
+        return json.loads(args)
+    return [sys.executable]
+
+def run(code, path=(), n=50):
+    interpreter = get_interpreter()
+    path = [os.path.join(os.path.dirname(os.path.abspath(__file__)), p) for p in path]
+
+    env = dict(os.environ)
+    env.pop(iteration_timings.TIMINGS_FILE_ENV, None)
+
+    totals = {}
+    fd, results_fn = tempfile.mkstemp(prefix="startup_phases_")
+    os.close(fd)
+    try:
+        env["STARTUP_RESULTS_FILE"] = results_fn
+        for i in xrange(n):
+            env["STARTUP_SPAWN_TIME"] = repr(time.time())
+            start = time.time()
+            subprocess.check_call(interpreter + [CHILD, code] + path, env=env)
+            elapsed = time.time() - start
+            iteration_timings.record(elapsed)
+
+            with open(results_fn) as f:
+                phases = json.load(f)
+            phases["exit"] = elapsed - sum(phases[k] for k in ("launch", "harness", "import", "run"))
+            for name, t in phases.items():
+                totals[name] = totals.get(name, 0.0) + t
+    finally:
+        os.remove(results_fn)
+
+    for name, t in sorted(totals.items()):
+        iteration_timings.record_phase(name, t / n)
@@ -0,0 +1,52 @@
+# Runs a startup benchmark snippet, tracing how long its imports take.
+# Usage: startup_child.py CODE [SYS_PATH_ENTRY...]
+# This needs to import as little as possible before it gets to the snippet.
+
+import time
+_start = time.time()
+
+import __builtin__
+import os
+import sys
+
+sys.path[0:0] = sys.argv[2:]
+
+_import_times = {}
+_import_depth = [0]
+_orig_import = __builtin__.__import__
+
+def _traced_import(name, *args, **kw):
+    if _import_depth[0]:
+        return _orig_import(name, *args, **kw)
+
+    # Only time the outermost import, so that nested ones get attributed to the
+    # package that the snippet asked for:
+    _import_depth[0] += 1
+    start = time.time()
+    try:
+        return _orig_import(name, *args, **kw)
+    finally:
+        package = name.split('.')[0] or "(relative)"
+        _import_times[package] = _import_times.get(package, 0.0) + time.time() - start
+        _import_depth[0] -= 1
+
+__builtin__.__import__ = _traced_import
+code_start = time.time()
+exec sys.argv[1] in {"__name__": "__startup__"}
+code_time = time.time() - code_start
+__builtin__.__import__ = _orig_import
+
+import_time = sum(_import_times.values())
+phases = {
+    "launch": _start - float(os.environ["STARTUP_SPAWN_TIME"]),
+    # Our own setup, which doesn't count towards any of the real phases:
+    "harness": code_start - _start,
+    "import": import_time,
+    "run": code_time - import_time,
+}
+for package, t in _import_times.items():
+    phases["import:" + package] = t
+# Not until now, so that the snippet gets to import json itself:
+import json
+with open(os.environ["STARTUP_RESULTS_FILE"], 'w') as f:
+    json.dump(phases, f)
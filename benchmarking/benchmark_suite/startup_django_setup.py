@@ -0,0 +1,8 @@
+import startup
+
+startup.run("""
+import os
+os.environ["DJANGO_SETTINGS_MODULE"] = "testsite.settings"
+import django
+django.setup()
+""", path=["django_migrate_testsite", "lib"])
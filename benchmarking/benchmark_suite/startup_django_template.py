@@ -0,0 +1,3 @@
+import startup
+
+startup.run("import django.template", path=["lib"])
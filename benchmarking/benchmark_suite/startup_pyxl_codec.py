@@ -0,0 +1,3 @@
+import startup
+
+startup.run("import pyxl.codec.register", path=["lib/pyxl"])
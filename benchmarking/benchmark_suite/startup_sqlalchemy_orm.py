@@ -0,0 +1,3 @@
+import startup
+
+startup.run("import sqlalchemy.orm", path=["lib/sqlalchemy/lib"])
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+Binary-searches a range of pyston commits for a performance regression:
+
+python bisect_perf.py GOOD_REV BAD_REV django_template3.py --threshold=2% --run-times=5
+
+Builds come from (and are saved to) analysis/saved_builds, and every
+measurement is recorded in the run history.  Compiles happen in the build
+worktrees (see analysis/builds.py), so the pyston checkout is left alone and
+other investigations can build at the same time.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import traceback
+
+import environment
+import measure_perf
+import model
+import stats
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../analysis"))
+import builds
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_suite")
+
+def load_bad_revs():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "bad_revs.txt")) as f:
+        return set(l.strip() for l in f if l.strip() and not l.startswith('#'))
+
+def rev_parse(rev, src_dir):
+    return subprocess.check_output(["git", "rev-parse", rev], cwd=src_dir).strip()
+
+def get_rev_range(good, bad, src_dir):
+    # Only look at the first parent, using that as the official sequence (like measure_all.sh does):
+    revs = subprocess.check_output(["git", "rev-list", "--first-parent", "--reverse", "%s..%s" % (good, bad)],
+            cwd=src_dir).split()
+    assert revs and revs[-1] == bad, "%s is not a first-parent descendant of %s" % (bad, good)
+    return [good] + revs
+
+class Bisector(object):
+    def __init__(self, src_dir, benchmark, run_times):
+        self.src_dir = src_dir
+        self.benchmark = benchmark
+        self.run_times = run_times
+        self.bad_revs = load_bad_revs()
+        self.times = {}
+
+    # Returns the median time of the benchmark on this revision, or None if the
+    # revision is known to be broken or fails to build or run.
+    def measure(self, revision):
+        if revision in self.times:
+            return self.times[revision]
+
+        if revision in self.bad_revs:
+            print "Skipping %s since it is in bad_revs.txt" % revision
+            return None
+
+        try:
+            pyston_exe = builds.build(revision, self.src_dir)
+        except Exception:
+            traceback.print_exc()
+            print "Couldn't build %s, skipping it" % revision
+            self.bad_revs.add(revision)
+            return None
+
+        results = []
+        def record_callback(exe, benchmark, elapsed, size, details):
+            details["run_id"] = model.add_run(benchmark, exe.name, revision, elapsed, size, details,
+                    env=environment.get_environment({}))
+            results.append(elapsed)
+
+        exe = measure_perf.Executable([pyston_exe] + builds.extra_jit_args(revision, self.src_dir), "pyston",
+                {'run_times': self.run_times, 'take_median': True})
+        try:
+            measure_perf.run_tests([exe], [measure_perf.Benchmark(self.benchmark, False)], [], [record_callback],
+                    BENCHMARK_DIR)
+        finally:
+            model.commit()
+
+        self.times[revision] = results[0] if results else None
+        return self.times[revision]
+
+    def bisect(self, revs, threshold):
+        good_time = self.measure(revs[0])
+        bad_time = self.measure(revs[-1])
+        assert good_time is not None, "Couldn't measure the good revision"
+        assert bad_time is not None, "Couldn't measure the bad revision"
+
+        if bad_time < good_time * (1 + threshold):
+            print "%s only went from %.2fs to %.2fs; not a regression of more than %.1f%%" % (
+                    self.benchmark, good_time, bad_time, threshold * 100)
+            return None
+
+        # Classify each revision by which end of the range it's closer to:
+        cutoff = (good_time + bad_time) / 2
+        print "Looking for the change from %.2fs to %.2fs among %d revisions" % (good_time, bad_time, len(revs) - 2)
+
+        lo = 0
+        hi = len(revs) - 1
+        untestable = set()
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            # If the midpoint can't be tested, try its neighbors, closest first:
+            candidates = sorted([i for i in xrange(lo + 1, hi) if i not in untestable], key=lambda i: abs(i - mid))
+            for i in candidates:
+                t = self.measure(revs[i])
+                if t is not None:
+                    break
+                untestable.add(i)
+            else:
+                break
+
+            print "%s: %.2fs (%s)" % (revs[i], t, "bad" if t > cutoff else "good")
+            if t > cutoff:
+                hi = i
+            else:
+                lo = i
+
+        return lo, hi
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("good")
+    parser.add_argument("bad")
+    parser.add_argument("benchmark")
+    parser.add_argument("--pyston_dir", dest="pyston_dir", action="store", default=None)
+    parser.add_argument("--threshold", dest="threshold", action="store", default="5%")
+    parser.add_argument("--run-times", dest="run_times", action="store", default='3')
+    parser.add_argument("--build-cache-gb", dest="build_cache_gb", action="store", default=None, type=float)
+    args = parser.parse_args()
+
+    if args.pyston_dir is None:
+        args.pyston_dir = os.path.join(os.path.dirname(__file__), "../../pyston")
+
+    benchmark = args.benchmark
+    if '.' not in benchmark:
+        benchmark += ".py"
+    assert os.path.exists(os.path.join(BENCHMARK_DIR, benchmark)), benchmark
+
+    good = rev_parse(args.good, args.pyston_dir)
+    bad = rev_parse(args.bad, args.pyston_dir)
+    revs = get_rev_range(good, bad, args.pyston_dir)
+
+    if args.build_cache_gb is not None:
+        builds.CACHE_BUDGET_GB = args.build_cache_gb
+
+    bisector = Bisector(args.pyston_dir, benchmark, int(args.run_times))
+    r = bisector.bisect(revs, stats.parse_percentage(args.threshold))
+    if r is None:
+        sys.exit(1)
+
+    lo, hi = r
+    print
+    if hi - lo == 1:
+        print "First bad revision: %s (%.2fs -> %.2fs)" % (revs[hi], bisector.times[revs[lo]], bisector.times[revs[hi]])
+    else:
+        print "The regression is somewhere between %s and %s;" % (revs[lo], revs[hi])
+        print "couldn't test the %d revisions in between" % (hi - lo - 1)
+
+if __name__ == "__main__":
+    main()
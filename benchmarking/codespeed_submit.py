@@ -1,7 +1,15 @@
 # Submission library based on the codespeed example:
 
 from datetime import datetime
+import errno
+import fcntl
+import httplib
+import itertools
+import json
+import os
 import socket
+import threading
+import time
 import urllib
 import urllib2
 
@@ -40,28 +48,166 @@ def _formdata(commitid, benchmark, executable, value):
 
     return data
 
-def submit(commitid, benchmark, executable, value):
-    data = _formdata(commitid, benchmark, executable, value)
+# Results get written to an on-disk spool and are submitted in batches by a
+# background thread, so that measuring never waits on the network and results
+# survive the server being down.  Anything that couldn't be submitted stays in
+# the spool until the next flush (ex `measure_perf.py --flush-spool`); results
+# that the server refuses get moved to the rejected/ subdirectory instead, so
+# that they don't hold up the ones after them.
+# Several processes can share the spool, so flushing it takes a lock file in it.
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "codespeed_spool")
+REJECTED_DIR = "rejected"
+LOCK_FILE = ".flush.lock"
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+MAX_BACKOFF = 60
 
-    params = urllib.urlencode(data)
-    response = "None"
-    print "Saving result for executable %s, revision %s, benchmark %s" % (
-        data['executable'], data['commitid'], data['benchmark'])
+_spool_counter = itertools.count()
+_flush_lock = threading.Lock()
+_worker = []
+_worker_wakeup = threading.Event()
+_worker_stopping = threading.Event()
 
-    retries = 1
-    while True:
-        try:
-            f = urllib2.urlopen(CODESPEED_URL + 'result/add/', params)
-            break
-        except urllib2.HTTPError as e:
-            print str(e)
+def _spool(data):
+    if not os.path.exists(SPOOL_DIR):
+        os.makedirs(SPOOL_DIR)
+    fn = os.path.join(SPOOL_DIR, "%.6f-%d-%d.json" % (time.time(), os.getpid(), next(_spool_counter)))
+    # Write to a temporary name first so that a flush never sees a partial file:
+    with open(fn + ".tmp", 'w') as f:
+        json.dump(data, f)
+    os.rename(fn + ".tmp", fn)
 
-            if retries > 0 and e.code in (500,):
-                print "Retrying..."
-                continue
+def _spooled_files():
+    if not os.path.exists(SPOOL_DIR):
+        return []
+    return sorted(fn for fn in os.listdir(SPOOL_DIR) if fn.endswith(".json"))
 
-            print e.read()
-            raise
+def _post_batch(batch):
+    params = urllib.urlencode({'json': json.dumps(batch)})
+    f = urllib2.urlopen(CODESPEED_URL + 'result/add/json/', params, timeout=60)
     response = f.read()
     f.close()
-    print "Server (%s) response: %s\n" % (CODESPEED_URL, response)
+    return response
+
+# Returned by _submit_files when the server refused the data itself
+REJECTED = object()
+
+def _submit_files(files, max_attempts):
+    # Returns the server's response, REJECTED, or None if we couldn't get
+    # through to it
+    batch = []
+    for fn in files:
+        with open(os.path.join(SPOOL_DIR, fn)) as f:
+            batch.append(json.load(f))
+
+    delay = 1
+    for attempt in xrange(max_attempts):
+        try:
+            return _post_batch(batch)
+        except (urllib2.URLError, socket.error, httplib.HTTPException) as e:
+            print "Codespeed submission failed: %s" % (e,)
+            if isinstance(e, urllib2.HTTPError):
+                print e.read()
+                # Retrying won't help if the server rejected the data itself:
+                if 400 <= e.code < 500:
+                    return REJECTED
+            if attempt + 1 < max_attempts:
+                print "Retrying in %ds..." % delay
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_BACKOFF)
+    return None
+
+# A spooled file can already be gone if a process that doesn't take the lock
+# (ex an older version of this) flushed it; that's fine.
+def _remove(fn):
+    try:
+        os.remove(os.path.join(SPOOL_DIR, fn))
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def _reject(fn):
+    rejected_dir = os.path.join(SPOOL_DIR, REJECTED_DIR)
+    if not os.path.exists(rejected_dir):
+        os.makedirs(rejected_dir)
+    try:
+        os.rename(os.path.join(SPOOL_DIR, fn), os.path.join(rejected_dir, fn))
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return
+    print "Codespeed rejected %s; moved it to %s" % (fn, rejected_dir)
+
+def flush_spool(max_attempts=MAX_ATTEMPTS):
+    # Returns whether the spool was completely emptied
+    if not os.path.exists(SPOOL_DIR):
+        return True
+    # The thread lock is for the other threads of this process, and the file
+    # lock for other processes.  The file lock goes away with the file,
+    # including when the process dies.
+    with _flush_lock, open(os.path.join(SPOOL_DIR, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        while True:
+            files = _spooled_files()[:BATCH_SIZE]
+            if not files:
+                return True
+
+            response = _submit_files(files, max_attempts)
+            if response is REJECTED and len(files) > 1:
+                # Send them one at a time to find out which ones it doesn't like:
+                for fn in files:
+                    response = _submit_files([fn], max_attempts)
+                    if response is None:
+                        break
+                    if response is REJECTED:
+                        _reject(fn)
+                    else:
+                        _remove(fn)
+                if response is not None:
+                    continue
+            elif response is REJECTED:
+                _reject(files[0])
+                continue
+
+            if response is None:
+                print "Leaving %d results in %s" % (len(_spooled_files()), SPOOL_DIR)
+                return False
+
+            for fn in files:
+                _remove(fn)
+            print "Submitted %d results; server (%s) response: %s" % (len(files), CODESPEED_URL, response)
+
+def _worker_loop():
+    while True:
+        _worker_wakeup.wait(1.0)
+        _worker_wakeup.clear()
+        stopping = _worker_stopping.is_set()
+        if not flush_spool() and not stopping:
+            # The server is probably down, so don't keep hammering it:
+            _worker_stopping.wait(MAX_BACKOFF)
+        if stopping:
+            return
+
+def submit(commitid, benchmark, executable, value):
+    data = _formdata(commitid, benchmark, executable, value)
+
+    print "Queueing result for executable %s, revision %s, benchmark %s" % (
+        data['executable'], data['commitid'], data['benchmark'])
+    _spool(data)
+
+    if not _worker:
+        t = threading.Thread(target=_worker_loop)
+        t.daemon = True
+        t.start()
+        _worker.append(t)
+    _worker_wakeup.set()
+
+def finish(timeout=None):
+    # Gives the background thread a chance to submit what's left in the spool.
+    if not _worker:
+        return
+    _worker_stopping.set()
+    _worker_wakeup.set()
+    _worker[0].join(timeout)
+    if _worker[0].is_alive():
+        print "Still submitting results; %d are left in %s" % (len(_spooled_files()), SPOOL_DIR)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+Looks through the run history for commits where a benchmark's times shifted
+by more than the noise, for example after a measure_all.sh sweep:
+
+python detect_regressions.py --threshold=2% [--queue]
+
+Each (executable, benchmark) series is laid out in first-parent commit order
+and split at the points where its level changes.  The changes that are both
+bigger than --threshold and statistically significant get reported, ranked by
+how far they stand out from the noise.  With --stat-category, the same is
+done for the time that pyston's stats attribute to a category such as
+"rewriter" (see pyston_stats.py), for runs that recorded them.  With --queue, each suspect commit and
+its parent get queued for confirmation reruns, which
+`python ../analysis/investigate.py --run-queue` then does.
+"""
+
+import argparse
+import collections
+import os
+import subprocess
+import sys
+
+import model
+import pyston_stats
+import stats
+
+INVESTIGATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../analysis/investigate.py")
+
+def get_commit_order(branch, src_dir):
+    revs = subprocess.check_output(["git", "rev-list", "--first-parent", "--reverse", branch], cwd=src_dir).split()
+    return dict((rev, i) for i, rev in enumerate(revs)), revs
+
+# Returns [(revision, [values])] in commit order, for the revisions on the branch
+def get_series(executable, benchmark, commit_order, stat_category=None):
+    if stat_category:
+        points = [(revision, v) for (timestamp, revision, run_id, samples) in model.get_stats_history(executable, benchmark)
+                for v in pyston_stats.rollup_category(samples, stat_category)]
+    else:
+        points = [(revision, t) for (timestamp, revision, t, run_id) in model.get_history(executable, benchmark)]
+
+    values = collections.defaultdict(list)
+    for revision, v in points:
+        if revision in commit_order and v is not None:
+            values[revision].append(v)
+    return sorted(values.items(), key=lambda (rev, _): commit_order[rev])
+
+class Suspect(object):
+    def __init__(self, executable, benchmark, revision, prev_revision, before, after):
+        self.executable = executable
+        self.benchmark = benchmark
+        self.revision = revision
+        # The last revision before this one that we have measurements for
+        self.prev_revision = prev_revision
+
+        before_medians = [stats.median(t) for (_, t) in before]
+        after_medians = [stats.median(t) for (_, t) in after]
+        old = stats.median(before_medians)
+        new = stats.median(after_medians)
+        if old:
+            self.change = (new - old) / old
+        else:
+            # A stats category that we didn't spend any time in before
+            self.change = float('inf') if new > 0 else 0.0
+        _, self.p = stats.mann_whitney(sum((t for (_, t) in before), []), sum((t for (_, t) in after), []))
+        # How many times bigger the shift is than the commit-to-commit noise
+        # on either side of it, which is what we rank by:
+        noise = 1.4826 * stats.mad([m - stats.median(before_medians) for m in before_medians] +
+                [m - stats.median(after_medians) for m in after_medians])
+        self.score = abs(self.change * old) / noise if noise else float('inf')
+
+def find_suspects(executable, benchmark, commit_order, min_segment, stat_category=None):
+    series = get_series(executable, benchmark, commit_order, stat_category)
+    medians = [stats.median(t) for (_, t) in series]
+    cps = stats.change_points(medians, min_size=min_segment)
+    bounds = [0] + cps + [len(series)]
+    rtn = []
+    for i in xrange(1, len(bounds) - 1):
+        lo, k, hi = bounds[i - 1], bounds[i], bounds[i + 1]
+        rtn.append(Suspect(executable, benchmark, series[k][0], series[k - 1][0], series[lo:k], series[k:hi]))
+    return rtn
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pyston_dir", dest="pyston_dir", action="store", default=None)
+    parser.add_argument("--branch", dest="branch", action="store", default="master")
+    parser.add_argument("--executable", dest="executables", action="append",
+            help="Which executables' history to look at (default: pyston)")
+    parser.add_argument("--benchmark-filter", "--filter", dest="benchmark_filter", action="append")
+    parser.add_argument("--threshold", dest="threshold", action="store", default="2%")
+    parser.add_argument("--alpha", dest="alpha", action="store", default="0.01", type=float,
+            help="How unlikely the shift has to be to be noise")
+    parser.add_argument("--min-segment", dest="min_segment", action="store", default="3", type=int,
+            help="How many measured commits a new level has to last for")
+    parser.add_argument("--improvements", dest="improvements", action="store_true",
+            help="Report speedups as well as regressions")
+    parser.add_argument("--stat-category", dest="stat_category", action="store",
+            help="Look at the time in this pyston stats category instead of the benchmark times")
+    parser.add_argument("--queue", dest="queue", action="store_true",
+            help="Queue confirmation reruns of the suspect commits and their parents")
+    args = parser.parse_args()
+
+    if args.pyston_dir is None:
+        args.pyston_dir = os.path.join(os.path.dirname(__file__), "../../pyston")
+    executables = args.executables or ["pyston"]
+    threshold = stats.parse_percentage(args.threshold)
+    # The confirmation reruns only measure the benchmark times:
+    assert not (args.queue and args.stat_category), "Can't --queue confirmations of stats categories"
+
+    commit_order, revs = get_commit_order(args.branch, args.pyston_dir)
+
+    suspects = []
+    for executable in executables:
+        for benchmark in model.get_benchmarks(executable):
+            if benchmark == "(calibration)":
+                continue
+            if args.benchmark_filter and not any(f in benchmark for f in args.benchmark_filter):
+                continue
+            for s in find_suspects(executable, benchmark, commit_order, args.min_segment, args.stat_category):
+                if s.p >= args.alpha or abs(s.change) < threshold:
+                    continue
+                if s.change < 0 and not args.improvements:
+                    continue
+                suspects.append(s)
+
+    if not suspects:
+        print "No shifts of more than %.1f%% found" % (threshold * 100)
+        return
+
+    suspects.sort(key=lambda s: -s.score)
+    print "%-20s %-35s %-12s %8s %8s %8s  %s" % ("executable", "benchmark", "commit", "change", "p", "score", "")
+    for s in suspects:
+        # Commits that we don't have measurements for could be to blame too:
+        untested = commit_order[s.revision] - commit_order[s.prev_revision] - 1
+        print "%-20s %-35s %-12s %+7.1f%% %8.4f %8.1f  %s" % (s.executable, s.benchmark, s.revision[:12],
+                s.change * 100, s.p, s.score,
+                "(or one of the %d commits before it)" % untested if untested else "")
+
+    if args.queue:
+        for s in suspects:
+            if not s.benchmark.endswith(".py"):
+                # Scores have to be confirmed through their benchmarks
+                continue
+            parent = revs[commit_order[s.revision] - 1]
+            reason = "%s %+.1f%% on %s" % (s.benchmark, s.change * 100, s.executable)
+            subprocess.check_call([sys.executable, INVESTIGATE, "--enqueue", parent, s.revision, s.benchmark, reason,
+                "slower" if s.change > 0 else "faster"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Checking, controlling, and recording the state of the benchmark host that
+# affects how noisy the results are: cpu frequency scaling, turbo, ASLR, etc.
+#
+# Every result gets recorded with a fingerprint of the environment it was
+# measured in, so that we don't end up comparing numbers from a tuned host
+# against numbers from an untuned one.
+
+import atexit
+import glob
+import hashlib
+import json
+import os
+import platform
+import subprocess
+
+GOVERNOR_GLOB = "/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_governor"
+# Depending on the cpufreq driver, turbo is controlled by one of these:
+INTEL_NO_TURBO = "/sys/devices/system/cpu/intel_pstate/no_turbo"
+CPUFREQ_BOOST = "/sys/devices/system/cpu/cpufreq/boost"
+ASLR = "/proc/sys/kernel/randomize_va_space"
+DROP_CACHES = "/proc/sys/vm/drop_caches"
+
+def _read(fn):
+    try:
+        with open(fn) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+def _write(fn, value):
+    with open(fn, 'w') as f:
+        f.write(value)
+
+def get_governors():
+    return sorted(set(_read(fn) for fn in glob.glob(GOVERNOR_GLOB)))
+
+def turbo_enabled():
+    if os.path.exists(INTEL_NO_TURBO):
+        return _read(INTEL_NO_TURBO) == "0"
+    if os.path.exists(CPUFREQ_BOOST):
+        return _read(CPUFREQ_BOOST) == "1"
+    return None
+
+def get_cpu_model():
+    for l in (_read("/proc/cpuinfo") or "").split('\n'):
+        if l.startswith("model name"):
+            return l.split(':', 1)[1].strip()
+    return platform.processor() or None
+
+# opts are the --stable-env settings that the benchmarks get run with
+def get_environment(opts):
+    return {
+        "cpu": get_cpu_model(),
+        "kernel": platform.release(),
+        "governors": ",".join(get_governors()) or None,
+        "turbo": turbo_enabled(),
+        "aslr": "off" if opts.get("disable_aslr") else _read(ASLR),
+        "pinned": bool(opts.get("pinned")),
+        "drop_caches": bool(opts.get("drop_caches")),
+    }
+
+def fingerprint(environment):
+    return hashlib.sha1(json.dumps(environment, sort_keys=True)).hexdigest()[:12]
+
+def check(environment):
+    # Returns a list of the things about the environment that will add noise
+    warnings = []
+    if environment["governors"] and environment["governors"] != "performance":
+        warnings.append("cpu frequency governor is %r rather than 'performance'" % environment["governors"])
+    if environment["turbo"]:
+        warnings.append("turbo is enabled")
+    if environment["aslr"] not in ("off", "0", None):
+        warnings.append("ASLR is enabled")
+    load = os.getloadavg()[0]
+    if load > 1.0:
+        warnings.append("the load average is %.2f; something else is running" % load)
+    return warnings
+
+# Puts the cpus into the most stable state we can, restoring the old settings
+# when we exit.  This needs root; returns the list of things that we couldn't do.
+def tune_host():
+    failures = []
+    saved = []
+
+    def set_value(fn, value):
+        old = _read(fn)
+        if old == value:
+            return
+        try:
+            _write(fn, value)
+            saved.append((fn, old))
+        except IOError as e:
+            failures.append("couldn't write %r to %s: %s" % (value, fn, e.strerror))
+
+    for fn in glob.glob(GOVERNOR_GLOB):
+        set_value(fn, "performance")
+    if os.path.exists(INTEL_NO_TURBO):
+        set_value(INTEL_NO_TURBO, "1")
+    elif os.path.exists(CPUFREQ_BOOST):
+        set_value(CPUFREQ_BOOST, "0")
+
+    def restore():
+        for fn, old in reversed(saved):
+            try:
+                _write(fn, old)
+            except IOError:
+                pass
+    atexit.register(restore)
+    return failures
+
+def wrap_args(args):
+    # Disables ASLR for just the benchmark process
+    return ["setarch", platform.machine(), "-R"] + args
+
+def drop_caches():
+    subprocess.check_call(["sync"])
+    _write(DROP_CACHES, "3")
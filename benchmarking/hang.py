@@ -0,0 +1,120 @@
+# Detection of benchmark runs that hang, ex because of a JIT miscompile that
+# loops forever.  A Watchdog gets started alongside each run, and if the run
+# takes longer than its timeout we grab stack samples of the benchmark
+# processes (so that we have something to debug from) and then kill the whole
+# process group.
+
+import os
+import signal
+import subprocess
+import threading
+
+import memory_sampler
+
+# How long we give gdb to attach and walk the stacks of each process
+GDB_TIMEOUT = 60
+
+def _read(fn):
+    try:
+        with open(fn) as f:
+            return f.read()
+    except IOError:
+        return None
+
+def _has_gdb():
+    return any(os.access(os.path.join(d, "gdb"), os.X_OK) for d in os.environ.get("PATH", "").split(os.pathsep))
+
+def _run_with_timeout(args, timeout):
+    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    timer = threading.Timer(timeout, p.kill)
+    timer.start()
+    try:
+        out, _ = p.communicate()
+    finally:
+        timer.cancel()
+    return out
+
+def _proc_stacks(pid):
+    # What we can see without attaching to the process: the state and kernel
+    # wait channel of each thread, and the kernel stack if we are allowed to
+    # read it.
+    lines = []
+    task_dir = "/proc/%d/task" % pid
+    try:
+        tids = sorted(int(t) for t in os.listdir(task_dir))
+    except OSError:
+        return ""
+    for tid in tids:
+        stat = _read("%s/%d/stat" % (task_dir, tid))
+        if stat is None:
+            continue
+        state = stat.rsplit(')', 1)[1].split()[0]
+        wchan = _read("%s/%d/wchan" % (task_dir, tid)) or "?"
+        lines.append("thread %d: state %s, wchan %s" % (tid, state, wchan.strip() or "0"))
+        kernel_stack = _read("%s/%d/stack" % (task_dir, tid))
+        if kernel_stack:
+            lines.extend("    " + l for l in kernel_stack.strip().split('\n'))
+    return "\n".join(lines)
+
+def capture_stacks(pid):
+    # Returns a text dump of the stacks of every benchmark process under pid
+    sections = []
+    for p in memory_sampler.get_benchmark_pids(pid):
+        cmdline = _read("/proc/%d/cmdline" % p)
+        if cmdline is None:
+            continue
+        sections.append("=== pid %d: %s" % (p, " ".join(cmdline.split('\0')).strip()))
+        sections.append(_proc_stacks(p))
+        if _has_gdb():
+            sections.append(_run_with_timeout(["gdb", "-p", str(p), "-batch", "-nx",
+                "-ex", "thread apply all bt"], GDB_TIMEOUT).strip())
+    return "\n".join(sections)
+
+# The process groups that are being watched, for kill_all
+_watched = set()
+_watched_lock = threading.Lock()
+
+def kill_all():
+    # Kills the watched runs, ex when we get interrupted: being in their own
+    # process groups, they don't get the terminal's signals, and would keep
+    # running in the background otherwise
+    with _watched_lock:
+        pgids = list(_watched)
+    for pgid in pgids:
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except OSError:
+            pass
+
+class Watchdog(threading.Thread):
+    # p has to have been started in its own process group (ie with os.setsid)
+    def __init__(self, p, timeout):
+        super(Watchdog, self).__init__()
+        self.daemon = True
+        self.p = p
+        self.timeout = timeout
+        self.timed_out = False
+        self.stacks = None
+        self._stop_event = threading.Event()
+        with _watched_lock:
+            _watched.add(p.pid)
+
+    def run(self):
+        self._stop_event.wait(self.timeout)
+        if self._stop_event.is_set():
+            return
+        self.timed_out = True
+        try:
+            self.stacks = capture_stacks(self.p.pid)
+        finally:
+            try:
+                os.killpg(self.p.pid, signal.SIGKILL)
+            except OSError:
+                # It exited while we were looking at it
+                pass
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        with _watched_lock:
+            _watched.discard(self.p.pid)
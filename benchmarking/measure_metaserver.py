@@ -55,6 +55,7 @@ def main():
     for k, v in results.items():
         name = "cpython 2.7" if CPYTHON else "pyston"
         codespeed_submit.submit(git_rev, str(k), name, v / NRUNS)
+    codespeed_submit.finish()
 
 if __name__ == "__main__":
     main()
@@ -14,83 +14,219 @@ python measure_perf.py --run-times=3 --save=meeting_XX_XX --compare=cpython --co
 """
 
 import argparse
+import collections
 import commands
 import hashlib
+import json
 import os.path
 import re
 import subprocess
 import sys
+import tempfile
 import time
 
 import codespeed_submit
+import environment
+import hang
+import memory_sampler
 import model
+import object_cache
+import perf_stat
+import pyston_stats
+import registry
+import resource_usage
+import scheduler
+import scoring
+import stats
+import warmup
 
 EXE_LEN = 20
 
-def run_tests(executables, benchmarks, filters, callbacks, benchmark_dir):
-    # times = [[] for e in executables]
-    failed = [False for e in executables]
-
-    for b in benchmarks:
-        for i, e in enumerate(executables):
-            skip = False
-            for f in filters:
-                skip = f(e, b.filename)
-                assert not isinstance(skip, float), "%r needs to be converted" % f
-                if skip:
-                    break
-
-            if not isinstance(skip, tuple) and skip:
-                # print "%s %s: skipped" % (e.name.rjust(EXE_LEN), b.filename.ljust(35))
-                failed[i] = True
-                continue
-
-            take_min = e.opts.get("take_min")
-            if isinstance(skip, float) and not take_min:
-                elapsed, size = skip
-                code = 0
-            else:
-                code = 0
-
-                args = e.args + [os.path.join(benchmark_dir, b.filename)]
-                if b.filename == "(calibration)":
-                    args = ["python", os.path.join(benchmark_dir, "fannkuch_med.py")]
-
-                if isinstance(skip, float):
-                    # print "Previous min was", skip
-                    elapsed, size = skip
-                else:
-                    elapsed = size = float('inf')
-
-                def do_run():
-                    if e.opts.get("clear_cache"):
-                        subprocess.check_call(["rm", "-rf", os.path.expanduser("~/.cache/pyston")])
-                    # print "running", args
-                    p = subprocess.Popen(["time", "-v"] + args, stdout=open("/dev/null", 'w'), stderr=subprocess.PIPE)
-                    out, err = p.communicate()
-                    assert not out
-                    code = p.wait()
-                    size = int(re.search("Maximum resident set size .*: (\\d+)", err).group(1))
-                    size = size / 1024.0 # Should this be 1000?
-                    return code, size
-
-                run_times = e.opts.get('run_times', 1)
-                if b.filename == "(calibration)":
-                    run_times = 1
-                # Warmup:
-                for _ in xrange(run_times - 1):
-                    start = time.time()
-                    code, _size = do_run()
-                    if code == 0:
-                        _e = time.time() - start
-                        if take_min:
-                            # print _e
-                            elapsed = min(elapsed, _e)
-                            size = min(size, _size)
-
-                start = time.time()
-                code, _size = do_run()
-                _e = time.time() - start
+# Marks a filter's (time, size, run_id) result as one to reuse even under --take-min
+FINISHED = "finished"
+
+# Returns ([iteration time], {phase: time}) from what iteration_timings wrote out
+def read_timings(fn):
+    iteration_times = []
+    phases = {}
+    with open(fn) as f:
+        for l in f:
+            fields = l.split()
+            if len(fields) == 1:
+                iteration_times.append(float(fields[0]))
+            elif len(fields) == 2:
+                phases[fields[0]] = float(fields[1])
+    return iteration_times, phases
+
+def make_temp_file(prefix):
+    fd, fn = tempfile.mkstemp(prefix=prefix)
+    os.close(fd)
+    return fn
+
+# Returns (exit code, max rss, info) where info has extra per-run measurements.
+# If the run takes longer than timeout seconds it gets killed, and info gets a
+# "timeout" entry with the stacks of the hung processes.
+def do_run(args, opts, cpus=None, timeout=None):
+    info = {}
+    temp_files = []
+    try:
+        timings_fn = make_temp_file("benchmark_timings_")
+        temp_files.append(timings_fn)
+        env = dict(os.environ)
+        env["BENCHMARK_TIMINGS_FILE"] = timings_fn
+        # The last argument is the benchmark; this lets benchmarks that start
+        # more processes (ex the startup ones) run them the same way:
+        env["BENCHMARK_INTERPRETER"] = json.dumps(args[:-1])
+
+        if opts.get("disable_aslr"):
+            args = environment.wrap_args(args)
+
+        if opts.get("perf_counters"):
+            perf_fn = make_temp_file("benchmark_perf_stat_")
+            temp_files.append(perf_fn)
+            args = perf_stat.wrap_args(args, perf_fn)
+
+        if opts.get("drop_caches"):
+            environment.drop_caches()
+
+        # print "running", args
+        # If it has a timeout, the benchmark gets its own process group so
+        # that if it hangs we can kill everything that it started.  Otherwise
+        # it stays in ours, so that ctrl-C reaches it.
+        p = subprocess.Popen(scheduler.pin_args(cpus, ["time", "-v"] + args), stdout=open("/dev/null", 'w'), stderr=subprocess.PIPE, env=env,
+                preexec_fn=os.setsid if timeout else None)
+        sampler = None
+        if opts.get("memory_interval"):
+            sampler = memory_sampler.Sampler(p.pid, opts["memory_interval"])
+            sampler.start()
+        watchdog = None
+        if timeout:
+            watchdog = hang.Watchdog(p, timeout)
+            watchdog.start()
+        try:
+            out, err = p.communicate()
+            assert not out
+            code = p.wait()
+        finally:
+            series = sampler.stop() if sampler else None
+        if watchdog:
+            watchdog.stop()
+            if watchdog.timed_out:
+                info["timeout"] = {"seconds": timeout, "stacks": watchdog.stacks}
+                return code, 0.0, info
+        if series is not None:
+            info["memory_series"] = series
+            info["memory"] = memory_sampler.summarize(series)
+        usage = resource_usage.parse(err)
+        info["resource_usage"] = usage
+        pyston_counters = pyston_stats.parse(err)
+        if pyston_counters:
+            info["pyston_stats"] = pyston_counters
+        size = usage["max_rss_kb"] / 1024.0 # Should this be 1000?
+
+        iteration_times, phases = read_timings(timings_fn)
+        if iteration_times:
+            info["iteration_times"] = iteration_times
+        if phases:
+            info["phases"] = phases
+        if opts.get("perf_counters"):
+            info["counters"] = perf_stat.parse_output(perf_fn)
+    finally:
+        for fn in temp_files:
+            os.remove(fn)
+    return code, size, info
+
+def needs_more_runs(samples, runs_done, opts):
+    target_ci = opts.get('target_ci')
+    if not target_ci or runs_done >= opts.get('max_runs', runs_done):
+        return False
+    times = [t for (t, _) in samples]
+    # The bootstrap isn't meaningful with only a couple of samples:
+    if len(times) < 3:
+        return True
+    return stats.relative_ci_width(times) > target_ci
+
+# Sets up the object cache the way that the given cache state calls for, and
+# returns a snapshot of it to restore before each run.
+def prepare_cache_state(state, e, benchmark_args, cpus):
+    assert state in object_cache.STATES, state
+    object_cache.clear()
+    if state == "warm":
+        prime_args = benchmark_args
+    elif state == "warm_prev":
+        prime_args = e.opts["cache_prev_args"] + benchmark_args[-1:]
+    if state != "cold":
+        code, _, _ = do_run(prime_args, {}, cpus)
+        assert code == 0, "Couldn't populate the cache: %s exited with code %d" % (prime_args, code)
+    return object_cache.save_snapshot()
+
+def run_benchmark(e, b, skip, benchmark_dir, cpus, timeout=None):
+    take_min = e.opts.get("take_min")
+    take_median = e.opts.get("take_median")
+    code = 0
+
+    args = e.args + [os.path.join(benchmark_dir, b.filename)]
+    if b.filename == "(calibration)":
+        args = ["python", os.path.join(benchmark_dir, "fannkuch_med.py")]
+
+    if isinstance(skip, tuple):
+        # print "Previous min was", skip
+        elapsed, size = skip[:2]
+    else:
+        elapsed = size = float('inf')
+
+    # (elapsed, size) of every successful run:
+    samples = []
+    # Other per-run measurements of the successful runs, ex per-iteration
+    # timings for the benchmarks that report them:
+    details = {"samples": samples}
+
+    run_times = e.opts.get('run_times', 1)
+    opts = e.opts
+    if b.filename == "(calibration)":
+        run_times = 1
+        opts = dict(opts, target_ci=None)
+
+    cache_state = e.opts.get("cache_state")
+    cache_snapshot = None
+    if cache_state and b.filename != "(calibration)":
+        cache_snapshot = prepare_cache_state(cache_state, e, args, cpus)
+
+    # The first run_times - 1 runs are warmups unless we are aggregating over
+    # all of them, and if we are trying to hit a target confidence interval
+    # we keep going until we do (or hit --max-runs):
+    try:
+        runs_done = 0
+        while True:
+            if cache_snapshot:
+                object_cache.restore_snapshot(cache_snapshot)
+                cache_entries_before = object_cache.stats()[0]
+
+            registry.run_setup(b.filename, benchmark_dir)
+
+            start = time.time()
+            code, _size, info = do_run(args, opts, cpus, timeout)
+            _e = time.time() - start
+            runs_done += 1
+
+            if "timeout" in info:
+                details["timeout"] = info["timeout"]
+                break
+
+            # The startup benchmarks report the time of each of the fresh
+            # processes that they start, which don't have a warmup to look at:
+            if "iteration_times" in info and "phases" not in info and registry.has_warmup(b.filename):
+                info["warmup"] = warmup.analyze(info["iteration_times"])
+
+            if cache_snapshot:
+                cache_entries, cache_size = object_cache.stats()
+                info["cache"] = {"entries": cache_entries, "size_mb": cache_size / 1024.0 ** 2,
+                        "new_entries": cache_entries - cache_entries_before}
+
+            if code == 0:
+                samples.append((_e, _size))
+                for k, v in info.items():
+                    details.setdefault(k, []).append(v)
                 if take_min:
                     # print _e
                     elapsed = min(elapsed, _e)
@@ -99,42 +235,218 @@ def run_tests(executables, benchmarks, filters, callbacks, benchmark_dir):
                     elapsed = _e
                     size = _size
 
-            if code != 0:
+            if runs_done < run_times:
+                continue
+            if code != 0 or not needs_more_runs(samples, runs_done, opts):
+                break
+    finally:
+        if cache_snapshot:
+            object_cache.discard_snapshot(cache_snapshot)
+
+    if take_median and samples:
+        elapsed = stats.median([t for (t, _) in samples])
+        size = stats.median([m for (_, m) in samples])
+
+    return code, elapsed, size, details
+
+def format_samples(samples):
+    times = [t for (t, _) in samples]
+    lo, hi = stats.bootstrap_ci(times)
+    return "[median %.2fs, MAD %.3fs, 95%% CI %.2f-%.2fs, n=%d]" % (stats.median(times), stats.mad(times), lo, hi, len(times))
+
+# The phases that the startup benchmarks report, in the order they happen:
+STARTUP_PHASES = ["launch", "import", "run", "exit"]
+
+def format_phases(phases):
+    return "[%s]" % ", ".join("%s %.1fms" % (name, phases[name] * 1000) for name in STARTUP_PHASES if name in phases)
+
+def format_cache(cache):
+    s = "[cache %.1fMB, %d entries" % (cache["size_mb"], cache["entries"])
+    if "hit_rate" in cache:
+        s += ", %.0f%% hits" % (cache["hit_rate"] * 100)
+    return s + "]"
+
+# Runs never time out sooner than this, so that noise in short benchmarks
+# doesn't get them killed:
+MIN_TIMEOUT = 60
+# How many of the most recent runs the timeouts are based on
+TIMEOUT_HISTORY = 10
+
+def get_timeout(exe_name, benchmark, factor):
+    info = registry.get(benchmark)
+    if info and info.timeout:
+        return info.timeout
+    if not factor:
+        return None
+    times = [t for (_, _, t, _) in model.get_history(exe_name, benchmark)[-TIMEOUT_HISTORY:] if t is not None]
+    if not times:
+        # We have nothing to go on for the first run
+        return None
+    return max(factor * stats.median(times), MIN_TIMEOUT)
+
+def median_counter(counters, name):
+    values = [c[name] for c in counters if name in c]
+    if not values:
+        return None
+    return stats.median(values)
+
+# timeouts is a {(executable name, benchmark): seconds} dict of how long each
+# run gets before we consider it hung, and timeout_callbacks get called with
+# (exe, benchmark, timeout info) for the ones that do hang.
+def run_tests(executables, benchmarks, filters, callbacks, benchmark_dir, jobs=1, isolate=False, timeouts=None,
+        timeout_callbacks=()):
+    # {benchmark: (elapsed, size, [sample times])} for each executable
+    results = [{} for e in executables]
+    failed = [False for e in executables]
+
+    # How many cache entries the cold run of each benchmark wrote out:
+    cold_cache_entries = {}
+
+    pool = scheduler.make_pool(jobs, isolate)
+
+    # Runs can finish out of order when running in parallel, but we report them
+    # (and call the callbacks) in the same order that we would have run them in:
+    pending = collections.deque()
+    def report_finished(block):
+        while pending:
+            i, e, b, r = pending[0]
+            # r is None until a parallel job gets submitted (see below)
+            if not block and (r is None or not r.done()):
+                break
+            pending.popleft()
+            code, elapsed, size, details = r.get()
+
+            if "timeout" in details:
+                print "%s %s: timed out after %.0fs" % (e.name.rjust(EXE_LEN), b.filename.ljust(35),
+                        details["timeout"]["seconds"]),
+                failed[i] = True
+                for cb in timeout_callbacks:
+                    cb(e, b.filename, details["timeout"])
+            elif code != 0:
                 print "%s %s: failed (code %d)" % (e.name.rjust(EXE_LEN), b.filename.ljust(35), code),
                 failed[i] = True
             else:
                 print "%s %s: % 6.2fs (%2.1fMB)" % (e.name.rjust(EXE_LEN), b.filename.ljust(35), elapsed, size),
-
-                # times[i].append(elapsed)
+                if len(details["samples"]) > 1:
+                    print format_samples(details["samples"]),
+                if "warmup" in details:
+                    print warmup.format_summary(details["warmup"][-1]),
+                    if e.opts.get("warmup_curve"):
+                        print
+                        print warmup.format_curve(details["iteration_times"][-1]),
+                if details.get("counters"):
+                    instructions = median_counter(details["counters"], "instructions")
+                    if instructions is not None:
+                        print "[%.2fG instrs]" % (instructions / 1e9),
+                if details.get("phases"):
+                    print format_phases(details["phases"][-1]),
+                if details.get("cache"):
+                    if e.opts.get("cache_state") == "cold":
+                        cold_cache_entries[b.filename] = stats.median([c["new_entries"] for c in details["cache"]])
+                    for c in details["cache"]:
+                        hit_rate = object_cache.get_hit_rate(c["new_entries"], cold_cache_entries.get(b.filename))
+                        if hit_rate is not None:
+                            c["hit_rate"] = hit_rate
+                    print format_cache(details["cache"][-1]),
+                if details.get("memory") and details["memory"][-1]:
+                    print memory_sampler.format_summary(details["memory"][-1]),
+
+                results[i][b.filename] = (elapsed, size, [t for (t, _) in details["samples"]])
 
                 for cb in callbacks:
-                    cb(e, b.filename, elapsed, size)
+                    cb(e, b.filename, elapsed, size, details)
 
             print
+            sys.stdout.flush()
+
+    def submit(e, b, skip):
+        info = registry.get(b.filename)
+        # Benchmarks that modify the same on-disk state can't run concurrently:
+        lock_names = [info.shared_state] if info and info.shared_state else []
+        if "lock" in e.opts:
+            lock_names.append(e.opts["lock"])
+        timeout = (timeouts or {}).get((e.name, b.filename))
+        return pool.submit(lambda cpus, e=e, b=b, skip=skip, timeout=timeout:
+                    run_benchmark(e, b, skip, benchmark_dir, cpus, timeout),
+                lock_names)
+
+    # [(pending entry, skip)] of the jobs to hand to a parallel pool
+    parallel_jobs = []
+
+    work = [(b, i, e) for b in benchmarks for i, e in enumerate(executables)]
+    # Runs with a timeout are in their own process groups, which don't get the
+    # ctrl-C from the terminal, so those have to be killed by hand:
+    try:
+        for b, i, e in work:
+            skip = False
+            for f in filters:
+                skip = f(e, b.filename)
+                assert not isinstance(skip, float), "%r needs to be converted" % f
+                if skip:
+                    break
 
-    '''
-    geomean_str = " ".join(sorted([os.path.basename(b.filename) for b in benchmarks if b.include_in_average]))
-    geomean_name = "(geomean-%s)" % (hashlib.sha1(geomean_str).hexdigest()[:4])
+            if not isinstance(skip, tuple) and skip:
+                # print "%s %s: skipped" % (e.name.rjust(EXE_LEN), b.filename.ljust(35))
+                failed[i] = True
+                continue
+
+            take_min = e.opts.get("take_min")
+            # Filters can return a previous (time, size, run_id) result, which
+            # we reuse as-is unless we are trying to improve on its min.  Results
+            # that are already FINISHED (earlier in this sweep) are always reused.
+            if isinstance(skip, tuple) and (not take_min or skip[3:] == (FINISHED,)):
+                elapsed, size, run_id = skip[:3]
+                r = scheduler.Result()
+                r.set((0, elapsed, size, {"samples": [], "run_id": run_id}))
+            elif jobs > 1:
+                entry = [i, e, b, None]
+                pending.append(entry)
+                parallel_jobs.append((entry, skip))
+                continue
+            else:
+                r = submit(e, b, skip)
+
+            pending.append((i, e, b, r))
+            report_finished(block=False)
+
+        # Hand out the longest jobs first, so that we don't end up waiting on
+        # one long job at the end while the other workers sit idle.  This only
+        # changes the order that they run in; they still get reported in the
+        # usual order.
+        def expected_runtime(b):
+            info = registry.get(b.filename)
+            return info.expected_runtime if info else 0
+        parallel_jobs.sort(key=lambda (entry, skip): -expected_runtime(entry[2]))
+        for entry, skip in parallel_jobs:
+            entry[3] = submit(entry[1], entry[2], skip)
+
+        report_finished(block=True)
+    except KeyboardInterrupt:
+        hang.kill_all()
+        raise
+
+    weights = dict((b.filename, b.weight) for b in benchmarks if b.include_in_average)
+    if not weights:
+        return
+    geomean_name = scoring.geomean_name(weights)
 
     for i, e in enumerate(executables):
-        if failed[i]:
+        # Only score the executables that have results for all of the benchmarks:
+        if not all(b in results[i] for b in weights):
             continue
 
-        time_list = times[i]
-        assert len(time_list) == len(benchmarks)
-        t = 1
-        n = 0
-        for j, elapsed in enumerate(time_list):
-            if not benchmarks[j].include_in_average:
-                continue
-            t *= elapsed
-            n += 1
-        t **= (1.0 / n)
-        print "%s %s: % 6.2fs" % (e.name.rjust(EXE_LEN), geomean_name.ljust(35), t),
+        t = scoring.geomean(dict((b, results[i][b][0]) for b in weights), weights)
+        size = scoring.geomean(dict((b, results[i][b][1]) for b in weights), weights)
+        # Previous results that we reused don't have samples:
+        samples = dict((b, results[i][b][2] or [results[i][b][0]]) for b in weights)
+        lo, hi = scoring.geomean_ci(samples, weights)
+        details = {"samples": [], "score": [{"ci_lo": lo, "ci_hi": hi, "benchmarks": len(weights)}]}
+
+        print "%s %s: % 6.2fs (%2.1fMB) [95%% CI %.2f-%.2fs]" % (e.name.rjust(EXE_LEN), geomean_name.ljust(35), t,
+                size, lo, hi),
         for cb in callbacks:
-            cb(e, geomean_name, t)
+            cb(e, geomean_name, t, size, details)
         print
-    '''
 
 
 class Executable(object):
@@ -144,9 +456,11 @@ class Executable(object):
         self.opts = opts
 
 class Benchmark(object):
-    def __init__(self, filename, include_in_average):
+    def __init__(self, filename, include_in_average, weight=1.0):
         self.filename = filename
         self.include_in_average = include_in_average
+        # How much this benchmark counts for in the geomean
+        self.weight = weight
 
 def get_git_rev(src_dir, allow_dirty):
     if not allow_dirty:
@@ -160,40 +474,86 @@ def get_git_rev(src_dir, allow_dirty):
     assert p.poll() == 0
     return out.strip()
 
+def get_clean_git_rev(src_dir):
+    # For labeling the run history, where we don't want to fail on a dirty tree
+    try:
+        return get_git_rev(src_dir, False)
+    except (AssertionError, OSError):
+        return None
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--pyston_dir", dest="pyston_dir", action="store", default=None)
     parser.add_argument("--submit", dest="submit", action="store_true")
+    parser.add_argument("--flush-spool", dest="flush_spool", action="store_true")
     parser.add_argument("--no-run-pyston", dest="run_pyston", action="store_false", default=True)
     parser.add_argument("--run-pyston-interponly", dest="run_pyston_interponly", action="store_true", default=False)
     parser.add_argument("--run-pyston-nocache", dest="run_pyston_nocache", action="store_true", default=False)
+    parser.add_argument("--cache-states", dest="cache_states", action="store", default=None,
+            help="Comma-separated object cache states to run pyston in: %s" % ",".join(object_cache.STATES))
+    parser.add_argument("--cache-prev-executable", dest="cache_prev_executable", action="store", default=None,
+            help="The pyston of the previous revision, for populating the cache in the warm_prev state")
     parser.add_argument("--run-cpython", action="store", nargs="?", default=None, const="python")
     parser.add_argument("--run-pypy", action="store", nargs="?", default=None, const="pypy")
     parser.add_argument("--save", dest="save_report", action="store", nargs="?", default=None, const="tmp")
     parser.add_argument("--compare", dest="compare_to", action="append", nargs="?", default=None, const="tmp")
     parser.add_argument("--clear", dest="clear", action="store", nargs="?", default=None, const="tmp")
     parser.add_argument("--use-previous", action="store_true")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", default=True)
     parser.add_argument("--save-by-commit", dest="save_by_commit", action="store_true")
     parser.add_argument("--view", dest="view", action="store", nargs="?", default=None, const="last")
     parser.add_argument("--allow-dirty", dest="allow_dirty", action="store_true")
     parser.add_argument("--list-reports", dest="list_reports", action="store_true")
+    parser.add_argument("--show-timeout", dest="show_timeout", action="store", type=int,
+            help="Print the stacks that were captured when the given run timed out")
     parser.add_argument("--pyston-executables-subdir", dest="pyston_executables_subdir", action="store", default=".")
     parser.add_argument("--pyston-executable", dest="pyston_executable", action="store")
     parser.add_argument("--pyston-executable-name", action="store")
     parser.add_argument("--run-times", dest="run_times", action="store", default='1')
     parser.add_argument("--extra-jit-args", dest="extra_jit_args", action="append")
+    parser.add_argument("--pyston-stats", dest="pyston_stats", action="store_true",
+            help="Record pyston's stats counters and timers with each run")
     parser.add_argument("--take-min", action="store_true")
+    parser.add_argument("--take-median", action="store_true")
+    parser.add_argument("--target-ci", dest="target_ci", action="store", default=None)
+    parser.add_argument("--max-runs", dest="max_runs", action="store", default=None)
+    parser.add_argument("--perf-counters", dest="perf_counters", action="store_true")
+    parser.add_argument("--warmup-curve", dest="warmup_curve", action="store_true")
+    parser.add_argument("--startup", dest="startup", action="store_true", help="Run the startup benchmarks")
+    parser.add_argument("--sample-memory", dest="sample_memory", action="store", nargs="?", default=None, const="10",
+            help="Sample the memory usage of the benchmarks every N milliseconds (default 10)")
     parser.add_argument("--benchmark-filter", "--filter", dest="benchmark_filter", action="append")
     parser.add_argument("--all-benchmarks", action="store_true")
+    parser.add_argument("-j", "--jobs", dest="jobs", action="store", default='1')
+    parser.add_argument("--stable-env", dest="stable_env", action="store_true",
+            help="Check the host for sources of noise, run benchmarks without ASLR, and pin them to isolated cores")
+    parser.add_argument("--tune-host", dest="tune_host", action="store_true",
+            help="Set the performance governor and disable turbo for the duration of the run (needs root)")
+    parser.add_argument("--drop-caches", dest="drop_caches", action="store_true",
+            help="Drop the page cache before every run (needs root)")
+    parser.add_argument("--timeout-factor", dest="timeout_factor", action="store", default="5",
+            help="Consider a run hung once it takes this many times its recent median (0 to disable)")
     args = parser.parse_args()
 
+    if args.flush_spool:
+        if not codespeed_submit.flush_spool():
+            sys.exit(1)
+        return
+
     if args.list_reports:
         for report_name in model.list_reports():
             print report_name
         return
 
+    if args.show_timeout is not None:
+        stacks = model.get_timeout_stacks(args.show_timeout)
+        assert stacks is not None, "No timeout %d" % args.show_timeout
+        print stacks
+        return
+
     if args.clear:
         model.clear_report(args.clear)
+        model.commit()
         return
 
     executables = []
@@ -205,6 +565,8 @@ def main():
         args.pyston_dir = os.path.join(os.path.dirname(__file__), "../../pyston")
 
     extra_jit_args = args.extra_jit_args or []
+    if args.pyston_stats:
+        extra_jit_args.append(pyston_stats.STATS_OPTION)
 
     pyston_executable = args.pyston_executable
     if not pyston_executable:
@@ -222,9 +584,48 @@ def main():
     global_opts = {}
     global_opts['take_min'] = args.take_min
     global_opts['run_times'] = int(args.run_times)
+    assert not (args.take_min and args.take_median), "Can only use one of --take-min and --take-median"
+    global_opts['take_median'] = args.take_median
+    global_opts['perf_counters'] = args.perf_counters
+    global_opts['warmup_curve'] = args.warmup_curve
+    if args.sample_memory:
+        global_opts['memory_interval'] = float(args.sample_memory) / 1000.0
+    if args.tune_host:
+        for failure in environment.tune_host():
+            print "Warning:", failure
+    if args.drop_caches:
+        # Dropping the caches under a concurrent run would slow it down too
+        assert int(args.jobs) == 1, "Can't use --drop-caches with --jobs"
+        try:
+            environment.drop_caches()
+        except IOError as e:
+            assert False, "Couldn't drop caches (--drop-caches needs root): %s" % e.strerror
+        global_opts['drop_caches'] = True
+    if args.stable_env:
+        global_opts['disable_aslr'] = True
+    global_opts['pinned'] = scheduler.is_pinned(int(args.jobs), args.stable_env)
+    host_environment = environment.get_environment(global_opts)
+    if args.stable_env:
+        for warning in environment.check(host_environment):
+            print "Warning:", warning
+    if args.target_ci:
+        global_opts['target_ci'] = stats.parse_percentage(args.target_ci)
+        global_opts['max_runs'] = int(args.max_runs or 20)
+        assert global_opts['max_runs'] >= global_opts['run_times']
+
+    cache_states = args.cache_states.split(',') if args.cache_states else []
+    for state in cache_states:
+        assert state in object_cache.STATES, "Unknown cache state %r" % state
+    if "warm_prev" in cache_states:
+        assert args.cache_prev_executable, "--cache-states=warm_prev needs --cache-prev-executable"
+
+    pyston_opts = dict(global_opts)
+    if args.run_pyston_nocache or cache_states:
+        # Clearing the cache would interfere with any concurrently-running pyston processes:
+        pyston_opts['lock'] = "pyston_cache"
 
     if args.run_pyston:
-        executables.append(Executable([pyston_executable] + extra_jit_args, pyston_executable_name, global_opts))
+        executables.append(Executable([pyston_executable] + extra_jit_args, pyston_executable_name, pyston_opts))
 
     if args.run_cpython:
         python_executable = args.run_cpython
@@ -239,51 +640,31 @@ def main():
         pypy_name = "pypy %s" % pypy_build
         executables.append(Executable([pypy_executable], pypy_name, global_opts))
 
-    main_benchmarks = [
-        "django_template3_10x.py",
-        "pyxl_bench_10x.py",
-        "sqlalchemy_imperative2_10x.py",
-        ]
-
-    perf_tracking_benchmarks = [
-        "django_migrate.py",
-        "virtualenv_bench.py",
-        "interp2.py",
-        "raytrace.py",
-        "nbody.py",
-        "fannkuch.py",
-        "chaos.py",
-        "fasta.py",
-        "pidigits.py",
-        "richards.py",
-        "deltablue.py",
-        "django_template2.py",
-        "django_template.py",
-    ]
-
-    unaveraged_benchmarks = [
-        "django_template3.py",
-        "pyxl_bench.py",
-        "pyxl_bench2.py",
-        "sqlalchemy_imperative2.py",
-        "pyxl_bench2_10x.py",
-    ]
-
-    compare_to_interp_benchmarks = [
-            "django_migrate.py",
-            "sre_parse_parse.py",
-            "raytrace_small.py",
-            "deltablue.py",
-            "richards.py",
-            ]
+    main_benchmarks = registry.in_group("main")
+    perf_tracking_benchmarks = registry.in_group("perf_tracking")
+    unaveraged_benchmarks = registry.in_group("unaveraged")
+    compare_to_interp_benchmarks = registry.in_group("interp")
+    # Benchmarks that report their per-iteration times:
+    warmup_curve_benchmarks = registry.with_inner_timings()
+    # Benchmarks that time lots of short-lived processes:
+    startup_benchmarks = registry.in_group("startup")
 
     if args.run_pyston_nocache:
-        opts = dict(global_opts)
-        opts['clear_cache'] = True
+        opts = dict(pyston_opts)
+        opts['cache_state'] = "cold"
         executables.append(Executable([pyston_executable] + extra_jit_args, "pyston_nocache", opts))
 
+    # Run the states in a fixed order, so that the cold run of each benchmark
+    # (which the hit rates get computed from) comes first:
+    for state in sorted(set(cache_states), key=object_cache.STATES.index):
+        opts = dict(pyston_opts)
+        opts['cache_state'] = state
+        if state == "warm_prev":
+            opts['cache_prev_args'] = [args.cache_prev_executable] + extra_jit_args
+        executables.append(Executable([pyston_executable] + extra_jit_args, "pyston_%s" % state, opts))
+
     if args.run_pyston_interponly:
-        executables.append(Executable([pyston_executable, "-I"] + extra_jit_args, "pyston_interponly", global_opts))
+        executables.append(Executable([pyston_executable, "-I"] + extra_jit_args, "pyston_interponly", pyston_opts))
         unaveraged_benchmarks += set(compare_to_interp_benchmarks).difference(main_benchmarks)
 
         def interponly_filter(exe, benchmark):
@@ -298,26 +679,56 @@ def main():
         filters.append(benchmark_filter)
 
     benchmarks = ([Benchmark("(calibration)", False)] +
-            [Benchmark(b, True) for b in main_benchmarks] +
+            [Benchmark(b, True, registry.get(b).weight) for b in main_benchmarks] +
             [Benchmark(b, False) for b in unaveraged_benchmarks])
 
     if args.all_benchmarks:
         benchmarks += [Benchmark(b, False) for b in perf_tracking_benchmarks]
 
+    if args.warmup_curve:
+        benchmarks = [Benchmark(b, False) for b in warmup_curve_benchmarks]
+
+    if args.startup:
+        benchmarks = [Benchmark(b, False) for b in startup_benchmarks]
+
     benchmark_dir = os.path.join(os.path.dirname(__file__), "benchmark_suite")
 
     git_rev = None
 
     if args.view:
+        view_results = model.get_results([args.view])
         def view_filter(exe, benchmark):
-            v = model.get_result(args.view, benchmark)
+            v = view_results.get((args.view, benchmark))
             if v is not None:
                 return v
             return True
         filters.append(view_filter)
 
+    pyston_rev = []
+    def get_revision(exe):
+        if 'pyston' not in exe.name.lower():
+            return None
+        if not pyston_rev:
+            pyston_rev.append(git_rev or get_clean_git_rev(args.pyston_dir))
+        return pyston_rev[0]
+
+    def record_callback(exe, benchmark, elapsed, size, details):
+        if "run_id" in details:
+            # A previous result that we are reusing
+            return
+        details["run_id"] = model.add_run(benchmark, exe.name, get_revision(exe), elapsed, size, details,
+                env=host_environment)
+    callbacks.append(record_callback)
+
+    timeout_callbacks = []
+    def record_timeout_callback(exe, benchmark, timeout):
+        timeout_id = model.add_timeout(benchmark, exe.name, get_revision(exe), timeout["seconds"], timeout["stacks"],
+                env=host_environment)
+        print "(stacks saved as timeout %d)" % timeout_id,
+    timeout_callbacks.append(record_timeout_callback)
+
     if args.submit:
-        def submit_callback(exe, benchmark, elapsed, size):
+        def submit_callback(exe, benchmark, elapsed, size, details):
             benchmark = os.path.basename(benchmark)
 
             if benchmark.endswith(".py"):
@@ -347,38 +758,115 @@ def main():
 
     if args.save_by_commit:
         git_rev = git_rev or get_git_rev(args.pyston_dir, args.allow_dirty)
-        def save_callback(exe, benchmark, elapsed, size):
+        def save_callback(exe, benchmark, elapsed, size, details):
             report_name = report_name_for_exe(exe)
-            model.save_result(report_name, benchmark, elapsed, size)
+            model.set_report_run(report_name, benchmark, details["run_id"])
         callbacks.append(save_callback)
 
     if args.compare_to:
         print "Comparing to '%s'" % args.compare_to
-        def compare_callback(exe, benchmark, elapsed, size):
+        def compare_callback(exe, benchmark, elapsed, size, details):
+            this_environment = model.get_run_environment(details["run_id"])
             for report_name in args.compare_to:
+                other_environment = model.get_report_environment(report_name, benchmark)
+                if this_environment and other_environment and this_environment != other_environment:
+                    print "(%s was measured in a different environment: %s vs %s)" % (report_name,
+                            other_environment, this_environment),
+                    continue
+
                 v = model.get_result(report_name, benchmark)
                 if v is None:
                     print "(no %s)" % report_name,
                 else:
                     print "%s: %.2fs (%s%%)" % (report_name, v[0], "{:5.1f}".format((elapsed - v[0]) / v[0] * 100)),
+
+                times = [t for (t, _) in details["samples"]]
+                other_times = [t for (t, _) in model.get_samples(report_name, benchmark)]
+                if len(times) > 1 and len(other_times) > 1:
+                    old_median = stats.median(other_times)
+                    diff = (stats.median(times) - old_median) / old_median * 100
+                    u, p = stats.mann_whitney(times, other_times)
+                    print "[median %+.1f%%, p=%.3f%s]" % (diff, p, "*" if p < 0.05 else ""),
+
+                score = details.get("score", [])
+                other_score = model.get_score(report_name, benchmark)
+                if score and other_score:
+                    overlap = score[0]["ci_lo"] <= other_score[0]["ci_hi"] and other_score[0]["ci_lo"] <= score[0]["ci_hi"]
+                    print "[%s: CI %.2f-%.2fs]" % ("within noise" if overlap else "significant",
+                            other_score[0]["ci_lo"], other_score[0]["ci_hi"]),
+
+                instructions = median_counter(details.get("counters", []), "instructions")
+                other_instructions = median_counter(model.get_counters(report_name, benchmark), "instructions")
+                if instructions is not None and other_instructions is not None:
+                    print "[instrs %+.2f%%]" % ((instructions - other_instructions) / other_instructions * 100),
+
+                steady = [w["steady_iteration_time"] for w in details.get("warmup", [])]
+                other_steady = [w["steady_iteration_time"] for w in model.get_warmup(report_name, benchmark)]
+                if steady and other_steady:
+                    old_steady = stats.median(other_steady)
+                    print "[steady %+.1f%%]" % ((stats.median(steady) - old_steady) / old_steady * 100),
+
+                usage = details.get("resource_usage", [])
+                other_usage = model.get_resource_usage(report_name, benchmark)
+                if usage and other_usage:
+                    sys_time = stats.median([u["sys_time"] for u in usage])
+                    other_sys_time = stats.median([u["sys_time"] for u in other_usage])
+                    faults = stats.median([resource_usage.total_faults(u) for u in usage])
+                    other_faults = stats.median([resource_usage.total_faults(u) for u in other_usage])
+                    print "[sys %.2fs (%+.2fs), faults %d (%+d)]" % (sys_time, sys_time - other_sys_time,
+                            faults, faults - other_faults),
+
+                phases = details.get("phases", [])
+                other_phases = model.get_phases(report_name, benchmark)
+                if phases and other_phases:
+                    diffs = []
+                    for name in STARTUP_PHASES:
+                        new = [p[name] for p in phases if name in p]
+                        old = [p[name] for p in other_phases if name in p]
+                        if new and old:
+                            diffs.append("%s %+.1fms" % (name, (stats.median(new) - stats.median(old)) * 1000))
+                    print "[%s]" % ", ".join(diffs),
+
+                cache = details.get("cache", [])
+                other_cache = model.get_cache(report_name, benchmark)
+                if cache and other_cache:
+                    size = stats.median([c["size_mb"] for c in cache])
+                    other_size = stats.median([c["size_mb"] for c in other_cache])
+                    cache_str = "cache %+.1fMB" % (size - other_size)
+                    hit_rates = [c["hit_rate"] for c in cache if "hit_rate" in c]
+                    other_hit_rates = [c["hit_rate"] for c in other_cache if "hit_rate" in c]
+                    if hit_rates and other_hit_rates:
+                        cache_str += ", hits %+.0f%%" % ((stats.median(hit_rates) - stats.median(other_hit_rates)) * 100)
+                    print "[%s]" % cache_str,
+
+                memory = [m for m in details.get("memory", []) if m]
+                other_memory = [m for m in model.get_memory(report_name, benchmark) if m]
+                if memory and other_memory:
+                    diffs = []
+                    for metric in ["rss_peak_mb", "rss_mean_mb", "rss_auc_mb_s"]:
+                        old = stats.median([m[metric] for m in other_memory])
+                        new = stats.median([m[metric] for m in memory])
+                        diffs.append((new - old) / old * 100 if old else 0.0)
+                    print "[rss peak %+.1f%%, mean %+.1f%%, area %+.1f%%]" % tuple(diffs),
         callbacks.append(compare_callback)
 
+    clear_save_report = False
     if args.save_report:
         assert len(executables) == 1, "Can't save a run on multiple executables"
 
-        if not args.use_previous and args.save_report != args.view:
-            model.clear_report(args.save_report)
+        # (This gets cleared once we know we aren't resuming a sweep that already saved to it)
+        clear_save_report = not args.use_previous and args.save_report != args.view
         print "Saving results as '%s'" % args.save_report
-        def save_report_callback(exe, benchmark, elapsed, size):
+        def save_report_callback(exe, benchmark, elapsed, size, details):
             old_val = model.get_result(args.save_report, benchmark)
-            model.save_result(args.save_report, benchmark, elapsed, size)
+            model.set_report_run(args.save_report, benchmark, details["run_id"])
             if old_val is not None and args.take_min:
                 print "(prev min: %.2fs / %2.1fMB)" % (old_val[0], old_val[1]),
         callbacks.append(save_report_callback)
 
     tmp_results = []
-    def save_last_callback(exe, benchmark, elapsed, size):
-        tmp_results.append((exe, benchmark, elapsed, size))
+    def save_last_callback(exe, benchmark, elapsed, size, details):
+        tmp_results.append((benchmark, details["run_id"]))
     callbacks.append(save_last_callback)
 
     if args.use_previous:
@@ -387,23 +875,85 @@ def main():
         else:
             git_rev = git_rev or get_git_rev(args.pyston_dir, args.allow_dirty)
             skip_report_name = report_name_for_exe
+        previous_results = model.get_results(set(skip_report_name(e) for e in executables))
         def repeated_filter(exe, benchmark):
-            v = model.get_result(skip_report_name(exe), benchmark)
+            v = previous_results.get((skip_report_name(exe), benchmark))
             if v:
                 return v
             return False
         filters.append(repeated_filter)
 
+    sweep_id = None
+    if not args.view:
+        # Rerunning the same command after an interruption picks up the
+        # unfinished sweep instead of starting over:
+        sweep_key = hashlib.sha1(repr((
+            [(e.name, e.args, sorted(e.opts.items())) for e in executables],
+            [b.filename for b in benchmarks],
+            args.save_report, args.save_by_commit, args.use_previous, args.benchmark_filter,
+            get_clean_git_rev(args.pyston_dir)))).hexdigest()
+        if args.resume:
+            sweep_id = model.find_unfinished_sweep(sweep_key)
+        if sweep_id is None:
+            sweep_id = model.start_sweep(sweep_key, [(e.name, b.filename) for b in benchmarks for e in executables])
+            if clear_save_report:
+                model.clear_report(args.save_report)
+            model.commit()
+            finished_units = {}
+        else:
+            finished_units = dict((k, result) for k, (state, result) in model.get_sweep_units(sweep_id).items()
+                    if state == "finished" and result)
+            print "Resuming an interrupted sweep; %d results are already done" % len(finished_units)
+
+        # The finished units get reused, so that they still get reported and
+        # count towards the geomean:
+        def finished_filter(exe, benchmark):
+            result = finished_units.get((exe.name, benchmark))
+            if result:
+                return result + (FINISHED,)
+            return False
+        filters.insert(0, finished_filter)
+
+        # This goes last, so it only sees the units that are actually going to run:
+        def running_filter(exe, benchmark):
+            model.set_sweep_unit(sweep_id, exe.name, benchmark, "running")
+            model.commit()
+            return False
+        filters.append(running_filter)
+
+        def sweep_callback(exe, benchmark, elapsed, size, details):
+            model.set_sweep_unit(sweep_id, exe.name, benchmark, "finished", details["run_id"])
+            model.commit()
+        callbacks.append(sweep_callback)
+
+        def sweep_timeout_callback(exe, benchmark, timeout):
+            model.set_sweep_unit(sweep_id, exe.name, benchmark, "timeout")
+            model.commit()
+        timeout_callbacks.append(sweep_timeout_callback)
+
+    timeout_factor = float(args.timeout_factor)
+    timeouts = {}
+    for e in executables:
+        for b in benchmarks:
+            timeouts[(e.name, b.filename)] = get_timeout(e.name, b.filename, timeout_factor)
+
     try:
-        run_tests(executables, benchmarks, filters, callbacks, benchmark_dir)
+        run_tests(executables, benchmarks, filters, callbacks, benchmark_dir, int(args.jobs), args.stable_env,
+                timeouts, timeout_callbacks)
+        if sweep_id is not None:
+            model.finish_sweep(sweep_id)
     # except KeyboardInterrupt:
         # print "Interrupted"
         # sys.exit(1)
     finally:
         model.clear_report("last")
         print "Saving results to 'last'"
-        for (exe, benchmark, elapsed, size) in tmp_results:
-            model.save_result("last", benchmark, elapsed, size)
+        for (benchmark, run_id) in tmp_results:
+            model.set_report_run("last", benchmark, run_id)
+        model.commit()
+
+        if args.submit:
+            codespeed_submit.finish(timeout=60)
 
 if __name__ == "__main__":
     main()
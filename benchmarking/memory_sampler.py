@@ -0,0 +1,141 @@
+# Samples the memory usage of a benchmark process over time, by polling /proc
+# while it runs.  Max RSS only tells us about the peak, whereas this lets us see
+# things like steady GC heap growth or the JIT code cache filling up.
+
+import array
+import os
+import threading
+import time
+import zlib
+
+# Fields of /proc/<pid>/status that we record, all in kB
+STATUS_FIELDS = {
+    "VmRSS": "rss",
+    "RssAnon": "anon",
+    "RssFile": "file",
+    "VmSwap": "swap",
+}
+
+# smaps_rollup is more expensive to read but also gives us the proportional set
+# size, which doesn't double-count memory shared between processes.
+SMAPS_FIELDS = {
+    "Pss": "pss",
+}
+
+SERIES = ["rss", "anon", "file", "swap", "pss"]
+
+# Processes that our command line wraps the benchmark in, which shouldn't count
+# towards its memory usage:
+WRAPPERS = ["time", "perf"]
+
+def _read(fn):
+    try:
+        with open(fn) as f:
+            return f.read()
+    except IOError:
+        # The process exited
+        return None
+
+def _parse_kb(s, fields, into):
+    for l in s.split('\n'):
+        if ':' not in l:
+            continue
+        name, value = l.split(':', 1)
+        if name in fields:
+            into[fields[name]] = into.get(fields[name], 0) + int(value.split()[0])
+
+def get_children(pid):
+    children = _read("/proc/%d/task/%d/children" % (pid, pid))
+    if children is not None:
+        return [int(c) for c in children.split()]
+
+    # Kernels without CONFIG_PROC_CHILDREN
+    rtn = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        stat = _read("/proc/%s/stat" % name)
+        # The command name can contain spaces, so parse from the end of it:
+        if stat and int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            rtn.append(int(name))
+    return rtn
+
+def get_benchmark_pids(pid):
+    rtn = []
+    stack = [pid]
+    while stack:
+        pid = stack.pop()
+        comm = _read("/proc/%d/comm" % pid)
+        if comm is None:
+            continue
+        if comm.strip() not in WRAPPERS:
+            rtn.append(pid)
+        stack.extend(get_children(pid))
+    return rtn
+
+class Sampler(threading.Thread):
+    def __init__(self, pid, interval):
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+        self.times = []
+        self.series = dict((name, []) for name in SERIES)
+        self._stop_event = threading.Event()
+        self._start = time.time()
+
+    def sample(self):
+        values = {}
+        for pid in get_benchmark_pids(self.pid):
+            status = _read("/proc/%d/status" % pid)
+            if status is None:
+                continue
+            _parse_kb(status, STATUS_FIELDS, values)
+            smaps = _read("/proc/%d/smaps_rollup" % pid)
+            if smaps is not None:
+                _parse_kb(smaps, SMAPS_FIELDS, values)
+        if not values:
+            return
+
+        self.times.append(time.time() - self._start)
+        for name in SERIES:
+            self.series[name].append(values.get(name, 0) / 1024.0)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        # Returns {"t": [seconds since start], "rss": [MB], ...}
+        return dict(self.series, t=self.times)
+
+def summarize(series):
+    # Peak, mean, and area under the curve (in MB*s) of each series
+    t = series["t"]
+    summary = {}
+    if not t:
+        return summary
+    for name in SERIES:
+        values = series[name]
+        auc = sum((t[i + 1] - t[i]) * (values[i] + values[i + 1]) / 2.0 for i in xrange(len(t) - 1))
+        summary[name + "_peak_mb"] = max(values)
+        summary[name + "_mean_mb"] = sum(values) / len(values)
+        summary[name + "_auc_mb_s"] = auc
+    return summary
+
+def format_summary(summary):
+    return "[rss peak %.1fMB, mean %.1fMB, %.1fMB*s]" % (summary["rss_peak_mb"], summary["rss_mean_mb"],
+            summary["rss_auc_mb_s"])
+
+# The series can have thousands of points, so they get stored as compressed arrays of doubles:
+
+def compress(values):
+    return zlib.compress(array.array('d', values).tostring())
+
+def decompress(data):
+    a = array.array('d')
+    a.fromstring(zlib.decompress(data))
+    return a.tolist()
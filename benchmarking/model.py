@@ -1,28 +1,429 @@
+import json
 import os.path
+import socket
 import sqlite3
 
+import environment
+import memory_sampler
+
+# Every measurement ever taken is kept as a run (one per executable+benchmark
+# per sweep), along with its individual samples.  Reports are just named
+# pointers to the runs that make them up, so clearing or overwriting a report
+# never loses any data.
+#
+# None of the write functions commit; callers are expected to call commit()
+# once per finished benchmark so that we don't pay for an fsync per sample.
+#
+# Each invocation of measure_perf is also recorded as a sweep, with the state of
+# every (executable, benchmark) unit in it, so that an interrupted sweep can be
+# resumed from where it stopped.
+#
+# Runs that hang get recorded separately as timeouts, along with the stacks of
+# the hung processes.
+
 conn = sqlite3.connect(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data2.db"))
-conn.cursor().execute("""CREATE TABLE IF NOT EXISTS results
-        (report text, benchmark text, time real, size real, PRIMARY KEY (report, benchmark))
-        """)
 
-def clear_report(report):
-    print "Deleting report '%s'" % (report,)
-    conn.cursor().execute("""DELETE FROM results WHERE report=?""", (report,))
+def _table_columns(table):
+    return [r[1] for r in conn.cursor().execute("""PRAGMA table_info(%s)""" % table).fetchall()]
+
+# Tables that hold a {name: value} dict for each sample of a run
+_SAMPLE_VALUE_TABLES = {
+    "counters": "counter",
+    "resource_usage": "field",
+    "warmup": "metric",
+    "memory": "metric",
+    "phases": "phase",
+    "cache": "metric",
+    "score": "metric",
+    "pyston_stats": "stat",
+}
+
+# The tables from before we kept run history, which were keyed by report:
+_LEGACY_TABLES = ["results", "samples", "iteration_times"] + sorted(_SAMPLE_VALUE_TABLES)
+
+def _create_tables():
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS machines
+            (id INTEGER PRIMARY KEY AUTOINCREMENT, hostname TEXT UNIQUE)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS executables
+            (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS revisions
+            (id INTEGER PRIMARY KEY AUTOINCREMENT, revision TEXT UNIQUE)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS runs
+            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+             benchmark TEXT,
+             executable_id INTEGER REFERENCES executables(id),
+             machine_id INTEGER REFERENCES machines(id),
+             revision_id INTEGER REFERENCES revisions(id),
+             timestamp TIMESTAMP,
+             time REAL,
+             size REAL)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS environments
+            (id INTEGER PRIMARY KEY AUTOINCREMENT, fingerprint TEXT UNIQUE, description TEXT)""")
+    if "environment_id" not in _table_columns("runs"):
+        cursor.execute("""ALTER TABLE runs ADD COLUMN environment_id INTEGER REFERENCES environments(id)""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS runs_revision_benchmark
+            ON runs (revision_id, benchmark)""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS runs_executable_benchmark_timestamp
+            ON runs (executable_id, benchmark, timestamp)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS samples
+            (run_id INTEGER REFERENCES runs(id), sample INTEGER, time REAL, size REAL,
+            PRIMARY KEY (run_id, sample))""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS iteration_times
+            (run_id INTEGER REFERENCES runs(id), sample INTEGER, iteration INTEGER, time REAL,
+            PRIMARY KEY (run_id, sample, iteration))""")
+    for table, name_column in _SAMPLE_VALUE_TABLES.items():
+        cursor.execute("""CREATE TABLE IF NOT EXISTS %s
+                (run_id INTEGER REFERENCES runs(id), sample INTEGER, %s TEXT, value REAL,
+                PRIMARY KEY (run_id, sample, %s))""" % (table, name_column, name_column))
+    cursor.execute("""CREATE TABLE IF NOT EXISTS memory_series
+            (run_id INTEGER REFERENCES runs(id), sample INTEGER, series TEXT, data BLOB,
+            PRIMARY KEY (run_id, sample, series))""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS reports
+            (report TEXT, benchmark TEXT, run_id INTEGER REFERENCES runs(id),
+            PRIMARY KEY (report, benchmark))""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS timeouts
+            (id INTEGER PRIMARY KEY AUTOINCREMENT,
+             benchmark TEXT,
+             executable_id INTEGER REFERENCES executables(id),
+             machine_id INTEGER REFERENCES machines(id),
+             revision_id INTEGER REFERENCES revisions(id),
+             environment_id INTEGER REFERENCES environments(id),
+             timestamp TIMESTAMP,
+             timeout REAL,
+             stacks TEXT)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS sweeps
+            (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, started TIMESTAMP, finished INTEGER)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS sweep_units
+            (sweep_id INTEGER REFERENCES sweeps(id), executable TEXT, benchmark TEXT, state TEXT,
+            run_id INTEGER REFERENCES runs(id),
+            PRIMARY KEY (sweep_id, executable, benchmark))""")
+
+def _migrate_legacy_tables():
+    if "report" not in _table_columns("results"):
+        return
+
+    print "Migrating results database to the run history format..."
+    cursor = conn.cursor()
+    legacy = [t for t in _LEGACY_TABLES if "report" in _table_columns(t)]
+    for t in legacy:
+        cursor.execute("""ALTER TABLE %s RENAME TO legacy_%s""" % (t, t))
+    _create_tables()
+
+    for report, benchmark, time, size in cursor.execute("""SELECT report, benchmark, time, size
+            FROM legacy_results""").fetchall():
+        cursor.execute("""INSERT INTO runs (benchmark, time, size) VALUES (?, ?, ?)""", (benchmark, time, size))
+        run_id = cursor.lastrowid
+        cursor.execute("""INSERT INTO reports (report, benchmark, run_id) VALUES (?, ?, ?)""",
+                (report, benchmark, run_id))
+        key = (run_id, report, benchmark)
+        if "samples" in legacy:
+            cursor.execute("""INSERT INTO samples (run_id, sample, time, size)
+                    SELECT ?, run, time, size FROM legacy_samples WHERE report=? AND benchmark=?""", key)
+        if "iteration_times" in legacy:
+            cursor.execute("""INSERT INTO iteration_times (run_id, sample, iteration, time)
+                    SELECT ?, run, iteration, time FROM legacy_iteration_times WHERE report=? AND benchmark=?""", key)
+        for table, name_column in _SAMPLE_VALUE_TABLES.items():
+            if table in legacy:
+                cursor.execute("""INSERT INTO %s (run_id, sample, %s, value)
+                        SELECT ?, run, %s, value FROM legacy_%s WHERE report=? AND benchmark=?""" % (
+                            table, name_column, name_column, table), key)
+
+    for t in legacy:
+        cursor.execute("""DROP TABLE legacy_%s""" % t)
     conn.commit()
 
-def save_result(report, benchmark, time, size):
-    conn.cursor().execute("""INSERT OR REPLACE INTO results (report, benchmark, time, size)
-            VALUES (?, ?, ?, ?)""", (report, benchmark, time, size))
+_migrate_legacy_tables()
+_create_tables()
+conn.commit()
+
+def commit():
     conn.commit()
 
+def _get_or_create_id(table, column, value):
+    if value is None:
+        return None
+    cursor = conn.cursor()
+    r = cursor.execute("""SELECT id FROM %s WHERE %s=?""" % (table, column), (value,)).fetchone()
+    if r:
+        return r[0]
+    cursor.execute("""INSERT INTO %s (%s) VALUES (?)""" % (table, column), (value,))
+    return cursor.lastrowid
+
+def _get_environment_id(env):
+    if env is None:
+        return None
+    fingerprint = environment.fingerprint(env)
+    env_id = _get_or_create_id("environments", "fingerprint", fingerprint)
+    conn.cursor().execute("""UPDATE environments SET description=? WHERE id=?""",
+            (json.dumps(env, sort_keys=True), env_id))
+    return env_id
+
+# Records a new run in the history and returns its id.  details is the dict of
+# per-sample measurements that measure_perf collects, and env is the
+# environment.get_environment() that it was measured in.
+def add_run(benchmark, executable, revision, time, size, details, env=None):
+    cursor = conn.cursor()
+    cursor.execute("""INSERT INTO runs (benchmark, executable_id, machine_id, revision_id, environment_id,
+                timestamp, time, size)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)""", (benchmark,
+                _get_or_create_id("executables", "name", executable),
+                _get_or_create_id("machines", "hostname", socket.gethostname()),
+                _get_or_create_id("revisions", "revision", revision),
+                _get_environment_id(env),
+                time, size))
+    run_id = cursor.lastrowid
+
+    cursor.executemany("""INSERT INTO samples (run_id, sample, time, size) VALUES (?, ?, ?, ?)""",
+            [(run_id, i, t, s) for i, (t, s) in enumerate(details.get("samples", []))])
+    cursor.executemany("""INSERT INTO iteration_times (run_id, sample, iteration, time) VALUES (?, ?, ?, ?)""",
+            [(run_id, i, j, t) for i, times in enumerate(details.get("iteration_times", []))
+                for j, t in enumerate(times)])
+    for table, name_column in _SAMPLE_VALUE_TABLES.items():
+        cursor.executemany("""INSERT INTO %s (run_id, sample, %s, value) VALUES (?, ?, ?, ?)""" % (table, name_column),
+                [(run_id, i, name, value) for i, values in enumerate(details.get(table, []))
+                    for name, value in values.items()])
+    cursor.executemany("""INSERT INTO memory_series (run_id, sample, series, data) VALUES (?, ?, ?, ?)""",
+            [(run_id, i, name, sqlite3.Binary(memory_sampler.compress(values)))
+                for i, series in enumerate(details.get("memory_series", [])) for name, values in series.items()])
+    return run_id
+
+# Records a run that got killed for taking longer than timeout seconds
+def add_timeout(benchmark, executable, revision, timeout, stacks, env=None):
+    cursor = conn.cursor()
+    cursor.execute("""INSERT INTO timeouts (benchmark, executable_id, machine_id, revision_id, environment_id,
+                timestamp, timeout, stacks)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)""", (benchmark,
+                _get_or_create_id("executables", "name", executable),
+                _get_or_create_id("machines", "hostname", socket.gethostname()),
+                _get_or_create_id("revisions", "revision", revision),
+                _get_environment_id(env),
+                timeout, stacks))
+    return cursor.lastrowid
+
+def get_timeout_stacks(timeout_id):
+    r = conn.cursor().execute("""SELECT stacks FROM timeouts WHERE id=?""", (timeout_id,)).fetchone()
+    if r is None:
+        return None
+    return r[0]
+
+def set_report_run(report, benchmark, run_id):
+    conn.cursor().execute("""INSERT OR REPLACE INTO reports (report, benchmark, run_id)
+            VALUES (?, ?, ?)""", (report, benchmark, run_id))
+
+def clear_report(report):
+    print "Deleting report '%s'" % (report,)
+    conn.cursor().execute("""DELETE FROM reports WHERE report=?""", (report,))
+
+def get_report_run(report, benchmark):
+    r = conn.cursor().execute("""SELECT run_id FROM reports WHERE report=? AND benchmark=?""",
+            (report, benchmark)).fetchone()
+    if r is None:
+        return None
+    return r[0]
+
 def get_result(report, benchmark):
-    val = conn.cursor().execute("""SELECT time, size FROM results WHERE
-            report=? AND benchmark=?""", (report, benchmark)).fetchone()
+    val = conn.cursor().execute("""SELECT time, size FROM runs JOIN reports ON runs.id = reports.run_id
+            WHERE reports.report=? AND reports.benchmark=?""", (report, benchmark)).fetchone()
     if val is not None:
         return val[0], val[1]
     return val
 
+def get_results(reports):
+    # Bulk version of get_result: returns {(report, benchmark): (time, size, run_id)}
+    # for every benchmark of the given reports.
+    reports = list(reports)
+    if not reports:
+        return {}
+    rows = conn.cursor().execute("""SELECT reports.report, reports.benchmark, time, size, runs.id
+            FROM runs JOIN reports ON runs.id = reports.run_id
+            WHERE reports.report IN (%s)""" % ",".join("?" * len(reports)), reports).fetchall()
+    return dict(((r[0], r[1]), (r[2], r[3], r[4])) for r in rows)
+
+def get_run_environment(run_id):
+    # Returns the fingerprint of the environment the run was measured in, if we know it
+    r = conn.cursor().execute("""SELECT fingerprint FROM runs JOIN environments ON runs.environment_id = environments.id
+            WHERE runs.id=?""", (run_id,)).fetchone()
+    if r is None:
+        return None
+    return r[0]
+
+def get_report_environment(report, benchmark):
+    run_id = get_report_run(report, benchmark)
+    if run_id is None:
+        return None
+    return get_run_environment(run_id)
+
+def get_run_samples(run_id):
+    rows = conn.cursor().execute("""SELECT time, size FROM samples WHERE run_id=? ORDER BY sample""",
+            (run_id,)).fetchall()
+    return [(r[0], r[1]) for r in rows]
+
+def get_run_iteration_times(run_id):
+    rows = conn.cursor().execute("""SELECT sample, time FROM iteration_times WHERE run_id=?
+            ORDER BY sample, iteration""", (run_id,)).fetchall()
+    rtn = []
+    for sample, t in rows:
+        while len(rtn) <= sample:
+            rtn.append([])
+        rtn[sample].append(t)
+    return rtn
+
+def get_run_memory_series(run_id):
+    # Returns a {series: [values]} dict for each sample
+    rows = conn.cursor().execute("""SELECT sample, series, data FROM memory_series WHERE run_id=?
+            ORDER BY sample""", (run_id,)).fetchall()
+    rtn = []
+    for sample, name, data in rows:
+        while len(rtn) <= sample:
+            rtn.append({})
+        rtn[sample][name] = memory_sampler.decompress(str(data))
+    return rtn
+
+def _get_run_values(table, run_id):
+    rows = conn.cursor().execute("""SELECT sample, %s, value FROM %s WHERE run_id=? ORDER BY sample""" % (
+        _SAMPLE_VALUE_TABLES[table], table), (run_id,)).fetchall()
+    rtn = []
+    for sample, name, value in rows:
+        while len(rtn) <= sample:
+            rtn.append({})
+        rtn[sample][name] = value
+    return rtn
+
+def _for_report(fn, report, benchmark, *args):
+    run_id = get_report_run(report, benchmark)
+    if run_id is None:
+        return []
+    return fn(*(args + (run_id,)))
+
+# These return the per-sample measurements of the run that a report points to:
+
+def get_samples(report, benchmark):
+    return _for_report(get_run_samples, report, benchmark)
+
+def get_iteration_times(report, benchmark):
+    return _for_report(get_run_iteration_times, report, benchmark)
+
+def get_counters(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "counters")
+
+def get_resource_usage(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "resource_usage")
+
+def get_warmup(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "warmup")
+
+def get_phases(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "phases")
+
+def get_cache(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "cache")
+
+def get_score(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "score")
+
+def get_pyston_stats(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "pyston_stats")
+
+def get_memory(report, benchmark):
+    return _for_report(_get_run_values, report, benchmark, "memory")
+
+def get_memory_series(report, benchmark):
+    return _for_report(get_run_memory_series, report, benchmark)
+
 def list_reports():
-    rows = conn.cursor().execute("""SELECT distinct(report) FROM results""").fetchall()
+    rows = conn.cursor().execute("""SELECT distinct(report) FROM reports""").fetchall()
     return [r[0] for r in rows]
+
+# Time-series queries over the run history:
+
+def get_history(executable, benchmark):
+    # Returns [(timestamp, revision, time, run_id)] in chronological order
+    return conn.cursor().execute("""SELECT timestamp, revision, time, runs.id FROM runs
+            JOIN executables ON runs.executable_id = executables.id
+            LEFT JOIN revisions ON runs.revision_id = revisions.id
+            WHERE executables.name=? AND benchmark=? ORDER BY timestamp, runs.id""",
+            (executable, benchmark)).fetchall()
+
+def get_benchmarks(executable):
+    rows = conn.cursor().execute("""SELECT DISTINCT benchmark FROM runs
+            JOIN executables ON runs.executable_id = executables.id
+            WHERE executables.name=? ORDER BY benchmark""", (executable,)).fetchall()
+    return [r[0] for r in rows]
+
+def get_stats_history(executable, benchmark):
+    # Returns [(timestamp, revision, run_id, [{stat: value} for each sample])]
+    # for the runs that recorded pyston's stats, in chronological order
+    rows = conn.cursor().execute("""SELECT timestamp, revision, runs.id, sample, stat, value FROM runs
+            JOIN executables ON runs.executable_id = executables.id
+            LEFT JOIN revisions ON runs.revision_id = revisions.id
+            JOIN pyston_stats ON pyston_stats.run_id = runs.id
+            WHERE executables.name=? AND benchmark=? ORDER BY timestamp, runs.id, sample""",
+            (executable, benchmark)).fetchall()
+    rtn = []
+    for timestamp, revision, run_id, sample, stat, value in rows:
+        if not rtn or rtn[-1][2] != run_id:
+            rtn.append((timestamp, revision, run_id, []))
+        samples = rtn[-1][3]
+        while len(samples) <= sample:
+            samples.append({})
+        samples[sample][stat] = value
+    return rtn
+
+def get_revision_stats(revision, benchmark, executable):
+    # Returns the per-sample stats of all the runs of the revision by the
+    # executable that have them, oldest first.  Different executables (ex
+    # pyston_interponly) spend their time very differently, so they don't get
+    # mixed.
+    rtn = []
+    for run_id, _, time in get_revision_runs(revision, benchmark, executable):
+        rtn += _get_run_values("pyston_stats", run_id)
+    return rtn
+
+def get_revision_runs(revision, benchmark, executable=None):
+    # Returns [(run_id, executable, time)] for the runs of a revision, by all
+    # executables unless one is given
+    query = """SELECT runs.id, executables.name, time FROM runs
+            JOIN revisions ON runs.revision_id = revisions.id
+            LEFT JOIN executables ON runs.executable_id = executables.id
+            WHERE revisions.revision=? AND benchmark=?"""
+    params = (revision, benchmark)
+    if executable is not None:
+        query += """ AND executables.name=?"""
+        params += (executable,)
+    return conn.cursor().execute(query + """ ORDER BY runs.id""", params).fetchall()
+
+# Sweep manifests.  Units go from "planned" to "running" when they get handed to
+# the scheduler, and to "finished" once their run has been recorded (or to
+# "timeout" if it hung, in which case a resumed sweep tries it again).
+
+def find_unfinished_sweep(key):
+    r = conn.cursor().execute("""SELECT id FROM sweeps WHERE key=? AND NOT finished
+            ORDER BY id DESC LIMIT 1""", (key,)).fetchone()
+    if r is None:
+        return None
+    return r[0]
+
+def start_sweep(key, units):
+    # units is a list of (executable, benchmark)
+    cursor = conn.cursor()
+    cursor.execute("""INSERT INTO sweeps (key, started, finished) VALUES (?, CURRENT_TIMESTAMP, 0)""", (key,))
+    sweep_id = cursor.lastrowid
+    cursor.executemany("""INSERT OR IGNORE INTO sweep_units (sweep_id, executable, benchmark, state)
+            VALUES (?, ?, ?, 'planned')""", [(sweep_id, e, b) for (e, b) in units])
+    return sweep_id
+
+def set_sweep_unit(sweep_id, executable, benchmark, state, run_id=None):
+    conn.cursor().execute("""UPDATE sweep_units SET state=?, run_id=?
+            WHERE sweep_id=? AND executable=? AND benchmark=?""", (state, run_id, sweep_id, executable, benchmark))
+
+def get_sweep_units(sweep_id):
+    # Returns {(executable, benchmark): (state, result)}, where result is the
+    # (time, size, run_id) of the unit's run, or None if it doesn't have one yet
+    rows = conn.cursor().execute("""SELECT sweep_units.executable, sweep_units.benchmark, state, time, size, runs.id FROM sweep_units
+            LEFT JOIN runs ON sweep_units.run_id = runs.id
+            WHERE sweep_id=?""", (sweep_id,)).fetchall()
+    return dict(((r[0], r[1]), (r[2], tuple(r[3:]) if r[5] is not None else None)) for r in rows)
+
+def finish_sweep(sweep_id):
+    conn.cursor().execute("""UPDATE sweeps SET finished=1 WHERE id=?""", (sweep_id,))
@@ -0,0 +1,55 @@
+# Control over the state of pyston's on-disk JIT object cache, so that we can
+# measure the same benchmark with the cache in different states:
+#
+#   cold:      the cache is empty
+#   warm:      the cache has been populated by a run of the same executable
+#   warm_prev: the cache has been populated by a run of a previous revision,
+#              as happens when restarting a fleet after a deploy
+#
+# Each state is set up once per benchmark, saved as a snapshot, and then
+# restored before every measured run, so that the runs don't see each other's
+# cache entries.
+
+import os
+import shutil
+import tempfile
+
+CACHE_DIR = os.path.expanduser("~/.cache/pyston")
+
+STATES = ["cold", "warm", "warm_prev"]
+
+def clear():
+    if os.path.exists(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+
+def stats():
+    # Returns (number of entries, total size in bytes)
+    entries = 0
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(CACHE_DIR):
+        for fn in filenames:
+            entries += 1
+            size += os.lstat(os.path.join(dirpath, fn)).st_size
+    return entries, size
+
+def save_snapshot():
+    snapshot = tempfile.mkdtemp(prefix="pyston_cache_")
+    if os.path.exists(CACHE_DIR):
+        shutil.copytree(CACHE_DIR, os.path.join(snapshot, "cache"))
+    return snapshot
+
+def restore_snapshot(snapshot):
+    clear()
+    if os.path.exists(os.path.join(snapshot, "cache")):
+        shutil.copytree(os.path.join(snapshot, "cache"), CACHE_DIR)
+
+def discard_snapshot(snapshot):
+    shutil.rmtree(snapshot)
+
+def get_hit_rate(new_entries, cold_entries):
+    # We can't see the cache lookups themselves, but a cold run has to compile
+    # (and write out) everything it needs, so the fraction of that which a
+    # warm run didn't have to write out is its hit rate.
+    if not cold_entries:
+        return None
+    return max(0.0, 1.0 - float(new_entries) / cold_entries)
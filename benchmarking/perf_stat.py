@@ -0,0 +1,35 @@
+# Support for collecting hardware performance counters with `perf stat`.
+# Instruction counts are much less noisy than wall-clock time, especially
+# on shared machines.
+
+EVENTS = [
+    "instructions",
+    "cycles",
+    "branch-misses",
+    "cache-misses",
+    "page-faults",
+    "context-switches",
+]
+
+def wrap_args(args, output_fn):
+    return ["perf", "stat", "-x,", "-o", output_fn, "-e", ",".join(EVENTS), "--"] + args
+
+def parse_output(fn):
+    # The csv format is "value,unit,event,run time,percentage,..."; events that
+    # couldn't be measured report a value of "<not supported>" or "<not counted>"
+    counters = {}
+    with open(fn) as f:
+        for l in f:
+            l = l.strip()
+            if not l or l.startswith('#'):
+                continue
+            fields = l.split(',')
+            if len(fields) < 3:
+                continue
+            value, event = fields[0], fields[2]
+            # Events can have modifiers attached, ex "cycles:u"
+            event = event.split(':')[0]
+            if event not in EVENTS or value.startswith('<'):
+                continue
+            counters[event] = float(value)
+    return counters
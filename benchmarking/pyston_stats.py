@@ -0,0 +1,146 @@
+# Pyston's internal stats: the counters and (in builds with STAT_TIMERS turned
+# on) the us_timer_* timers that it prints to stderr at exit.  These get stored
+# with each run like any other per-sample measurement, and rolled up into
+# categories such as "rewriter" or "llvm+irgen" when we look at them, so that
+# changing the categories applies to all of the history.
+
+# This option changed from "-s" to "-T" in d1e16e8
+STATS_OPTION = "-T"
+
+def parse(err):
+    # Returns {stat: value} from between "Counters:" and "(End of stats)", or
+    # {} if the run didn't print its stats
+    if "Counters:" not in err:
+        return {}
+    _, counter_str = err.rsplit("Counters:", 1)
+    counter_str = counter_str.split("(End of stats)")[0]
+    stats = {}
+    for l in counter_str.strip().split('\n'):
+        if l.count(':') != 1:
+            continue
+        k, v = l.split(':')
+        stats[k.strip()] = float(v)
+    return stats
+
+TIMER_PREFIX = "us_timer_"
+
+# How specific each kind of category is.  A timer goes into the most specific
+# category that it matches, up to the level that we are rolling up at, so that
+# the same timers can be viewed at different granularities.
+TIMER = 30      # the timer itself
+SUBSYSTEM = 20  # ex "rewriter", "llvm+irgen"
+BROAD = 10      # ex "tiering overhead"
+
+# (category, level, prefixes, names).  Timers match on their prefix, or on
+# their name with or without the us_timer_ prefix.
+RULES = [
+    ("slowpaths", SUBSYSTEM, ["us_timer_slowpath_"], []),
+    ("api conversion", SUBSYSTEM, ["us_timer_slot_", "us_timer_wrap_"], []),
+    ("avoidable runtime overhead", BROAD, ["us_timer_slowpath_", "us_timer_slot_", "us_timer_wrap_"], []),
+    ("llvm+irgen", SUBSYSTEM, [], ["compileFunction"]),
+    ("in interpreter", SUBSYSTEM, [], ["in_interpreter", "main_toplevel"]),
+    ("rewriter", SUBSYSTEM, [], ["rewriter", "createrewriter"]),
+    ("tiering overhead", BROAD, [], ["compileFunction", "in_interpreter", "main_toplevel", "rewriter", "createrewriter"]),
+    ("things that should be fast", BROAD, [], ["in_jitted_code", "in_builtins", "in_baseline_jitted_code", "typeNew"]),
+    ("unwinding", BROAD, [], ["unwinding", "getTopPythonFrame"]),
+    ("parsing", SUBSYSTEM, [], ["caching_parse_file", "cpyton_parsing"]),
+    ("gc collection", BROAD, [], ["gc_collection"]),
+]
+
+# The levels that stats_rollup prints tables at, most specific first
+CATEGORIZE_AT = [SUBSYSTEM, BROAD]
+
+class _Matcher(object):
+    # The rules up to one level, compiled into a dict of exact names and a
+    # trie of prefixes, so that categorizing a timer is a walk down its name
+    # rather than a scan over all of the rules.
+    def __init__(self, max_level):
+        self.max_level = max_level
+        # {name: (level, category)}
+        self.names = {}
+        # Nested {char: node} dicts, with the (level, category) of a prefix
+        # that ends at a node under the None key
+        self.trie = {}
+
+        for category, level, prefixes, names in RULES:
+            if level > max_level:
+                continue
+            for n in names:
+                for full_name in (n, TIMER_PREFIX + n):
+                    self._add(self.names, full_name, level, category)
+            for prefix in prefixes:
+                node = self.trie
+                for c in prefix:
+                    node = node.setdefault(c, {})
+                self._add(node, None, level, category)
+
+        # Rules of the same level that overlap make the result depend on their
+        # order, so catch those here rather than per timer:
+        overlaps = list(self.names.items())
+        for category, level, prefixes, names in RULES:
+            if level <= max_level:
+                overlaps += [(prefix, (level, category)) for prefix in prefixes]
+        for name, (level, category) in overlaps:
+            for prefix_level, prefix_category in self._prefix_matches(name):
+                if prefix_level == level and prefix_category != category:
+                    print "Ambiguous specificity between %r and %r when applied to %r" % (category, prefix_category, name)
+
+    def _add(self, d, key, level, category):
+        old = d.get(key)
+        if old is not None and old[0] == level and old[1] != category:
+            print "Ambiguous specificity between %r and %r when applied to %r" % (old[1], category, key)
+        if old is None or level > old[0]:
+            d[key] = (level, category)
+
+    def _prefix_matches(self, name):
+        node = self.trie
+        for c in name:
+            if None in node:
+                yield node[None]
+            if c not in node:
+                return
+            node = node[c]
+        if None in node:
+            yield node[None]
+
+    def categorize(self, timer):
+        if self.max_level >= TIMER:
+            return timer
+        best = self.names.get(timer, (0, "misc"))
+        for m in self._prefix_matches(timer):
+            if m[0] > best[0]:
+                best = m
+        return best[1]
+
+_matchers = {}
+_categories = {}
+def categorize(timer, max_level):
+    key = (timer, max_level)
+    if key not in _categories:
+        if max_level not in _matchers:
+            _matchers[max_level] = _Matcher(max_level)
+        _categories[key] = _matchers[max_level].categorize(timer)
+    return _categories[key]
+
+def rollup(stats_list, max_level=SUBSYSTEM):
+    # Turns a list of {stat: value} dicts into a list of {category: us} dicts.
+    # Each timer only gets categorized once, however many runs we are rolling
+    # up, so this stays cheap over long histories.
+    timers = sorted(set(k for stats in stats_list for k in stats if k.startswith(TIMER_PREFIX)))
+    categories = [categorize(t, max_level) for t in timers]
+    rtn = []
+    for stats in stats_list:
+        totals = {}
+        for t, c in zip(timers, categories):
+            totals[c] = totals.get(c, 0) + stats.get(t, 0)
+        rtn.append(totals)
+    return rtn
+
+def rollup_category(stats_list, category):
+    # Returns the us spent in one category for each {stat: value} dict, at the
+    # most specific level that has that category
+    for max_level in [TIMER] + CATEGORIZE_AT:
+        totals = rollup(stats_list, max_level)
+        if any(category in t for t in totals):
+            return [t.get(category, 0) for t in totals]
+    return [0 for _ in stats_list]
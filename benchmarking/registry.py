@@ -0,0 +1,162 @@
+# The list of benchmarks in benchmark_suite/ and what we know about them.
+# measure_perf.py, bisect_perf.py and analysis/investigate.py all get their
+# idea of what "the suite" is from here.
+#
+# Groups:
+#   main:          the headline benchmarks, which go into the geomean
+#   unaveraged:    run by default but not averaged
+#   perf_tracking: only run with --all-benchmarks
+#   interp:        the ones that we compare against the interpreter with --run-pyston-interponly
+#   startup:       the startup suite (--startup)
+#   investigate, investigate_unaveraged, micro: the sets that investigate.py uses
+
+import os
+import shutil
+import subprocess
+
+class BenchmarkInfo(object):
+    def __init__(self, filename, groups, expected_runtime, weight=1.0, setup=(), timeout=None,
+            inner_timings=False, shared_state=None):
+        self.filename = filename
+        self.groups = groups
+        # Rough runtime in seconds, which is only used for deciding what order
+        # to hand jobs out in when running with -j:
+        self.expected_runtime = expected_runtime
+        # How much this benchmark counts for in the geomean
+        self.weight = weight
+        # Names of SETUP_ACTIONS to run before each run
+        self.setup = setup
+        # Seconds after which a run is considered hung, instead of the timeout that
+        # measure_perf derives from its recent runs
+        self.timeout = timeout
+        # Whether it reports per-iteration times through iteration_timings
+        self.inner_timings = inner_timings
+        # The on-disk state that it modifies, if any; benchmarks with the same
+        # shared state can't be run concurrently.
+        self.shared_state = shared_state
+
+BENCHMARKS = [
+    BenchmarkInfo("django_template3_10x.py", ["main", "investigate", "investigate_unaveraged"], 30,
+        setup=["copy_django_template2_db"], inner_timings=True, shared_state="django_template2_site"),
+    BenchmarkInfo("pyxl_bench_10x.py", ["main", "investigate"], 20),
+    BenchmarkInfo("sqlalchemy_imperative2_10x.py", ["main", "investigate"], 20),
+
+    BenchmarkInfo("django_template3.py", ["unaveraged", "investigate"], 3,
+        setup=["copy_django_template2_db"], inner_timings=True, shared_state="django_template2_site"),
+    BenchmarkInfo("pyxl_bench.py", ["unaveraged", "investigate"], 2),
+    BenchmarkInfo("pyxl_bench2.py", ["unaveraged", "investigate"], 2, inner_timings=True),
+    BenchmarkInfo("sqlalchemy_imperative2.py", ["unaveraged", "investigate"], 2),
+    BenchmarkInfo("pyxl_bench2_10x.py", ["unaveraged", "investigate"], 20, inner_timings=True),
+
+    BenchmarkInfo("django_migrate.py", ["perf_tracking", "interp", "investigate_unaveraged"], 5,
+        setup=["remove_django_migrate_db"], shared_state="django_migrate_testsite"),
+    BenchmarkInfo("virtualenv_bench.py", ["perf_tracking", "investigate_unaveraged"], 15,
+        setup=["remove_bench_env"], shared_state="bench_env"),
+    BenchmarkInfo("virtualenv_bench2.py", [], 15, setup=["remove_bench_env"], shared_state="bench_env"),
+    BenchmarkInfo("interp2.py", ["perf_tracking", "micro"], 5),
+    BenchmarkInfo("raytrace.py", ["perf_tracking", "micro"], 5),
+    BenchmarkInfo("nbody.py", ["perf_tracking", "micro"], 5),
+    BenchmarkInfo("fannkuch.py", ["perf_tracking", "micro"], 5),
+    BenchmarkInfo("chaos.py", ["perf_tracking"], 5, inner_timings=True, shared_state="py.ppm"),
+    BenchmarkInfo("fasta.py", ["perf_tracking", "micro"], 5),
+    BenchmarkInfo("pidigits.py", ["perf_tracking", "micro"], 5),
+    BenchmarkInfo("richards.py", ["perf_tracking", "interp", "micro"], 5, inner_timings=True),
+    BenchmarkInfo("deltablue.py", ["perf_tracking", "interp", "micro"], 3, inner_timings=True),
+    BenchmarkInfo("django_template2.py", ["perf_tracking", "investigate_unaveraged"], 5,
+        setup=["copy_django_template2_db"], inner_timings=True, shared_state="django_template2_site"),
+    BenchmarkInfo("django_template.py", ["perf_tracking", "investigate_unaveraged"], 5, inner_timings=True),
+    BenchmarkInfo("django_lexing.py", ["investigate_unaveraged"], 5),
+
+    BenchmarkInfo("sre_parse_parse.py", ["interp"], 3),
+    BenchmarkInfo("raytrace_small.py", ["interp"], 2),
+    BenchmarkInfo("sre_compile_ubench.py", ["micro"], 3),
+
+    BenchmarkInfo("startup_bare.py", ["startup"], 1, inner_timings=True),
+    BenchmarkInfo("startup_django_template.py", ["startup"], 10, inner_timings=True),
+    BenchmarkInfo("startup_sqlalchemy_orm.py", ["startup"], 10, inner_timings=True),
+    BenchmarkInfo("startup_django_setup.py", ["startup"], 30, inner_timings=True),
+    BenchmarkInfo("startup_pyxl_codec.py", ["startup"], 5, inner_timings=True),
+]
+
+_BY_FILENAME = dict((b.filename, b) for b in BENCHMARKS)
+
+def get(filename):
+    # Returns None for things that aren't in the suite, ex "(calibration)"
+    return _BY_FILENAME.get(filename)
+
+# Most groups list their benchmarks in the order that they're declared in above,
+# but these keep the order that their tools have always used, so that their
+# output stays comparable with older runs:
+GROUP_ORDER = {
+    "investigate": [
+        "django_template3.py",
+        "pyxl_bench.py",
+        "sqlalchemy_imperative2.py",
+        "pyxl_bench2.py",
+        "pyxl_bench_10x.py",
+        "django_template3_10x.py",
+        "sqlalchemy_imperative2_10x.py",
+        "pyxl_bench2_10x.py",
+    ],
+    "investigate_unaveraged": [
+        "django_template3_10x.py",
+        "django_template2.py",
+        "django_template.py",
+        "django_lexing.py",
+        "django_migrate.py",
+        "virtualenv_bench.py",
+    ],
+    "interp": [
+        "django_migrate.py",
+        "sre_parse_parse.py",
+        "raytrace_small.py",
+        "deltablue.py",
+        "richards.py",
+    ],
+}
+
+def in_group(group):
+    rtn = [b.filename for b in BENCHMARKS if group in b.groups]
+    if group in GROUP_ORDER:
+        assert sorted(GROUP_ORDER[group]) == sorted(rtn), "GROUP_ORDER[%r] is out of date" % group
+        rtn = list(GROUP_ORDER[group])
+    return rtn
+
+def with_inner_timings():
+    return [b.filename for b in BENCHMARKS if b.inner_timings and "startup" not in b.groups]
+
+def has_warmup(filename):
+    # Whether the benchmark's inner timings are iterations of a single
+    # process, as opposed to separate processes like in the startup suite
+    info = get(filename)
+    return not (info and "startup" in info.groups)
+
+# Setup actions, which put back the state that a benchmark expects to start
+# from in case a previous run of it got killed partway through.  These take the
+# benchmark_suite directory.
+
+def _remove_bench_env(benchmark_dir):
+    # virtualenv_bench creates this in the current directory
+    subprocess.check_call(["rm", "-rf", "bench_env"])
+
+def _remove_django_migrate_db(benchmark_dir):
+    db_path = os.path.join(benchmark_dir, "django_migrate_testsite/db.sqlite3")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+def _copy_django_template2_db(benchmark_dir):
+    site_dir = os.path.join(benchmark_dir, "django_template2_site")
+    shutil.copy(os.path.join(site_dir, "db_base.sqlite3"), os.path.join(site_dir, "db.sqlite3"))
+
+SETUP_ACTIONS = {
+    "remove_bench_env": _remove_bench_env,
+    "remove_django_migrate_db": _remove_django_migrate_db,
+    "copy_django_template2_db": _copy_django_template2_db,
+}
+
+def run_setup(filename, benchmark_dir):
+    info = get(filename)
+    if info is None:
+        return
+    for action in info.setup:
+        SETUP_ACTIONS[action](benchmark_dir)
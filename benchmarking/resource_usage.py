@@ -0,0 +1,31 @@
+# Parsing of the resource usage report that `/usr/bin/time -v` prints to stderr.
+
+# Maps the labels that time uses to the names we store them under
+FIELDS = {
+    "User time (seconds)": "user_time",
+    "System time (seconds)": "sys_time",
+    "Maximum resident set size (kbytes)": "max_rss_kb",
+    "Major (requiring I/O) page faults": "major_faults",
+    "Minor (reclaiming a frame) page faults": "minor_faults",
+    "Voluntary context switches": "voluntary_context_switches",
+    "Involuntary context switches": "involuntary_context_switches",
+    "Swaps": "swaps",
+    "File system inputs": "fs_inputs",
+    "File system outputs": "fs_outputs",
+}
+
+def parse(err):
+    # The benchmark's own stderr comes first, so in case it happens to print
+    # something that looks like one of our lines, the last occurrence wins.
+    usage = {}
+    for l in err.split('\n'):
+        if ': ' not in l:
+            continue
+        label, value = l.strip().rsplit(': ', 1)
+        if label in FIELDS:
+            usage[FIELDS[label]] = float(value)
+    assert "max_rss_kb" in usage, "Couldn't find the output of time -v"
+    return usage
+
+def total_faults(usage):
+    return usage["major_faults"] + usage["minor_faults"]
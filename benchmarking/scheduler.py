@@ -0,0 +1,166 @@
+import collections
+import glob
+import os
+import Queue
+import sys
+import threading
+
+def parse_cpu_list(s):
+    # Parses the kernel's cpu list format, ex "0-3,8,10-11"
+    cpus = []
+    for part in s.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-')
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def get_allowed_cpus():
+    with open("/proc/self/status") as f:
+        for l in f:
+            if l.startswith("Cpus_allowed_list:"):
+                return parse_cpu_list(l.split(':', 1)[1])
+    raise Exception("Couldn't find Cpus_allowed_list in /proc/self/status")
+
+def get_thread_siblings(cpu):
+    # The logical cpus that share a physical core with this one (including it)
+    fn = "/sys/devices/system/cpu/cpu%d/topology/thread_siblings_list" % cpu
+    if not os.path.exists(fn):
+        return [cpu]
+    with open(fn) as f:
+        return parse_cpu_list(f.read())
+
+def get_physical_cores():
+    # Returns one logical cpu per physical core that we are allowed to run on.
+    # Only using one thread of each core means that two runs will never end
+    # up on sibling hyperthreads.
+    allowed = set(get_allowed_cpus())
+    cores = {}
+    for fn in glob.glob("/sys/devices/system/cpu/cpu[0-9]*/topology/thread_siblings_list"):
+        cpu = int(os.path.basename(os.path.dirname(os.path.dirname(fn)))[len("cpu"):])
+        with open(fn) as f:
+            siblings = tuple(parse_cpu_list(f.read()))
+        cores.setdefault(siblings, []).append(cpu)
+
+    rtn = []
+    for siblings in cores.values():
+        # Skip the whole core if any of its threads are in use by someone else:
+        if not allowed.issuperset(siblings):
+            continue
+        rtn.append(min(siblings))
+    return sorted(rtn)
+
+def get_isolated_cpus():
+    # The cpus that were set aside with isolcpus=, which the kernel won't
+    # schedule anything else on
+    try:
+        with open("/sys/devices/system/cpu/isolated") as f:
+            return parse_cpu_list(f.read())
+    except IOError:
+        return []
+
+def partition_cores(jobs, isolate=False):
+    cores = get_physical_cores()
+    if isolate:
+        # Prefer isolated cores, and otherwise stay off of cpu 0 since that's
+        # where a lot of interrupt handling and housekeeping ends up:
+        isolated = set(get_isolated_cpus())
+        if len(isolated.intersection(cores)) >= jobs:
+            cores = [c for c in cores if c in isolated]
+        elif len(cores) > jobs:
+            cores = [c for c in cores if c != 0]
+    assert jobs <= len(cores), "Can't run %d jobs on %d free physical cores" % (jobs, len(cores))
+    per_job = len(cores) // jobs
+    return [cores[i * per_job:(i + 1) * per_job] for i in xrange(jobs)]
+
+def pin_args(cpus, args):
+    if cpus is None:
+        return args
+    return ["taskset", "-c", ",".join(str(c) for c in cpus)] + args
+
+class Result(object):
+    def __init__(self):
+        self.__event = threading.Event()
+        self.__value = None
+        self.__exc_info = None
+
+    def set(self, value):
+        self.__value = value
+        self.__event.set()
+
+    def set_exception(self, exc_info):
+        self.__exc_info = exc_info
+        self.__event.set()
+
+    def done(self):
+        return self.__event.is_set()
+
+    def get(self):
+        # Waiting with a timeout keeps us responsive to KeyboardInterrupt:
+        while not self.__event.wait(1.0):
+            pass
+        if self.__exc_info:
+            raise self.__exc_info[0], self.__exc_info[1], self.__exc_info[2]
+        return self.__value
+
+class SerialPool(object):
+    def __init__(self, cpus=None):
+        self.__cpus = cpus
+
+    def submit(self, fn, lock_names=()):
+        r = Result()
+        try:
+            r.set(fn(self.__cpus))
+        except Exception:
+            r.set_exception(sys.exc_info())
+        return r
+
+# Runs jobs on a fixed set of worker threads, each of which owns a disjoint
+# set of physical cores.  Jobs that touch the same on-disk state are
+# serialized by giving them the same lock name.
+class JobPool(object):
+    def __init__(self, cpu_sets):
+        self.__queue = Queue.Queue()
+        self.__locks = collections.defaultdict(threading.Lock)
+        self.__locks_lock = threading.Lock()
+
+        for cpus in cpu_sets:
+            t = threading.Thread(target=self.__worker, args=(cpus,))
+            t.daemon = True
+            t.start()
+
+    def submit(self, fn, lock_names=()):
+        r = Result()
+        self.__queue.put((fn, lock_names, r))
+        return r
+
+    def __worker(self, cpus):
+        while True:
+            fn, lock_names, r = self.__queue.get()
+
+            with self.__locks_lock:
+                # Always acquire in the same order to avoid deadlocks:
+                locks = [self.__locks[n] for n in sorted(set(lock_names))]
+            for l in locks:
+                l.acquire()
+            try:
+                r.set(fn(cpus))
+            except Exception:
+                r.set_exception(sys.exc_info())
+            finally:
+                for l in reversed(locks):
+                    l.release()
+
+def is_pinned(jobs, isolate=False):
+    # Whether make_pool's runs get pinned to their own cores
+    return jobs > 1 or isolate
+
+def make_pool(jobs, isolate=False):
+    if not is_pinned(jobs, isolate):
+        return SerialPool()
+    if jobs == 1:
+        return SerialPool(partition_cores(1, isolate=True)[0])
+    return JobPool(partition_cores(jobs, isolate))
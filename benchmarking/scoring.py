@@ -0,0 +1,47 @@
+# Composite scores over a set of benchmarks.  measure_perf reports these as
+# pseudo-benchmarks named "(geomean-xxxx)", where the hash identifies which
+# benchmarks went into the score so that scores over different sets never get
+# compared with each other.
+
+import hashlib
+import math
+import os.path
+import random
+
+import stats
+
+# weights is a {benchmark filename: weight} dict
+def geomean_name(weights):
+    geomean_str = " ".join(sorted([os.path.basename(b) for b in weights]))
+    # Only include the weights in the hash if there are any, so that unweighted
+    # scores keep the names they've always had:
+    if any(w != 1 for w in weights.values()):
+        geomean_str += " " + " ".join("%s=%r" % (os.path.basename(b), w) for b, w in sorted(weights.items()))
+    return "(geomean-%s)" % (hashlib.sha1(geomean_str).hexdigest()[:4])
+
+def geomean(values, weights=None):
+    # values and weights are {benchmark: value} dicts
+    assert values
+    if weights is None:
+        weights = dict((b, 1.0) for b in values)
+    total_weight = sum(weights[b] for b in values)
+    return math.exp(sum(weights[b] * math.log(values[b]) for b in values) / total_weight)
+
+def geomean_ci(samples, weights=None, confidence=0.95, resamples=1000):
+    # Bootstraps a confidence interval for the geomean by resampling each
+    # benchmark's samples independently and taking their medians.  samples is a
+    # {benchmark: [times]} dict; benchmarks with a single sample contribute
+    # no uncertainty.
+    assert samples
+    rand = random.Random(0)
+    estimates = []
+    for _ in xrange(resamples):
+        values = {}
+        for b, l in samples.items():
+            values[b] = stats.median([l[rand.randrange(len(l))] for _ in xrange(len(l))])
+        estimates.append(geomean(values, weights))
+    estimates.sort()
+    alpha = (1.0 - confidence) / 2
+    lo = estimates[int(alpha * (resamples - 1))]
+    hi = estimates[int(math.ceil((1.0 - alpha) * (resamples - 1)))]
+    return lo, hi
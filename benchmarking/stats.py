@@ -0,0 +1,114 @@
+import math
+import random
+
+def median(l):
+    assert l
+    l = sorted(l)
+    n = len(l)
+    if n % 2:
+        return l[n // 2]
+    return (l[n // 2 - 1] + l[n // 2]) / 2.0
+
+def mad(l):
+    # Median absolute deviation
+    m = median(l)
+    return median([abs(x - m) for x in l])
+
+def bootstrap_ci(l, statistic=median, confidence=0.95, resamples=1000):
+    assert l
+    if len(l) == 1:
+        return l[0], l[0]
+
+    # Use a fixed seed so that rerunning a report gives the same intervals:
+    rand = random.Random(0)
+    n = len(l)
+    estimates = sorted(statistic([l[rand.randrange(n)] for _ in xrange(n)]) for _ in xrange(resamples))
+    alpha = (1.0 - confidence) / 2
+    lo = estimates[int(alpha * (resamples - 1))]
+    hi = estimates[int(math.ceil((1.0 - alpha) * (resamples - 1)))]
+    return lo, hi
+
+def relative_ci_width(l, **kw):
+    lo, hi = bootstrap_ci(l, **kw)
+    return (hi - lo) / median(l)
+
+def mann_whitney(a, b):
+    # Two-sided Mann-Whitney U test, using the normal approximation with a
+    # correction for ties.  Returns (U, p-value).
+    assert a and b
+    n1 = len(a)
+    n2 = len(b)
+    combined = sorted([(x, 0) for x in a] + [(x, 1) for x in b])
+
+    ranks = [0.0] * len(combined)
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        # Tied values all get the average of their ranks (which are 1-based):
+        for k in xrange(i, j + 1):
+            ranks[k] = (i + j) / 2.0 + 1
+        t = j - i + 1
+        tie_term += t ** 3 - t
+        i = j + 1
+
+    r1 = sum(r for r, (x, which) in zip(ranks, combined) if which == 0)
+    u1 = r1 - n1 * (n1 + 1) / 2.0
+    u = min(u1, n1 * n2 - u1)
+
+    n = n1 + n2
+    mu = n1 * n2 / 2.0
+    sigma_sq = n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1)))
+    if sigma_sq <= 0:
+        return u, 1.0
+    z = (abs(u1 - mu) - 0.5) / math.sqrt(sigma_sq)
+    p = math.erfc(max(z, 0) / math.sqrt(2))
+    return u, min(p, 1.0)
+
+def change_points(l, min_size=5, penalty=None):
+    # Finds the indices where the mean of the series shifts, using binary
+    # segmentation with a BIC-style penalty.  Segments shorter than min_size
+    # aren't considered, so that isolated spikes (ex a gc) aren't picked up.
+    n = len(l)
+    if n < 2 * min_size:
+        return []
+
+    s1 = [0.0]
+    s2 = [0.0]
+    for x in l:
+        s1.append(s1[-1] + x)
+        s2.append(s2[-1] + x * x)
+
+    def cost(i, j):
+        # Sum of squared deviations from the mean of l[i:j]
+        return (s2[j] - s2[i]) - (s1[j] - s1[i]) ** 2 / (j - i)
+
+    if penalty is None:
+        # Estimate the noise level from the differences between adjacent
+        # points, which is robust to the level shifts we are looking for:
+        sigma = 1.4826 * mad([l[i + 1] - l[i] for i in xrange(n - 1)]) / math.sqrt(2)
+        if sigma == 0:
+            sigma = 1e-3 * abs(median(l)) or 1e-9
+        penalty = 2 * sigma ** 2 * math.log(n)
+
+    rtn = []
+    def split(i, j):
+        if j - i < 2 * min_size:
+            return
+        total = cost(i, j)
+        best_gain, best_k = max((total - cost(i, k) - cost(k, j), k) for k in xrange(i + min_size, j - min_size + 1))
+        if best_gain <= penalty:
+            return
+        split(i, best_k)
+        rtn.append(best_k)
+        split(best_k, j)
+    split(0, n)
+    return rtn
+
+def parse_percentage(s):
+    # Accepts either "1%" or "0.01"
+    if s.endswith('%'):
+        return float(s[:-1]) / 100.0
+    return float(s)
@@ -0,0 +1,109 @@
+import BaseHTTPServer
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urlparse
+
+import codespeed_submit
+
+# A stand-in for codespeed's result/add/json/ endpoint: accepts batches
+# unless it is told to fail, or one of the results has a negative value
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        batch = json.loads(urlparse.parse_qs(body)["json"][0])
+        server = self.server
+        if server.fail_code:
+            code = server.fail_code
+        elif any(r["result_value"] < 0 for r in batch):
+            code = 400
+        else:
+            code = 202
+            server.accepted += batch
+        self.send_response(code)
+        self.end_headers()
+        self.wfile.write("ok" if code == 202 else "error")
+
+    def log_message(self, *args):
+        pass
+
+class FlushSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.fail_code = None
+        self.server.accepted = []
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+        self.old_url = codespeed_submit.CODESPEED_URL
+        self.old_spool_dir = codespeed_submit.SPOOL_DIR
+        codespeed_submit.CODESPEED_URL = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        codespeed_submit.SPOOL_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(codespeed_submit.SPOOL_DIR)
+        codespeed_submit.CODESPEED_URL = self.old_url
+        codespeed_submit.SPOOL_DIR = self.old_spool_dir
+
+    def spool(self, *values):
+        for v in values:
+            codespeed_submit._spool(codespeed_submit._formdata("abc", "bench", "pyston", v))
+
+    def rejected(self):
+        d = os.path.join(codespeed_submit.SPOOL_DIR, codespeed_submit.REJECTED_DIR)
+        return os.listdir(d) if os.path.exists(d) else []
+
+    def test_accepted(self):
+        self.spool(1.0, 2.0, 3.0)
+        self.assertTrue(codespeed_submit.flush_spool(max_attempts=1))
+        self.assertEqual([r["result_value"] for r in self.server.accepted], [1.0, 2.0, 3.0])
+        self.assertEqual(codespeed_submit._spooled_files(), [])
+        self.assertEqual(self.rejected(), [])
+
+    def test_rejected(self):
+        self.spool(1.0, -1.0, 2.0)
+        self.assertTrue(codespeed_submit.flush_spool(max_attempts=1))
+        self.assertEqual([r["result_value"] for r in self.server.accepted], [1.0, 2.0])
+        self.assertEqual(codespeed_submit._spooled_files(), [])
+        self.assertEqual(len(self.rejected()), 1)
+
+        # The rejected result doesn't hold up later flushes:
+        self.spool(3.0)
+        self.assertTrue(codespeed_submit.flush_spool(max_attempts=1))
+        self.assertEqual([r["result_value"] for r in self.server.accepted], [1.0, 2.0, 3.0])
+
+    def test_already_removed(self):
+        # Another flush took the files out from under us while we were
+        # submitting them:
+        self.spool(1.0, 2.0)
+        old_post_batch = codespeed_submit._post_batch
+        def post_batch(batch):
+            for fn in codespeed_submit._spooled_files():
+                os.remove(os.path.join(codespeed_submit.SPOOL_DIR, fn))
+            return old_post_batch(batch)
+        codespeed_submit._post_batch = post_batch
+        try:
+            self.assertTrue(codespeed_submit.flush_spool(max_attempts=1))
+        finally:
+            codespeed_submit._post_batch = old_post_batch
+        self.assertEqual([r["result_value"] for r in self.server.accepted], [1.0, 2.0])
+
+    def test_server_error(self):
+        self.server.fail_code = 500
+        self.spool(1.0, 2.0)
+        self.assertFalse(codespeed_submit.flush_spool(max_attempts=1))
+        self.assertEqual(len(codespeed_submit._spooled_files()), 2)
+        self.assertEqual(self.rejected(), [])
+
+        self.server.fail_code = None
+        self.assertTrue(codespeed_submit.flush_spool(max_attempts=1))
+        self.assertEqual([r["result_value"] for r in self.server.accepted], [1.0, 2.0])
+
+if __name__ == "__main__":
+    unittest.main()
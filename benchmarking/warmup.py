@@ -0,0 +1,46 @@
+import stats
+
+# Analysis of the per-iteration latencies of a single run, to separate the
+# time spent warming up (ex in the interpreter and baseline jit tiers) from
+# the steady-state performance.
+def analyze(iteration_times):
+    n = len(iteration_times)
+    cps = stats.change_points(iteration_times, min_size=max(5, n // 50))
+    bounds = [0] + cps + [n]
+    segments = [iteration_times[bounds[i]:bounds[i + 1]] for i in xrange(len(bounds) - 1)]
+
+    # Walk backwards from the final segment, merging in segments that are at
+    # the same level (ex the ones on either side of a gc spike).  The
+    # iteration where that stops is where latency stabilized.
+    final = stats.median(segments[-1])
+    tolerance = max(3 * 1.4826 * stats.mad(segments[-1]), 0.01 * final)
+    steady_iteration = bounds[-2]
+    for i in xrange(len(segments) - 2, -1, -1):
+        if abs(stats.median(segments[i]) - final) > tolerance:
+            break
+        steady_iteration = bounds[i]
+
+    steady_time = stats.median(iteration_times[steady_iteration:])
+    return {
+        "steady_iteration": steady_iteration,
+        "time_to_steady": sum(iteration_times[:steady_iteration]),
+        "warmup_overhead": sum(iteration_times[:steady_iteration]) - steady_iteration * steady_time,
+        "steady_iteration_time": steady_time,
+        "steady_throughput": 1.0 / steady_time if steady_time else 0.0,
+        "num_change_points": len(cps),
+    }
+
+def format_summary(analysis):
+    return "[steady after iter %d (%.2fs, %.2fs overhead), %.1fms/iter]" % (analysis["steady_iteration"],
+            analysis["time_to_steady"], analysis["warmup_overhead"], analysis["steady_iteration_time"] * 1000.0)
+
+def format_curve(iteration_times):
+    # Shows the latency at exponentially-spaced iterations
+    points = []
+    i = 1
+    while i <= len(iteration_times):
+        points.append("%d: %.1fms" % (i, iteration_times[i - 1] * 1000.0))
+        i *= 2
+    if i // 2 != len(iteration_times):
+        points.append("%d: %.1fms" % (len(iteration_times), iteration_times[-1] * 1000.0))
+    return "    " + ", ".join(points)